@@ -0,0 +1,328 @@
+"""
+Бенчмарк пропускной способности пайплайна без GPU и весов моделей.
+
+Генерирует синтетический корпус (benchmarks/synthetic.py), прогоняет отдельные
+этапы и весь пайплайн с заглушками моделей (benchmarks/stubs.py) и пишет JSON:
+время, страниц/с, сегментов/с и пиковый RSS для каждого случая.
+Каждый случай идёт в отдельном процессе, поэтому пиковый RSS не смешивается.
+
+    python -m benchmarks.run --docs 2 --pages 3 --segments 12 --output bench.json
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.15
+
+С --baseline код возврата 1, если какой-то случай медленнее (или тяжелее по памяти)
+базового больше чем на tolerance.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import KINDS, generate_corpus, make_segment
+
+# Метрики, которые должны не падать / не расти
+THROUGHPUT_METRICS = ("pages_per_s", "segments_per_s")
+MEMORY_METRICS = ("peak_rss_mb",)
+
+
+def _paths(manifest, *kinds):
+    return [item for item in manifest if item["kind"] in kinds]
+
+
+# --- Случаи ---
+# Каждый случай: setup(manifest, params) -> state (не входит во время), run(state) -> (pages, segments)
+
+def setup_pdf_extract(manifest, params):
+    return _paths(manifest, "text_pdf", "scan_pdf")
+
+
+def run_pdf_extract(items):
+    from module.pdf_utils import PdfDocument, PAGE_TEXT
+    pages = segments = 0
+    for item in items:
+        pdf = PdfDocument(item["path"])
+        for page_num, kind in enumerate(pdf.page_kinds()):
+            if kind == PAGE_TEXT:
+                segments += len(pdf.page_text_and_bboxes(page_num)[0])
+        pages += pdf.page_count
+    return pages, segments
+
+
+def setup_filter_boxes(manifest, params):
+    rng = random.Random(params["seed"])
+    pages = []
+    for _ in range(sum(item["pages"] for item in manifest)):
+        boxes = []
+        for _ in range(params["boxes"]):
+            x, y = rng.uniform(0, 2000), rng.uniform(0, 3000)
+            boxes.append([x, y, x + rng.uniform(5, 600), y + rng.uniform(5, 200)])
+        pages.append((boxes, ["Текст"] * len(boxes)))
+    return pages
+
+
+def run_filter_boxes(pages):
+    from module.helper import filter_contained_boxes
+    segments = 0
+    for boxes, labels in pages:
+        filter_contained_boxes(boxes, labels)
+        segments += len(boxes)
+    return len(pages), segments
+
+
+def setup_anonymize(manifest, params):
+    from module.anonymize import load_ner_models
+    # Загрузка Natasha не входит во время
+    load_ner_models()
+    rng = random.Random(params["seed"])
+    pages = sum(item["pages"] for item in manifest)
+    return pages, [make_segment(rng) for _ in range(pages * params["segments"])]
+
+
+def run_anonymize(state):
+    from module.anonymize import anonymize_texts
+    pages, texts = state
+    anonymize_texts(texts)
+    return pages, len(texts)
+
+
+def setup_doc_reader(manifest, params):
+    return _paths(manifest, "docx", "rtf")
+
+
+def run_doc_reader(items):
+    from module.doc_reader import extract_document_data
+    segments = 0
+    for item in items:
+        segments += len(extract_document_data(item["path"])["texts"])
+    return sum(item["pages"] for item in items), segments
+
+
+def setup_pdf_gen(manifest, params):
+    from module.pdf_utils import PdfDocument
+    output_dir = tempfile.mkdtemp(prefix="bench_pdf_gen_")
+    docs = []
+    for i, item in enumerate(_paths(manifest, "text_pdf")):
+        pdf = PdfDocument(item["path"])
+        page_texts, page_bboxes = pdf.extract_all_pages_text_and_bboxes()
+        texts = [text for page in page_texts for text in page]
+        bboxes = [bbox for page in page_bboxes for bbox in page]
+        docs.append({
+            "texts": texts,
+            "bboxes": bboxes,
+            "labels": ["Текст"] * len(texts),
+            "page_size": pdf.page_size(0),
+            "pages": pdf.page_count,
+            "output": os.path.join(output_dir, f"out_{i}.pdf"),
+        })
+    return docs
+
+
+def run_pdf_gen(docs):
+    from reportlab.lib.pagesizes import A4
+    from module.pdf_gen import generate_pdf_from_layout_data
+    for data in docs:
+        generate_pdf_from_layout_data(
+            texts_list=data["texts"],
+            bboxes_list=data["bboxes"],
+            label_ids_list=data["labels"],
+            original_page_size=data["page_size"],
+            output_pdf_filename=data["output"],
+            target_pdf_pagesize=A4,
+        )
+    return sum(data["pages"] for data in docs), sum(len(data["texts"]) for data in docs)
+
+
+def setup_end_to_end(manifest, params):
+    return manifest, tempfile.mkdtemp(prefix="bench_e2e_")
+
+
+def run_end_to_end(state):
+    from benchmarks.stubs import STUB_COSTS, stub_factories
+    from main import run_batch
+    from module.models import ModelManager
+    manifest, output_dir = state
+    manager = ModelManager(stub_factories(), STUB_COSTS)
+    docs = run_batch([item["path"] for item in manifest], output_dir, manager=manager, checkpoints=None)
+    return sum(item["pages"] for item in manifest), sum(len(data["texts"]) for data in docs)
+
+
+CASES = {
+    "pdf_extract": (setup_pdf_extract, run_pdf_extract),
+    "filter_boxes": (setup_filter_boxes, run_filter_boxes),
+    "anonymize": (setup_anonymize, run_anonymize),
+    "doc_reader": (setup_doc_reader, run_doc_reader),
+    "pdf_gen": (setup_pdf_gen, run_pdf_gen),
+    "end_to_end": (setup_end_to_end, run_end_to_end),
+}
+
+
+def _case_worker(name, manifest, params, conn):
+    if not params["verbose"]:
+        # Логи пайплайна ниже ERROR глушатся, stdout (в том числе дочерних процессов) уходит в devnull:
+        # в выводе остаётся только отчёт бенчмарка. --verbose показывает всё
+        logging.disable(logging.WARNING)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+    try:
+        setup, run = CASES[name]
+        state = setup(manifest, params)
+        start = time.perf_counter()
+        pages, segments = run(state)
+        seconds = time.perf_counter() - start
+        # ru_maxrss в Linux - килобайты
+        self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        conn.send({
+            "seconds": seconds,
+            "pages": pages,
+            "segments": segments,
+            "pages_per_s": pages / seconds if seconds else 0.0,
+            "segments_per_s": segments / seconds if seconds else 0.0,
+            "peak_rss_mb": self_rss,
+            "peak_children_rss_mb": children_rss,
+        })
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_case(name, manifest, params):
+    """
+    Запускает случай в свежем процессе (spawn) и возвращает его метрики.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_case_worker, args=(name, manifest, params, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {"error": f"процесс завершился с кодом {process.exitcode}"}
+    process.join()
+    return result
+
+
+def run_benchmarks(cases, manifest, params, repeat=1):
+    """
+    Лучший (самый быстрый) из repeat прогонов каждого случая; пиковый RSS - максимум.
+    """
+    results = {}
+    for name in cases:
+        runs = [run_case(name, manifest, params) for _ in range(repeat)]
+        errors = [run["error"] for run in runs if "error" in run]
+        if errors:
+            results[name] = {"error": errors[0]}
+            continue
+        best = dict(min(runs, key=lambda run: run["seconds"]))
+        for metric in ("peak_rss_mb", "peak_children_rss_mb"):
+            best[metric] = max(run[metric] for run in runs)
+        results[name] = best
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Список регрессий относительно baseline (словарь results из прошлого отчёта).
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base or "error" in base:
+            continue
+        if "error" in current:
+            regressions.append(f"{name}: ошибка {current['error']}")
+            continue
+        for metric in THROUGHPUT_METRICS:
+            if base.get(metric) and current[metric] < base[metric] * (1 - tolerance):
+                regressions.append(f"{name}.{metric}: {current[metric]:.1f} < {base[metric]:.1f}")
+        for metric in MEMORY_METRICS:
+            if base.get(metric) and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {current[metric]:.1f} > {base[metric]:.1f}")
+    return regressions
+
+
+def print_table(results, baseline=None):
+    print(f"{'case':<14}{'seconds':>10}{'pages/s':>12}{'segments/s':>14}{'rss MB':>10}")
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<14}  ОШИБКА: {result['error']}")
+            continue
+        line = (f"{name:<14}{result['seconds']:>10.3f}{result['pages_per_s']:>12.1f}"
+                f"{result['segments_per_s']:>14.1f}{result['peak_rss_mb']:>10.1f}")
+        base = (baseline or {}).get(name)
+        if base and base.get("segments_per_s"):
+            line += f"  ({result['segments_per_s'] / base['segments_per_s'] - 1:+.1%} к базовому)"
+        print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк пайплайна с заглушками моделей")
+    parser.add_argument("--docs", type=int, default=2, help="документов каждого вида")
+    parser.add_argument("--pages", type=int, default=3, help="страниц в документе")
+    parser.add_argument("--segments", type=int, default=12, help="сегментов на странице")
+    parser.add_argument("--boxes", type=int, default=300, help="bbox'ов на странице для filter_boxes")
+    parser.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="куда писать синтетический корпус (по умолчанию временная папка)")
+    parser.add_argument("--output", help="JSON-отчёт")
+    parser.add_argument("--baseline", help="JSON-отчёт для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить отчёт как базовый")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--verbose", action="store_true", help="не глушить вывод пайплайна")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_corpus_")
+    manifest = generate_corpus(workdir, docs=args.docs, pages=args.pages, segments=args.segments,
+                               kinds=args.kinds, seed=args.seed)
+    params = {"seed": args.seed, "segments": args.segments, "boxes": args.boxes, "verbose": args.verbose}
+
+    results = run_benchmarks(args.cases, manifest, params, repeat=args.repeat)
+    report = {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "corpus": {"docs": args.docs, "pages": args.pages, "segments": args.segments,
+                       "kinds": args.kinds, "seed": args.seed},
+        },
+        "results": results,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    exit_code = 1 if any("error" in result for result in results.values()) else 0
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ: {regression}")
+        if regressions:
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
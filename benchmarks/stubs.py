@@ -0,0 +1,111 @@
+"""
+Детерминированные заглушки Layout, OCR и GENERATE_TEXT для бенчмарков на CPU.
+
+Интерфейс тот же, что у настоящих моделей, поэтому пайплайн и ModelManager
+работают с ними без изменений. seconds_per_* - искусственная задержка,
+чтобы моделировать время GPU (по умолчанию 0: меряется только CPU-обвязка).
+"""
+import hashlib
+import time
+
+from module.config import id2label
+from module.llm_plan import plan_generation
+
+STUB_LABELS = [id2label["7"], id2label["9"], id2label["9"], id2label["3"], id2label["9"], id2label["4"]]
+
+
+class StubLayout:
+    """
+    Делит страницу на rows горизонтальных полос, метки идут по кругу из STUB_LABELS.
+    """
+    def __init__(self, rows=12, seconds_per_page=0.0):
+        self.rows = rows
+        self.seconds_per_page = seconds_per_page
+
+    def detect_layout(self, img, threshold=0.5):
+        return self.detect_layout_batch([img], threshold=threshold)[0]
+
+    def detect_layout_batch(self, images, batch_size=8, threshold=0.5):
+        if self.seconds_per_page:
+            time.sleep(self.seconds_per_page * len(images))
+        results = []
+        for img in images:
+            width, height = img.size
+            step = height / (self.rows + 1)
+            bboxes = [[width * 0.05, step * (i + 0.5), width * 0.95, step * (i + 1.4)] for i in range(self.rows)]
+            labels = [STUB_LABELS[i % len(STUB_LABELS)] for i in range(self.rows)]
+            results.append((bboxes, labels))
+        return results
+
+    def unload(self):
+        pass
+
+
+class StubOCR:
+    """
+    Текст кропа выбирается по хэшу его пикселей из фиксированного списка фраз.
+    """
+    PHRASES = [
+        "Иван Петров проживает в Москве, телефон +7 (912) 345-67-89.",
+        "Договор заключён между ООО «Ромашка» и Марией Смирновой.",
+        "Отчёт подготовлен отделом кадров по итогам квартала.",
+        "Для связи: user42@example.ru, Алексей Кузнецов, 35 лет.",
+    ]
+
+    def __init__(self, seconds_per_crop=0.0):
+        self.seconds_per_crop = seconds_per_crop
+
+    def ocr(self, img):
+        return self.ocr_batch([img])[0]
+
+    def ocr_batch(self, crops, labels=None, batch_size=16):
+        if self.seconds_per_crop:
+            time.sleep(self.seconds_per_crop * len(crops))
+        texts = []
+        for crop in crops:
+            digest = hashlib.md5(crop.tobytes()).digest()
+            texts.append(self.PHRASES[digest[0] % len(self.PHRASES)])
+        return texts
+
+    def unload(self):
+        pass
+
+
+class StubLLM:
+    """
+    "Перефразирует" переворотом порядка слов в каждой строке; плейсхолдеры остаются на месте
+    как слова, переводы строк (строки таблиц) сохраняются.
+    generate_corpus использует тот же планировщик, что и GENERATE_TEXT.
+    """
+    def __init__(self, seconds_per_segment=0.0):
+        self.seconds_per_segment = seconds_per_segment
+        self.last_plan_stats = None
+
+    def generate_text(self, texts):
+        texts = list(texts)
+        if self.seconds_per_segment:
+            time.sleep(self.seconds_per_segment * len(texts))
+        return ["\n".join(" ".join(reversed(line.split())) for line in text.split("\n")) for text in texts]
+
+    def generate_corpus(self, documents_texts):
+        plan = plan_generation(documents_texts)
+        generated = self.generate_text(plan.unique_texts) if plan.unique_texts else []
+        self.last_plan_stats = plan.stats
+        return plan.apply(generated)
+
+    def unload(self):
+        pass
+
+
+def stub_factories(layout_seconds=0.0, ocr_seconds=0.0, llm_seconds=0.0):
+    """
+    Фабрики для ModelManager(factories=..., costs=STUB_COSTS).
+    """
+    return {
+        "layout": lambda: StubLayout(seconds_per_page=layout_seconds),
+        "ocr": lambda: StubOCR(seconds_per_crop=ocr_seconds),
+        "llm": lambda: StubLLM(seconds_per_segment=llm_seconds),
+    }
+
+
+STUB_COSTS = {"layout": 0.0, "ocr": 0.0, "llm": 0.0}
@@ -0,0 +1,162 @@
+"""
+Синтетический корпус для бенчмарков: текстовые PDF, PDF-сканы, PNG, DOCX и RTF.
+
+Тексты детерминированы (random.Random(seed)) и похожи на настоящие:
+имена, телефоны, почта и возраст, чтобы анонимизатору было что заменять.
+"""
+import os
+import random
+
+import docx
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+KINDS = ("text_pdf", "scan_pdf", "png", "docx", "rtf")
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DejaVuSans.ttf")
+FONT_NAME = "BenchDejaVuSans"
+# Разрешение, с которым "сканируются" страницы сканов и PNG
+SCAN_DPI = 100
+
+NAMES = ["Иван Петров", "Мария Смирнова", "Алексей Кузнецов", "Ольга Иванова", "Дмитрий Соколов"]
+CITIES = ["Москве", "Санкт-Петербурге", "Казани", "Новосибирске", "Екатеринбурге"]
+COMPANIES = ["ООО «Ромашка»", "АО «Вектор»", "ПАО «Северсталь»", "ИП Сидоров"]
+TEMPLATES = [
+    "{name} проживает в {city} и работает в {company} уже {age} лет.",
+    "Для связи с {name} используйте телефон {phone} или почту {email}.",
+    "Договор между {company} и {name} заключён в {city} сроком на {age} года.",
+    "Ответственный сотрудник {name}, {age} лет, телефон {phone}.",
+    "Отчёт подготовлен отделом {company} по итогам работы филиала в {city}.",
+]
+
+
+def make_sentence(rng):
+    name = rng.choice(NAMES)
+    return rng.choice(TEMPLATES).format(
+        name=name,
+        city=rng.choice(CITIES),
+        company=rng.choice(COMPANIES),
+        age=rng.randint(18, 70),
+        phone=f"+7 (9{rng.randint(10, 99)}) {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}",
+        email=f"user{rng.randint(1, 999)}@example.ru",
+    )
+
+
+def make_segment(rng, sentences=(1, 3)):
+    return " ".join(make_sentence(rng) for _ in range(rng.randint(*sentences)))
+
+
+def _register_font():
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return FONT_NAME
+    if os.path.exists(FONT_PATH):
+        pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+        return FONT_NAME
+    return "Helvetica"
+
+
+def _image_font(size):
+    if os.path.exists(FONT_PATH):
+        return ImageFont.truetype(FONT_PATH, size)
+    return ImageFont.load_default()
+
+
+def page_lines(rng, segments):
+    return [make_segment(rng, (1, 1)) for _ in range(segments)]
+
+
+def write_text_pdf(path, rng, pages, segments):
+    font = _register_font()
+    c = canvas.Canvas(path, pagesize=A4)
+    width, height = A4
+    step = (height - 100) / max(segments, 1)
+    for _ in range(pages):
+        c.setFont(font, 9)
+        for i, line in enumerate(page_lines(rng, segments)):
+            c.drawString(40, height - 50 - i * step, line)
+        c.showPage()
+    c.save()
+
+
+def render_page_image(rng, segments, dpi=SCAN_DPI):
+    """
+    Страница A4 "скан": белый фон и строки текста картинкой.
+    """
+    scale = dpi / 72
+    width, height = int(A4[0] * scale), int(A4[1] * scale)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    font = _image_font(max(8, int(9 * scale)))
+    step = (height - 100 * scale) / max(segments, 1)
+    for i, line in enumerate(page_lines(rng, segments)):
+        draw.text((40 * scale, 50 * scale + i * step), line, fill="black", font=font)
+    return img
+
+
+def write_scan_pdf(path, rng, pages, segments):
+    c = canvas.Canvas(path, pagesize=A4)
+    for _ in range(pages):
+        c.drawImage(ImageReader(render_page_image(rng, segments)), 0, 0, *A4)
+        c.showPage()
+    c.save()
+
+
+def write_png(path, rng, pages, segments):
+    # Картинка - всегда одна страница
+    render_page_image(rng, segments).save(path)
+
+
+def write_docx(path, rng, pages, segments):
+    document = docx.Document()
+    document.sections[0].header.paragraphs[0].text = "Конфиденциально"
+    document.sections[0].footer.paragraphs[0].text = f"Составил {rng.choice(NAMES)}"
+    for page in range(pages):
+        document.add_heading(f"Раздел {page + 1}", level=1 if page == 0 else 2)
+        for _ in range(segments - 1):
+            document.add_paragraph(make_segment(rng))
+    table = document.add_table(rows=2, cols=2)
+    for cell in table._cells:
+        cell.text = rng.choice(NAMES)
+    document.save(path)
+
+
+def _rtf_escape(text):
+    return "".join(ch if ord(ch) < 128 else f"\\u{ord(ch) if ord(ch) < 32768 else ord(ch) - 65536}?" for ch in text)
+
+
+def write_rtf(path, rng, pages, segments):
+    lines = [_rtf_escape(make_segment(rng)) for _ in range(pages * segments)]
+    body = "\\par\n".join(lines)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{\\rtf1\\ansi\\deff0{\\fonttbl{\\f0 Times New Roman;}}\n" + body + "\\par\n}")
+
+
+WRITERS = {
+    "text_pdf": (write_text_pdf, ".pdf"),
+    "scan_pdf": (write_scan_pdf, ".pdf"),
+    "png": (write_png, ".png"),
+    "docx": (write_docx, ".docx"),
+    "rtf": (write_rtf, ".rtf"),
+}
+
+
+def generate_corpus(output_dir, docs=2, pages=3, segments=12, kinds=KINDS, seed=0):
+    """
+    Создаёт docs файлов каждого вида из kinds в output_dir.
+    Возвращает манифест: список {path, kind, pages, segments} (оценка числа сегментов).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    manifest = []
+    for kind in kinds:
+        writer, extension = WRITERS[kind]
+        for i in range(docs):
+            path = os.path.join(output_dir, f"{kind}_{i:03d}{extension}")
+            writer(path, rng, pages, segments)
+            doc_pages = 1 if kind == "png" else pages
+            manifest.append({"path": path, "kind": kind, "pages": doc_pages, "segments": doc_pages * segments})
+    return manifest
@@ -1,261 +1,191 @@
-from module.layout import Layout
-from module.ocr import OCR
-from module.llm import GENERATE_TEXT  
-from module.pdf_gen import generate_pdf_from_layout_data
-from module.config import anonymize_text_tokens
-from module.helper import filter_contained_boxes
-from module.anonymize import anonymize_text
-from reportlab.lib.pagesizes import A4
-from PIL import Image
-import os
-import gc 
-import torch
-from module.doc_reader import extract_document_data, put_to_docx
-from module.pdf_utils import (
-    check_scanned_pdf, 
-    get_pdf_pages_count, 
-    get_pdf_page_size, 
-    get_pdf_page_text_and_bboxes, 
-    extract_all_pdf_pages_text_and_bboxes,
-    create_pdf_from_text_and_bboxes
+import logging
+from contextlib import ExitStack
+
+from module.anonymize import ParallelAnonymizer
+from module.rasterize import Rasterizer
+from module.page_render import PageRenderer
+from module.models import ModelManager
+from module.checkpoint import CheckpointStore
+from module.metrics import Metrics, DISABLED, setup_logging
+from module.config import (
+    DATA_PATH, OUTPUT_DIR, PIPELINE_MODE, PIPELINE_WINDOW, PIPELINE_SHARD_SIZE, PIPELINE_FALLBACK_SHARD_SIZE,
+    CHECKPOINT_PATH,
+)
+from module.pipeline import (
+    list_documents,
+    open_document,
+    pending,
+    save_checkpoints,
+    load_document,
+    needs_ocr,
+    ocr_document,
+    restore_images,
+    release_images,
+    anonymize_documents,
+    rephrase_documents,
+    write_documents,
+    stream_documents,
+    document_pages,
 )
-import fitz  # PyMuPDF for converting PDF pages to images
 
-def main():
-    data_path = '/home/ubuntu/alan/test_lm/data'
-    layout = Layout()
+logger = logging.getLogger(__name__)
+
+
+def iter_shards(file_paths, shard_size=PIPELINE_SHARD_SIZE):
+    if not shard_size:
+        yield list(file_paths)
+        return
+    for start in range(0, len(file_paths), shard_size):
+        yield file_paths[start:start + shard_size]
+
+
+def open_checkpoints(enabled=True):
+    if enabled and CHECKPOINT_PATH:
+        return CheckpointStore(CHECKPOINT_PATH)
+    return None
+
+
+def run_batch(file_paths, output_dir=OUTPUT_DIR, manager=None, shard_size=PIPELINE_SHARD_SIZE, checkpoints=None,
+              metrics=None, anonymizer=None, rasterizer=None, renderer=None):
+    """
+    Каждый этап прогоняется по пачке документов. Модели берутся у ModelManager:
+    если все влезают в бюджет памяти, они грузятся один раз на весь запуск,
+    иначе менеджер выгружает давно не использованные перед загрузкой следующей.
+
+    С checkpoints (CheckpointStore) этапы, уже сделанные в прошлом запуске,
+    пропускаются, и модель, которой нечего делать, не загружается.
+    metrics (Metrics) получает время каждого этапа по каждому документу.
+    Переданные manager, anonymizer, rasterizer и renderer не закрываются (их пулы и модели
+    переживают вызов), недостающие создаются на время вызова.
+    """
+    metrics = metrics if metrics is not None else DISABLED
+    own_manager = manager is None
+    if own_manager:
+        manager = ModelManager(metrics=metrics)
     data_list = []
-    
-    # Process files in data directory
-    for file in os.listdir(data_path):
-        file_path = os.path.join(data_path, file)
-        data_list.append(dict())
-        data_list[-1]['file'] = file
+    try:
+        with ExitStack() as stack:
+            if anonymizer is None:
+                anonymizer = stack.enter_context(ParallelAnonymizer())
+            if rasterizer is None:
+                rasterizer = stack.enter_context(Rasterizer())
+            if renderer is None:
+                renderer = stack.enter_context(PageRenderer())
+            for shard in iter_shards(file_paths, shard_size):
+                shard_data = [open_document(file_path, checkpoints, output_dir) for file_path in shard]
 
-        # Handle different file types
-        if file.endswith('.pdf'):
-            # Process PDF files
-            is_scanned = check_scanned_pdf(file_path)
-            
-            if is_scanned:
-                # Process scanned PDF as images
-                print(f"Processing scanned PDF: {file}")
-                
-                # Create a list to store data for each page
-                pdf_pages_data = []
-                
-                # Open PDF with PyMuPDF
-                pdf_doc = fitz.open(file_path)
-                num_pages = len(pdf_doc)
-                
-                for page_num in range(num_pages):
-                    # Convert PDF page to image
-                    page = pdf_doc.load_page(page_num)
-                    pix = page.get_pixmap(matrix=fitz.Matrix(300/72, 300/72))  # 300 DPI
-                    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                    
-                    # Process image with layout detection
-                    bboxes, labels = layout.detect_layout(img)
-                    bboxes, labels = filter_contained_boxes(bboxes, labels)
-                    
-                    # Store page data
-                    pdf_pages_data.append({
-                        'page_num': page_num,
-                        'img': img,
-                        'bboxes': bboxes,
-                        'labels': labels
-                    })
-                
-                # Close PDF document
-                pdf_doc.close()
-                
-                # Add all pages data to the main data list
-                data_list[-1]['pdf_pages'] = pdf_pages_data
-                data_list[-1]['is_scanned_pdf'] = True
-                data_list[-1]['pdf_page_count'] = num_pages
-                
-            else:
-                # Process regular PDF with text extraction
-                print(f"Processing regular PDF with text extraction: {file}")
-                
-                # Get PDF information
-                page_count = get_pdf_pages_count(file_path)
-                page_size = get_pdf_page_size(file_path)
-                
-                # Extract text and bounding boxes from all pages
-                all_texts, all_bboxes = extract_all_pdf_pages_text_and_bboxes(file_path)
-                
-                # Prepare text and bbox lists for all pages combined
-                combined_texts = []
-                combined_bboxes = []
-                combined_labels = []
-                
-                # Process each page's data
-                for page_num, (page_texts, page_bboxes) in enumerate(zip(all_texts, all_bboxes)):
-                    # Skip empty pages
-                    if not page_texts:
-                        continue
-                        
-                    # Default label (assuming text paragraphs as default)
-                    default_label = "1"  # Assuming "1" corresponds to regular text in your label system
-                    page_labels = [default_label] * len(page_texts)
-                    
-                    # Add page data to combined lists
-                    combined_texts.extend(page_texts)
-                    combined_bboxes.extend(page_bboxes)
-                    combined_labels.extend(page_labels)
-                
-                # Store extracted data
-                data_list[-1]['texts'] = combined_texts
-                data_list[-1]['bboxes'] = combined_bboxes
-                data_list[-1]['labels'] = combined_labels
-                data_list[-1]['is_scanned_pdf'] = False
-                data_list[-1]['pdf_page_count'] = page_count
-                data_list[-1]['pdf_page_size'] = page_size
-                
-                # Skip OCR for regular PDFs with text
-                continue
-                
-        elif file.endswith('.docx') or file.endswith('.rtf'):
-            # Skip DOCX/RTF processing here - will be handled below
-            continue
-        else:
-            # Process image files
-            img = Image.open(file_path).convert("RGB")
-            bboxes, labels = layout.detect_layout(img)
-            bboxes, labels = filter_contained_boxes(bboxes, labels)
+                todo = pending(shard_data, "layout")
+                if todo:
+                    layout = manager.get("layout")
+                    for data in todo:
+                        with metrics.stage("layout", document=data['file']) as record:
+                            data.update(load_document(data['path'], layout, rasterizer))
+                            record["items"] = document_pages(data)
+                    save_checkpoints(todo, "layout", checkpoints)
 
-            data_list[-1]['bboxes'] = bboxes
-            data_list[-1]['labels'] = labels
-            data_list[-1]['img'] = img
-    
-    # Release layout model resources
-    layout.model.to("cpu")
-    layout.model = None
-    gc.collect()
-    torch.cuda.empty_cache()
+                # OCR processing
+                todo = pending(shard_data, "ocr")
+                if todo:
+                    ocr = manager.get("ocr") if any(needs_ocr(data) for data in todo) else None
+                    for data in todo:
+                        with metrics.stage("ocr", document=data['file']) as record:
+                            # Картинки не из чекпоинта рендерятся по одному документу и сразу освобождаются
+                            restore_images(data, rasterizer)
+                            ocr_document(data, ocr)
+                            record["items"] = len(data['texts'])
+                        release_images(data)
+                    save_checkpoints(todo, "ocr", checkpoints)
 
-    # OCR processing
-    ocr = OCR()
-    for data in data_list:
-        file = data['file']
-        
-        if file.endswith('.docx') or file.endswith('.rtf'):
-            continue
-            
-        if file.endswith('.pdf') and not data.get('is_scanned_pdf', False):
-            continue  # Skip OCR for non-scanned PDFs
-            
-        if file.endswith('.pdf') and data.get('is_scanned_pdf', True):
-            # Process each page of scanned PDF with OCR
-            pdf_pages = data['pdf_pages']
-            
-            all_texts = []
-            all_bboxes = []
-            all_labels = []
-            
-            for page_data in pdf_pages:
-                img = page_data['img']
-                bboxes = page_data['bboxes']
-                labels = page_data['labels']
-                
-                # OCR for each text region
-                page_texts = []
-                for i in range(len(bboxes)):
-                    page_texts.append(ocr.ocr(img.crop(bboxes[i])))
-                
-                # Add page data to combined lists
-                all_texts.extend(page_texts)
-                all_bboxes.extend(bboxes)
-                all_labels.extend(labels)
-            
-            # Store combined data for all pages
-            data['texts'] = all_texts
-            data['bboxes'] = all_bboxes
-            data['labels'] = all_labels
-        else:
-            # Regular image processing with OCR
-            img = data['img']
-            bboxes = data['bboxes']
-            labels = data['labels']
+                # Anonymize text
+                todo = pending(shard_data, "anonymize")
+                if todo:
+                    with metrics.stage("anonymize", items=sum(len(data['texts']) for data in todo)):
+                        anonymize_documents(todo, anonymizer)
+                    save_checkpoints(todo, "anonymize", checkpoints)
 
-            texts = []
-            for i in range(len(bboxes)):   
-                texts.append(ocr.ocr(img.crop(bboxes[i])))
-            data['texts'] = texts
-    
-    # Release OCR model resources
-    ocr.model.to("cpu")
-    ocr.model = None
-    gc.collect()
-    torch.cuda.empty_cache()
-    
-    # Process DOCX/RTF files
-    for data in data_list:
-        file = data['file']
-        if file.endswith('.docx') or file.endswith('.rtf'):
-            data_doc = extract_document_data(os.path.join(data_path, file))
-            data['texts'] = data_doc['texts']
-            data['labels'] = data_doc['labels']
-            data['bboxes'] = data_doc['bboxes']
+                # Generate rephrased text using LLM
+                # Сегменты всей пачки идут в vLLM одним потоком
+                todo = pending(shard_data, "rephrase")
+                if todo:
+                    llm = manager.get("llm")
+                    with metrics.stage("rephrase", items=sum(len(data['anonymized_texts']) for data in todo)):
+                        rephrase_documents(todo, llm)
+                    save_checkpoints(todo, "rephrase", checkpoints)
 
-    # Anonymize text
-    for data in data_list:
-        texts = data['texts']
-        anonymized_texts = []
-        for text in texts:  
-            anonymized_texts.append(anonymize_text(text))
-        data['anonymized_texts'] = anonymized_texts
+                # Generate output files
+                # Документы пишутся в пуле renderer; упавший получает data['write_error'], остальные идут дальше
+                for data in write_documents(pending(shard_data, "write"), output_dir, renderer, metrics):
+                    if 'write_error' not in data:
+                        save_checkpoints([data], "write", checkpoints)
+                data_list.extend(shard_data)
+    finally:
+        if own_manager:
+            manager.close()
+    return data_list
 
-    # Generate rephrased text using LLM
-    llm = GENERATE_TEXT()
-    for data in data_list:
-        texts = data['texts']
-        anonymized_texts = data['anonymized_texts']
-        rephrased_texts = llm.generate_text(anonymized_texts)
-        data['rephrased_texts'] = rephrased_texts
-   
-    # Create output directories
+
+def run_streaming(file_paths, output_dir=OUTPUT_DIR, window=PIPELINE_WINDOW, manager=None, checkpoints=None,
+                  metrics=None):
+    """
+    Все модели загружены сразу, документы идут потоком и пишутся по готовности.
+    Если модели не влезают в бюджет менеджера вместе, корпус обрабатывается
+    пакетным режимом пачками (PIPELINE_SHARD_SIZE или PIPELINE_FALLBACK_SHARD_SIZE документов,
+    не меньше window): менеджер грузит модели по очереди (LRU), а в памяти только одна пачка.
+    """
+    metrics = metrics if metrics is not None else DISABLED
+    own_manager = manager is None
+    if own_manager:
+        manager = ModelManager(metrics=metrics)
+    if not manager.fits_together(["layout", "ocr", "llm"]):
+        shard_size = max(PIPELINE_SHARD_SIZE or PIPELINE_FALLBACK_SHARD_SIZE, window)
+        logger.warning("Модели не влезают в бюджет %s ГБ вместе, потоковый режим заменён пакетным "
+                       "(пачки по %d документов)", manager.budget_gb, shard_size)
+        try:
+            run_batch(file_paths, output_dir, manager=manager, shard_size=shard_size, checkpoints=checkpoints,
+                      metrics=metrics)
+        finally:
+            if own_manager:
+                manager.close()
+        return
     try:
-        os.makedirs("output")
-    except:
-        pass
+        layout = manager.get("layout")
+        ocr = manager.get("ocr")
+        llm = manager.get("llm")
+        with ParallelAnonymizer() as anonymizer, Rasterizer() as rasterizer, PageRenderer() as renderer:
+            for data in stream_documents(file_paths, layout, ocr, llm, window=window, output_dir=output_dir,
+                                         anonymizer=anonymizer, rasterizer=rasterizer, checkpoints=checkpoints,
+                                         metrics=metrics, renderer=renderer):
+                if 'write_error' not in data:
+                    logger.info("Готово: %s -> %s", data['file'], data['output_path'])
+    finally:
+        if own_manager:
+            manager.close()
+
+
+def main(data_path=DATA_PATH, mode=PIPELINE_MODE, resume=True):
+    if mode == "service":
+        # Долгоживущий HTTP-сервис с тёплыми моделями (module.service)
+        from module.service import JobService, serve
+        serve(service=JobService(checkpoints=open_checkpoints(resume)))
+        return
+    if mode not in ("streaming", "batch"):
+        raise ValueError(f"Неизвестный режим пайплайна: {mode}")
+    file_paths = list_documents(data_path)
+    checkpoints = open_checkpoints(resume)
+    metrics = Metrics()
     try:
-        os.makedirs("tmp")
-    except:
-        pass    
-    # Generate output files
-    for data in data_list:
-        file = data['file']
-        bboxes = data['bboxes']
-        labels = data['labels']
-        rephrased_texts = data['rephrased_texts']
-        
-        # Determine page size
-        if file.endswith('.pdf') and not data.get('is_scanned_pdf', False):
-            size = data.get('pdf_page_size', A4)
-        elif 'img' in data:
-            size = data['img'].size
+        if mode == "streaming":
+            run_streaming(file_paths, checkpoints=checkpoints, metrics=metrics)
         else:
-            size = A4
-            
-        # Handle DOCX files
-        if file.endswith('.docx'):
-            doc = put_to_docx(os.path.join(data_path, file), data)
-            doc.save(os.path.join("output", f"nibba_{file}"))
-            # doc.save(os.path.join("tmp", f"nibba_{file}"))
-            # convert(os.path.join("tmp", f"nibba_{file}"), os.path.join("output", f"nibba_{file}.pdf"))
-        else:    
-            # Generate PDF with rephrased text
-            generate_pdf_from_layout_data(
-                texts_list=rephrased_texts,
-                bboxes_list=bboxes,
-                label_ids_list=labels,
-                original_page_size=size,
-                output_pdf_filename=os.path.join("output", f"nibba_{file}.pdf"),
-                target_pdf_pagesize=A4,
-                debug_draw_bbox_borders=True
-            )
+            run_batch(file_paths, checkpoints=checkpoints, metrics=metrics)
+    finally:
+        metrics.close()
+        if checkpoints is not None:
+            checkpoints.close()
+    for stage, values in metrics.summary().items():
+        logger.info("%s: %d вызовов, %.1f с, %.1f элементов/с", stage, values['calls'], values['seconds'],
+                    values['items_per_s'])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    setup_logging()
+    main()
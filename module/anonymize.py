@@ -1,44 +1,70 @@
+import os
 import re
+import multiprocessing
 from natasha import (
-    Segmenter,
-    MorphVocab,
     NewsEmbedding,
-    NewsMorphTagger,
-    NewsSyntaxParser,
     NewsNERTagger,
-    Doc
+)
+from module.config import (
+    NER_BATCH_SIZE,
+    ANONYMIZE_WORKERS,
+    ANONYMIZE_CHUNK_SIZE,
+    ANONYMIZE_MIN_PARALLEL,
 )
 
-# Инициализация компонентов Natasha
-segmenter = Segmenter()
-morph_vocab = MorphVocab()
-emb = NewsEmbedding()
-morph_tagger = NewsMorphTagger(emb)
-syntax_parser = NewsSyntaxParser(emb)
-ner_tagger = NewsNERTagger(emb)
+# Компоненты Natasha грузятся лениво: в основном процессе при первом вызове,
+# в воркерах пула - один раз в инициализаторе.
+# Для замены сущностей нужен только NER: он сам токенизирует текст,
+# поэтому сегментация, морфология и синтаксис не запускаются.
+emb = None
+ner_tagger = None
+
+
+def load_ner_models():
+    global emb, ner_tagger
+    if ner_tagger is None:
+        emb = NewsEmbedding()
+        ner_tagger = NewsNERTagger(emb)
+        ner_tagger.batch_size = NER_BATCH_SIZE
+    return ner_tagger
+
+NER_REPLACEMENT_MAP = {
+    "PER": "[PERSON_NAME]",
+    "LOC": "[LOCATION]"
+}
+
+# Упрощенное регулярное выражение для номеров телефонов
+# Может потребоваться более сложное для покрытия всех форматов
+PHONE_PATTERN = re.compile(
+    r"(\+7|8)?[\s\(-]*(\d{3})[\s\)-]*(\d{3})[\s-]*(\d{2})[\s-]*(\d{2})"
+)
+EMAIL_PATTERN = re.compile(
+    r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"
+)
+# Пример: "30 лет", "25 год", "42 года"
+AGE_PATTERN = re.compile(r"\b(\d{1,3})\s+(лет|год|года)\b", re.IGNORECASE)
 
-def replace_ner_entities(text, replacement_map):
-    """
-    Заменяет извлеченные именованные сущности (PER, LOC) на заданные токены.
 
-    Args:
-        text (str): Входной текст.
-        replacement_map (dict): Словарь, где ключи - типы сущностей ('PER', 'LOC'),
-                                а значения - токены для замены.
-
-    Returns:
-        str: Текст с замененными сущностями.
+def tag_ner_batch(texts):
+    """
+    Прогоняет NER по всем текстам батчами (ner_tagger.batch_size).
+    Возвращает списки спанов в порядке texts; пустые тексты дают [].
+    """
+    spans = [[] for _ in texts]
+    indices = [i for i, text in enumerate(texts) if text.strip()]
+    markups = load_ner_models().map([texts[i] for i in indices])
+    for i, markup in zip(indices, markups):
+        spans[i] = markup.spans
+    return spans
+
+def apply_ner_replacements(text, spans, replacement_map):
+    """
+    Заменяет спаны NER, чьи типы есть в replacement_map, на токены.
     """
-    doc = Doc(text)
-    doc.segment(segmenter)
-    doc.tag_morph(morph_tagger)
-    doc.parse_syntax(syntax_parser)
-    doc.tag_ner(ner_tagger)
-
     # Чтобы корректно заменять, не нарушая индексы,
     # собираем замены и применяем их в обратном порядке
     replacements = []
-    for span in doc.spans:
+    for span in spans:
         if span.type in replacement_map:
             replacements.append({
                 "start": span.start,
@@ -56,39 +82,42 @@ def replace_ner_entities(text, replacement_map):
 
     return "".join(processed_text)
 
+def replace_ner_entities(text, replacement_map):
+    """
+    Заменяет извлеченные именованные сущности (PER, LOC) на заданные токены.
+
+    Args:
+        text (str): Входной текст.
+        replacement_map (dict): Словарь, где ключи - типы сущностей ('PER', 'LOC'),
+                                а значения - токены для замены.
+
+    Returns:
+        str: Текст с замененными сущностями.
+    """
+    return apply_ner_replacements(text, tag_ner_batch([text])[0], replacement_map)
+
 def replace_phone_numbers(text, token="[PHONE_NUMBER]"):
     """
     Заменяет номера телефонов на заданный токен.
     Это простое регулярное выражение, может потребовать доработки.
     """
-    # Упрощенное регулярное выражение для номеров телефонов
-    # Может потребоваться более сложное для покрытия всех форматов
-    phone_pattern = re.compile(
-        r"(\+7|8)?[\s\(-]*(\d{3})[\s\)-]*(\d{3})[\s-]*(\d{2})[\s-]*(\d{2})"
-    )
-    return phone_pattern.sub(token, text)
+    return PHONE_PATTERN.sub(token, text)
 
 def replace_emails(text, token="[EMAIL_ADDRESS]"):
     """
     Заменяет email адреса на заданный токен.
     """
-    email_pattern = re.compile(
-        r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"
-    )
-    return email_pattern.sub(token, text)
+    return EMAIL_PATTERN.sub(token, text)
 
 def replace_age(text, token="[AGE]"):
     """
     Заменяет упоминания возраста (число + "лет/год/года") на заданный токен.
     Это очень простое регулярное выражение и может требовать доработки.
     """
-    # Пример: "30 лет", "25 год", "42 года"
-    age_pattern = re.compile(r"\b(\d{1,3})\s+(лет|год|года)\b", re.IGNORECASE)
-
     # Чтобы избежать замены частей уже замененных токенов,
     # ищем совпадения и заменяем их, идя по тексту с конца
     matches = []
-    for match in age_pattern.finditer(text):
+    for match in AGE_PATTERN.finditer(text):
         matches.append((match.start(), match.end()))
 
     processed_text = list(text)
@@ -102,21 +131,12 @@ def replace_age(text, token="[AGE]"):
     return "".join(processed_text)
 
 
-def anonymize_text(text):
+def anonymize_regex(text):
     """
-    Комплексная функция для анонимизации текста.
+    Регулярные замены, которые идут после NER.
     """
-    # Шаг 1: Замена NER-сущностей (Имена, Локации)
-    # Важно: Сначала заменяем NER, так как регулярки могут сработать на частях имен или локаций,
-    # которые выглядят как email или телефон (хотя это маловероятно для стандартных токенов).
-    ner_replacement_map = {
-        "PER": "[PERSON_NAME]",
-        "LOC": "[LOCATION]"
-    }
-    processed_text = replace_ner_entities(text, ner_replacement_map)
-
     # Шаг 2: Замена возраста (после NER, чтобы не мешать, если имя содержит числа)
-    processed_text = replace_age(processed_text, token="[AGE]")
+    processed_text = replace_age(text, token="[AGE]")
 
     # Шаг 3: Замена email адресов
     processed_text = replace_emails(processed_text, token="[EMAIL_ADDRESS]")
@@ -125,3 +145,87 @@ def anonymize_text(text):
     processed_text = replace_phone_numbers(processed_text, token="[PHONE_NUMBER]")
 
     return processed_text
+
+
+def anonymize_texts(texts):
+    """
+    Анонимизация списка текстов: NER по всем текстам батчами, затем регулярки.
+    Результаты в порядке texts.
+    """
+    # Шаг 1: Замена NER-сущностей (Имена, Локации)
+    # Важно: Сначала заменяем NER, так как регулярки могут сработать на частях имен или локаций,
+    # которые выглядят как email или телефон (хотя это маловероятно для стандартных токенов).
+    texts = list(texts)
+    all_spans = tag_ner_batch(texts)
+    return [
+        anonymize_regex(apply_ner_replacements(text, spans, NER_REPLACEMENT_MAP))
+        for text, spans in zip(texts, all_spans)
+    ]
+
+
+def anonymize_text(text):
+    """
+    Комплексная функция для анонимизации текста.
+    """
+    return anonymize_texts([text])[0]
+
+
+# --- Параллельная анонимизация ---
+
+def _init_worker():
+    load_ner_models()
+
+
+class ParallelAnonymizer:
+    """
+    Анонимизация на пуле процессов.
+
+    Тексты режутся на чанки по chunk_size и раздаются воркерам, результаты
+    собираются в исходном порядке. Если воркер один или текстов меньше
+    min_parallel, всё считается в текущем процессе без пула.
+    Пул создаётся при первом параллельном вызове и живёт до close().
+    """
+    def __init__(self, workers=ANONYMIZE_WORKERS, chunk_size=ANONYMIZE_CHUNK_SIZE,
+                 min_parallel=ANONYMIZE_MIN_PARALLEL):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.pool = None
+
+    def _get_pool(self):
+        if self.pool is None:
+            # spawn: воркеры не наследуют CUDA-контекст и модели основного процесса
+            ctx = multiprocessing.get_context("spawn")
+            self.pool = ctx.Pool(self.workers, initializer=_init_worker)
+        return self.pool
+
+    def anonymize_texts(self, texts):
+        texts = list(texts)
+        if self.workers <= 1 or len(texts) < self.min_parallel:
+            return anonymize_texts(texts)
+
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        results = []
+        for chunk_result in self._get_pool().imap(anonymize_texts, chunks):
+            results.extend(chunk_result)
+        return results
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def anonymize_texts_parallel(texts, workers=ANONYMIZE_WORKERS):
+    """
+    Разовая параллельная анонимизация списка текстов.
+    """
+    with ParallelAnonymizer(workers=workers) as anonymizer:
+        return anonymizer.anonymize_texts(texts)
@@ -0,0 +1,130 @@
+"""
+Персистентный кэш "ключ -> строка" на SQLite с вытеснением по размеру.
+Ключи - хэши содержимого (см. make_key), поэтому кэш можно
+переиспользовать между запусками, пока входы и конфиг не меняются.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Ограничение SQLite на число параметров в одном запросе
+_SQL_CHUNK = 500
+
+
+def make_key(*parts):
+    """
+    Content-addressed ключ: sha256 от всех частей (модель, параметры, шаблон, текст, ...).
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Кэш в одном файле SQLite.
+    Когда суммарный размер значений превышает max_bytes, удаляются
+    давно не читавшиеся записи, пока размер не опустится до 90% лимита.
+    """
+    def __init__(self, path, max_bytes):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """
+        Возвращает словарь {key: value} только для найденных ключей.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        with self.lock:
+            for start in range(0, len(keys), _SQL_CHUNK):
+                chunk = keys[start:start + _SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(rows)
+                if rows:
+                    hit_keys = [row[0] for row in rows]
+                    self.conn.execute(
+                        f"UPDATE entries SET accessed = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [now, *hit_keys]
+                    )
+            self.conn.commit()
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """
+        Сохраняет словарь {key: value} и при необходимости вытесняет старые записи.
+        """
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, value, len(value.encode("utf-8")), now) for key, value in items.items()]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)", rows
+            )
+            self.conn.commit()
+            self._evict()
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def delete_many(self, keys):
+        keys = [(key,) for key in dict.fromkeys(keys)]
+        if not keys:
+            return
+        with self.lock:
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            self.conn.commit()
+
+    def total_size(self):
+        with self.lock:
+            return self._total_size()
+
+    def _total_size(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self):
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        to_delete = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total <= target:
+                break
+            to_delete.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+        self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
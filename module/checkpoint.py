@@ -0,0 +1,178 @@
+"""
+Чекпоинты пайплайна: результат каждого этапа для каждого документа
+сохраняется на диск, и повторный запуск продолжает с места остановки.
+
+Ключ артефакта - хэш входного файла + конфиг этого этапа и всех этапов до него.
+Поэтому смена PROMPT_TEMPLATE перезапускает только rephrase и write,
+смена стилей pdf_gen - только write, а layout и OCR берутся с диска.
+Копии одного файла под разными именами делят артефакты до rephrase включительно;
+write ещё зависит от имени файла, а имя и путь в восстановленном документе всегда свои.
+
+Этапы (по порядку) и что сохраняется:
+    layout    - документ после разбора: bbox'ы, метки, тексты текстового слоя (без картинок)
+    ocr       - документ после OCR: texts, bboxes, labels
+    anonymize - anonymized_texts
+    rephrase  - rephrased_texts
+    write     - output_path (действителен, пока файл на месте)
+"""
+import hashlib
+import json
+import os
+
+from module.cache import DiskCache, make_key
+from module.config import CHECKPOINT_PATH, CHECKPOINT_MAX_BYTES
+
+STAGES = ("layout", "ocr", "anonymize", "rephrase", "write")
+
+# Поля документа, которые сохраняет каждый этап (None - весь документ без картинок)
+STAGE_FIELDS = {
+    "layout": None,
+    "ocr": None,
+    "anonymize": ("anonymized_texts",),
+    "rephrase": ("rephrased_texts",),
+    "write": ("output_path",),
+}
+
+
+def file_hash(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _style_fingerprint(styles):
+    return {name: sorted((key, repr(value)) for key, value in vars(style).items())
+            for name, style in styles.items()}
+
+
+def stage_fingerprints():
+    """
+    Конфиг каждого этапа, от которого зависит его результат.
+    Модули моделей импортируются лениво, сами модели при этом не грузятся.
+    """
+    from module import config
+    from module.layout import LAYOUT_MODEL_NAME, LAYOUT_THRESHOLD
+    from module import ocr, llm, anonymize, pdf_gen, doc_reader
+
+    try:
+        from importlib.metadata import version
+        natasha_version = version("natasha")
+    except Exception:
+        natasha_version = None
+
+    stages = {
+        "layout": (LAYOUT_MODEL_NAME, LAYOUT_THRESHOLD, config.id2label, doc_reader.EXTRACTOR_VERSION,
+                   config.RASTER_DPI, config.RASTER_COLORSPACE,
+                   config.PDF_MIN_TEXT_CHARS, config.PDF_SCAN_IMAGE_COVERAGE, config.PDF_SCAN_MAX_TEXT_COVERAGE),
+        "ocr": (ocr.OCR_MODEL_NAME, ocr.OCR_PROMPTS, ocr.OCR_MIN_PIXELS, ocr.OCR_MAX_PIXELS,
+                config.OCR_DEFAULT_ROUTE, config.OCR_ROUTING, config.OCR_TOKENS_ROUNDING),
+        "anonymize": (natasha_version, anonymize.NER_REPLACEMENT_MAP, anonymize.PHONE_PATTERN.pattern,
+                      anonymize.EMAIL_PATTERN.pattern, anonymize.AGE_PATTERN.pattern),
+        "rephrase": (llm.MODEL_NAME, repr(llm.SAMPLING_PARAMS), llm.PROMPT_TEMPLATE, config.LLM_MAX_MODEL_LEN,
+                     config.LLM_OUTPUT_RATIO, config.LLM_OUTPUT_MARGIN, config.LLM_DETERMINISTIC,
+                     config.LLM_TRIVIAL_MIN_LETTERS, config.LLM_TRIVIAL_PATTERNS),
+        "write": (pdf_gen.effective_font_name, _style_fingerprint(pdf_gen.get_text_styles(pdf_gen.effective_font_name))),
+    }
+    return {stage: json.dumps(parts, sort_keys=True, ensure_ascii=False, default=repr)
+            for stage, parts in stages.items()}
+
+
+def stage_done(data, stage):
+    """
+    True, если этап stage для документа уже выполнен (восстановлен из чекпоинта).
+    """
+    done = data.get('stage')
+    return done is not None and STAGES.index(done) >= STAGES.index(stage)
+
+
+# Поля, которые задаёт сам входной файл: артефакт ищется только по содержимому,
+# поэтому у копии с другим именем они должны остаться своими
+IDENTITY_FIELDS = ('file', 'path', 'file_hash')
+
+
+def _snapshot(data):
+    # Картинки не сохраняются: если понадобятся для OCR, их можно отрендерить заново
+    snapshot = {key: value for key, value in data.items() if key not in ('img', 'stage', *IDENTITY_FIELDS)}
+    if 'pdf_pages' in snapshot:
+        snapshot['pdf_pages'] = [{key: value for key, value in page.items() if key != 'img'}
+                                 for page in snapshot['pdf_pages']]
+    return snapshot
+
+
+class CheckpointStore:
+    """
+    path: файл SQLite с артефактами
+    fingerprints: {этап: строка конфига}; по умолчанию stage_fingerprints()
+    """
+    def __init__(self, path=CHECKPOINT_PATH, max_bytes=CHECKPOINT_MAX_BYTES, fingerprints=None):
+        self.cache = DiskCache(path, max_bytes)
+        self.fingerprints = fingerprints if fingerprints is not None else stage_fingerprints()
+
+    def key(self, data, stage):
+        upstream = [self.fingerprints[name] for name in STAGES[:STAGES.index(stage) + 1]]
+        if stage == "write":
+            # Выходной файл называется по входному: копии с другим именем пишутся заново
+            return make_key(data['file_hash'], *upstream, stage, data['file'])
+        return make_key(data['file_hash'], *upstream, stage)
+
+    def save(self, data, stage):
+        fields = STAGE_FIELDS[stage]
+        if fields is None:
+            artifact = _snapshot(data)
+        else:
+            artifact = {field: data[field] for field in fields}
+        self.cache.put(self.key(data, stage), json.dumps(artifact, ensure_ascii=False))
+        data['stage'] = stage
+        return data
+
+    def save_many(self, docs, stage):
+        for data in docs:
+            self.save(data, stage)
+        return docs
+
+    def restore(self, file_path, output_dir=None):
+        """
+        Словарь документа, восстановленный до последнего сохранённого этапа.
+        data['stage'] - последний выполненный этап (None - начинать с нуля).
+        """
+        data = {'file': os.path.basename(file_path), 'path': file_path,
+                'file_hash': file_hash(file_path), 'stage': None}
+        keys = [self.key(data, stage) for stage in STAGES]
+        found = self.cache.get_many(keys)
+
+        for stage, key in zip(STAGES, keys):
+            if key not in found:
+                break
+            artifact = json.loads(found[key])
+            if stage == "write" and not self._output_valid(artifact['output_path'], output_dir):
+                break
+            # Имя и путь - этого файла, даже если артефакт сохранён для копии с другим именем
+            data.update({key: value for key, value in artifact.items() if key not in IDENTITY_FIELDS})
+            data['stage'] = stage
+        return data
+
+    def invalidate(self, file_path, stage=STAGES[0]):
+        """
+        Удаляет артефакты документа начиная с этапа stage и ниже по пайплайну.
+        """
+        data = {'file': os.path.basename(file_path), 'file_hash': file_hash(file_path)}
+        self.cache.delete_many([self.key(data, name) for name in STAGES[STAGES.index(stage):]])
+
+    @staticmethod
+    def _output_valid(output_path, output_dir):
+        if not os.path.exists(output_path):
+            return False
+        if output_dir is None:
+            return True
+        return os.path.dirname(os.path.abspath(output_path)) == os.path.abspath(output_dir)
+
+    def close(self):
+        self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -23,4 +23,189 @@ anonymize_text_tokens = [
     "[AGE]",
     "[EMAIL_ADDRESS]",
     "[PHONE_NUMBER]"
-]
\ No newline at end of file
+]
+
+
+# --- Пайплайн ---
+DATA_PATH = '/home/ubuntu/alan/test_lm/data'
+OUTPUT_DIR = "output"
+
+# "batch" - каждый этап прогоняется по всему корпусу (layout -> OCR -> ... -> рендер),
+# "streaming" - документы идут потоком через все этапы, готовые сразу пишутся в OUTPUT_DIR,
+# "service" - локальный HTTP-сервис с очередью заданий (module.service)
+PIPELINE_MODE = "batch"
+# Сколько документов (без картинок) может одновременно ждать LLM в streaming-режиме.
+# Ограничивает пиковую память вместо размера корпуса.
+PIPELINE_WINDOW = 8
+
+# --- Layout ---
+# Сколько страниц за один forward DETR
+LAYOUT_BATCH_SIZE = 8
+
+# --- OCR ---
+# Сколько кропов за один вызов generate
+OCR_BATCH_SIZE = 16
+
+# --- Анонимизация ---
+# Сколько текстов за один прогон NER
+NER_BATCH_SIZE = 64
+# Число процессов для анонимизации (None - по числу ядер)
+ANONYMIZE_WORKERS = None
+# Сколько текстов отдаётся воркеру за раз
+ANONYMIZE_CHUNK_SIZE = 256
+# Меньше этого числа текстов пул не запускается, всё считается в текущем процессе
+ANONYMIZE_MIN_PARALLEL = 2000
+
+# --- LLM ---
+# Кэш перефразировок на диске (None - не кэшировать)
+LLM_CACHE_PATH = "cache/llm_cache.sqlite"
+LLM_CACHE_MAX_BYTES = 2 * 1024**3
+# seed каждого запроса выводится из хэша промпта, чтобы кэш оставался валидным
+LLM_DETERMINISTIC = True
+# Контекст vLLM в токенах (промпт + ответ)
+LLM_MAX_MODEL_LEN = 1200
+# max_tokens запроса = LLM_OUTPUT_RATIO * токенов входа + LLM_OUTPUT_MARGIN
+# (не больше SAMPLING_PARAMS.max_tokens); тексты длиннее, чем позволяет контекст,
+# режутся по предложениям и собираются обратно после генерации
+LLM_OUTPUT_RATIO = 1.3
+LLM_OUTPUT_MARGIN = 32
+
+# --- PDF ---
+# Классификация страниц PDF: страница со сканом идёт в растеризацию, layout и OCR,
+# страница с текстовым слоем - в извлечение текста.
+# Меньше стольких символов текстового слоя - текста на странице нет
+PDF_MIN_TEXT_CHARS = 10
+# Картинки покрывают не меньше этой доли страницы...
+PDF_SCAN_IMAGE_COVERAGE = 0.5
+# ...а текстовый слой - меньше этой доли: считаем страницу сканом
+PDF_SCAN_MAX_TEXT_COVERAGE = 0.05
+
+# --- Растеризация сканов ---
+RASTER_DPI = 300
+# "rgb" или "gray" (layout хватает серого, OCR кропов из серых страниц тоже работает)
+RASTER_COLORSPACE = "rgb"
+# Размер пула рендера (0 - рендер в текущем потоке) и его тип: "process" или "thread"
+RASTER_WORKERS = 4
+RASTER_EXECUTOR = "process"
+# Сколько страниц может быть отрендерено вперёд, пока layout занят
+RASTER_PREFETCH = 16
+
+# --- Рендер выходных PDF ---
+# Число процессов постраничного рендера (None - по числу ядер, 0 - без пула)
+RENDER_WORKERS = None
+# Документы короче стольких страниц рендерятся в текущем процессе
+RENDER_MIN_PARALLEL_PAGES = 8
+# Сколько документов одновременно отдано пулу: больше не держим в памяти очереди пула
+RENDER_MAX_PENDING = 16
+
+# Кэш OCR по перцептивному хэшу кропа (колонтитулы, печати, логотипы)
+OCR_CACHE_ENABLED = True
+OCR_CACHE_MAX_ENTRIES = 10000
+# Хранилище на диске между документами и запусками (None - только память)
+OCR_CACHE_PATH = "cache/ocr_cache.sqlite"
+OCR_CACHE_MAX_BYTES = 256 * 1024**2
+# Похожие кропы: dHash (512 бит) отличается не больше чем на OCR_CACHE_MAX_DISTANCE бит, а после выравнивания
+# (сдвиг до 2 пикселей) средняя разница яркости в каждой клетке OCR_CACHE_REGION_CELL x OCR_CACHE_REGION_CELL
+# не больше OCR_CACHE_REGION_TOLERANCE из 255. Шум скана и сдвиг bbox проходят, другая цифра в номере страницы - нет.
+# Для поиска похожих в памяти держится до OCR_CACHE_FUZZY_ENTRIES кропов не больше OCR_CACHE_FUZZY_MAX_PIXELS
+# пикселей каждый; кропы крупнее находятся только точной копией. С выравниванием сравниваются
+# не больше OCR_CACHE_FUZZY_CANDIDATES недавних кандидатов на кроп.
+OCR_CACHE_MAX_DISTANCE = 32
+OCR_CACHE_REGION_CELL = 4
+OCR_CACHE_REGION_TOLERANCE = 96
+OCR_CACHE_FUZZY_ENTRIES = 1000
+OCR_CACHE_FUZZY_MAX_PIXELS = 65536
+OCR_CACHE_FUZZY_CANDIDATES = 8
+
+# Маршрутизация OCR по меткам layout (id2label).
+# skip - регион не распознаётся (текст пустой),
+# prompt - вариант промпта из module.ocr.OCR_PROMPTS,
+# max_new_tokens - базовый бюджет генерации, tokens_per_megapixel - добавка за площадь кропа,
+# max_tokens_cap - потолок бюджета. Не указанные поля берутся из OCR_DEFAULT_ROUTE.
+OCR_DEFAULT_ROUTE = {
+    "skip": False,
+    "prompt": "default",
+    "max_new_tokens": 64,
+    "tokens_per_megapixel": 256,
+    "max_tokens_cap": 1024,
+}
+OCR_ROUTING = {
+    "Изображение": {"skip": True},
+    "Таблица": {"prompt": "table", "max_new_tokens": 128, "tokens_per_megapixel": 512, "max_tokens_cap": 2048},
+    "Текст": {"max_new_tokens": 64, "tokens_per_megapixel": 320, "max_tokens_cap": 1536},
+    "Элемент списка": {"max_new_tokens": 64, "tokens_per_megapixel": 320},
+    "Сноска": {"max_new_tokens": 64, "tokens_per_megapixel": 320},
+    "Заголовок": {"max_new_tokens": 48, "max_tokens_cap": 256},
+    "Заголовок раздела": {"max_new_tokens": 48, "max_tokens_cap": 256},
+    "Верхний колонтитул страницы": {"max_new_tokens": 48, "max_tokens_cap": 256},
+    "Нижний колонтитул страницы": {"max_new_tokens": 48, "max_tokens_cap": 256},
+}
+# Бюджеты округляются вверх до кратного, чтобы похожие кропы попадали в один вызов generate
+OCR_TOKENS_ROUNDING = 64
+
+# Сегменты, которые не идут в LLM и остаются как есть:
+# меньше стольких букв без учёта плейсхолдеров (номера страниц, пунктуация, одиночный [PERSON_NAME])
+LLM_TRIVIAL_MIN_LETTERS = 3
+# ...или целиком совпадающие с одним из шаблонов
+LLM_TRIVIAL_PATTERNS = [
+    r"(стр\.?|страница|page)\s*\d+(\s*(из|of|/)\s*\d+)?",  # Стр. 5 из 12
+    r"\d{1,2}\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+\d{4}(\s*г\.?)?",
+]
+
+# Менеджер моделей (module.models): примерный объём памяти каждой модели в ГБ
+# и бюджет на все загруженные одновременно. Если модели не влезают вместе,
+# давно не использованные выгружаются (LRU); на большой карте все остаются загруженными.
+# vLLM занимает долю LLM_GPU_MEMORY_UTILIZATION всей памяти карты, сколько бы ни весила модель.
+# На карте 48 ГБ OCR и LLM вместе не помещаются: пакетный режим грузит их по очереди
+# (layout остаётся загруженным), потоковый переходит на пакетный. С GPU_MEMORY_GB >= 80 все три
+# модели загружены одновременно.
+GPU_MEMORY_GB = 48.0
+LLM_GPU_MEMORY_UTILIZATION = 0.7
+MODEL_MEMORY_COST_GB = {"layout": 1.0, "ocr": 17.0, "llm": GPU_MEMORY_GB * LLM_GPU_MEMORY_UTILIZATION}
+MODEL_MEMORY_BUDGET_GB = GPU_MEMORY_GB
+# В пакетном режиме корпус идёт пачками по столько документов (None - весь корпус одной пачкой).
+# Модели между пачками не перезагружаются, если влезают в бюджет.
+PIPELINE_SHARD_SIZE = None
+# Потоковый режим, которому не хватает бюджета на все модели, идёт пакетным такими пачками
+# (если PIPELINE_SHARD_SIZE не задан): память ограничена пачкой, а OCR и LLM
+# перезагружаются раз на пачку, а не раз на окно.
+PIPELINE_FALLBACK_SHARD_SIZE = 64
+# Видимые для vLLM GPU (например "1"); None - не трогать CUDA_VISIBLE_DEVICES
+LLM_CUDA_VISIBLE_DEVICES = None
+
+# Чекпоинты этапов пайплайна (module.checkpoint): повторный запуск пропускает готовые этапы.
+# None - без чекпоинтов
+CHECKPOINT_PATH = "cache/checkpoints.sqlite"
+CHECKPOINT_MAX_BYTES = 4 * 1024**3
+
+# Логирование и метрики этапов (module.metrics)
+LOG_LEVEL = "INFO"
+METRICS_ENABLED = True
+# Записи по этапам и документам, строками JSON (None - не писать)
+METRICS_JSONL_PATH = "metrics/pipeline_metrics.jsonl"
+# Сводка в текстовом формате Prometheus (для node_exporter textfile collector; None - не писать)
+METRICS_PROMETHEUS_PATH = "metrics/pipeline.prom"
+# Этапы, которые снимаются профайлером ("cprofile" или "torch"), и сколько первых вызовов снимать
+METRICS_PROFILE_STAGES = ()
+METRICS_PROFILER = "cprofile"
+METRICS_PROFILE_WINDOW = 1
+METRICS_PROFILE_DIR = "metrics/profiles"
+
+# Локальный сервис (module.service, main(mode="service")): HTTP только на localhost
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_UPLOAD_DIR = "service/uploads"
+SERVICE_OUTPUT_DIR = "service/output"
+# POST /jobs {"path": ...} принимает только файлы внутри этой папки (None - только загрузка файла)
+SERVICE_INPUT_ROOT = DATA_PATH
+# Сколько самых коротких заданий воркер прогоняет одной пачкой
+SERVICE_MAX_BATCH = 8
+# Оценка стоимости задания для очереди "сначала короткие":
+# страница-скан (layout + OCR), страница с текстовым слоем, сегмент DOCX/RTF
+SERVICE_SCAN_PAGE_COST = 10
+SERVICE_TEXT_PAGE_COST = 1
+SERVICE_SEGMENT_COST = 0.1
+# Старение в очереди: за каждую секунду ожидания приоритет задания растёт на столько единиц
+# стоимости, чтобы поток мелких заданий не откладывал большой скан бесконечно
+# (скан на 500 страниц = 5000 единиц пропускает новые мелкие задания не дольше ~1.5 часа)
+SERVICE_AGING_PER_SECOND = 1.0
@@ -2,34 +2,53 @@ import docx
 from striprtf.striprtf import rtf_to_text
 import os
 import re # Для некоторых проверок
+import logging
+import zipfile
 from reportlab.lib.pagesizes import A4
 
 from module.config import id2label
+from module.docx_xml import (
+    W_P, W_R, W_TBL, W_BODY, W_HDR, W_FTR, run_text, paragraph_text, paragraph_style, table_cells, cell_text, iter_part,
+    element_path, read_relationships, document_part_name, read_style_names, unit_sect_pr,
+    section_references, resolve_section_parts,
+)
 
-def classify_docx_paragraph(paragraph):
+logger = logging.getLogger(__name__)
+
+# Версия извлечения текста из DOCX/RTF: входит в отпечаток этапа layout (module.checkpoint).
+# Увеличивается, когда меняются тексты, метки или пути элементов, чтобы старые чекпоинты не подхватывались.
+EXTRACTOR_VERSION = 2
+
+def classify_docx_paragraph(p, style_names, default_style="Normal"):
     """
-    Пытается классифицировать параграф DOCX.
+    Пытается классифицировать параграф DOCX (элемент w:p).
+    style_names - {ID стиля: имя} из styles.xml (docx_xml.read_style_names).
     Возвращает (type_id, type_label).
     """
-    style_name = paragraph.style.name.lower()
-    text = paragraph.text.strip()
+    text = paragraph_text(p).strip()
 
     if not text: # Пустые параграфы пропускаем или считаем текстом? Пока пропустим.
         return None, None
 
+    style_id, numbered = paragraph_style(p)
+    style_name = style_names.get(style_id, default_style) if style_id else default_style
+    # ID стиля и имя могут расходиться ("Heading1" / "heading 1"), сравниваем без пробелов
+    style_key = style_name.lower().replace(" ", "")
+
     # Заголовки
-    if style_name.startswith('heading 1'):
+    if style_key.startswith('heading1'):
         return "0", id2label["0"]
-    if style_name.startswith('heading'): # Heading 2, Heading 3 и т.д.
+    if style_key.startswith('heading'): # Heading 2, Heading 3 и т.д.
         return "7", id2label["7"]
 
-    
-    if paragraph.style.name == 'List Paragraph':
+    # Нумерация Word (numPr) - список, даже если стиль обычный
+    if style_name == 'List Paragraph' or numbered:
         return "3", id2label["3"]
     # Более сложная проверка на маркеры или нумерацию (требует анализа run.text)
     # Например, если первый run содержит '•', '*', или цифру с точкой.
     # Этот подход очень упрощен и может давать ложные срабатывания.
-    first_run_text = paragraph.runs[0].text.strip() if paragraph.runs else ""
+    first_run = p.find(W_R)
+    first_run_text = run_text(first_run).strip() if first_run is not None else ""
     if re.match(r"^(\d+\.|[a-zA-Z]\.|[•*-])", first_run_text):
          if len(text) > len(first_run_text) + 2: # Чтобы не принять просто "1." за список
             return "3", id2label["3"]
@@ -38,87 +57,103 @@ def classify_docx_paragraph(paragraph):
     # По умолчанию - обычный текст
     return "9", id2label["9"]
 
-def extract_from_docx(filepath):
+def iter_docx_items(filepath, stats=None):
     """
-    Извлекает текст, "позицию" (описательную) и тип из DOCX.
+    Генератор элементов DOCX по мере разбора: словари text, type_id, type_label,
+    element_index (номер элемента тела, для bbox) и path (путь элемента для docx_writer).
+
+    word/document.xml читается iterparse: в памяти только текущий параграф или таблица.
+    Таблица отдаётся по ячейкам, у каждой свой путь; объединённая ячейка - один раз.
+    Затем колонтитулы по секциям: связанный с предыдущей секцией - та же часть, берётся один раз.
+    stats (dict) после тела документа получает "body_units" - число элементов тела.
     """
-    doc = docx.Document(filepath)
-    extracted_data = []
-    element_index = 0
-    len_element = len(doc.element.body)
-    # 1. Основной текст документа (параграфы и таблицы)
-    for element in doc.element.body:
-        element_index += 1
-        if isinstance(element, docx.oxml.text.paragraph.CT_P): # Параграф
-            para = docx.text.paragraph.Paragraph(element, doc)
-            text = para.text.strip()
-            if not text:
-                continue
+    with zipfile.ZipFile(filepath) as zin:
+        document_name = document_part_name(zin)
+        document_rels = read_relationships(zin, document_name)
+        style_names, default_style = read_style_names(zin, document_rels)
+        sections = []
 
-            type_id, type_label = classify_docx_paragraph(para)
-            if type_id is None: # Пропускаем если классификатор вернул None
-                continue
+        # 1. Основной текст документа (параграфы и таблицы)
+        body_units = 0
+        with zin.open(document_name) as source:
+            for kind, element, index in iter_part(source, W_BODY):
+                if kind != "unit" or index is None:
+                    continue
+                body_units += 1
+                sect_pr = unit_sect_pr(element)
+                if sect_pr is not None:
+                    sections.append(section_references(sect_pr))
 
-            bbox = (4,element_index*(A4[1]/len_element), A4[0]-4, (element_index+1)*(A4[1]/len_element))
-            extracted_data.append({
-                "text": text,
-                "bbox": bbox,
-                "type_id": type_id,
-                "type_label": type_label
-            })
+                if element.tag == W_P: # Параграф
+                    type_id, type_label = classify_docx_paragraph(element, style_names, default_style)
+                    if type_id is None: # Пропускаем если классификатор вернул None
+                        continue
+                    yield {
+                        "text": paragraph_text(element).strip(),
+                        "type_id": type_id,
+                        "type_label": type_label,
+                        "element_index": index + 1,
+                        "path": element_path(document_name, index),
+                    }
 
-        elif isinstance(element, docx.oxml.table.CT_Tbl): # Таблица
-            table = docx.table.Table(element, doc)
-            table_text_parts = []
-            for i, row in enumerate(table.rows):
-                row_texts = []
-                for j, cell in enumerate(row.cells):
-                    cell_text = cell.text.strip()
-                    row_texts.append(cell_text)
-                   
-                table_text_parts.append(" | ".join(row_texts)) # Соединяем ячейки строки
-            full_table_text = "\n".join(table_text_parts) # Соединяем строки
-            bbox = (4,element_index*(A4[1]/len_element), A4[0]-4, (element_index+1)*(A4[1]/len_element))
-
-            if full_table_text:
-                 extracted_data.append({
-                    "text": full_table_text,
-                    "bbox": bbox,
-                    "type_id": "8",
-                    "type_label": id2label["8"]
-                })
+                elif element.tag == W_TBL: # Таблица
+                    for row, column, tc in table_cells(element):
+                        text = cell_text(tc)
+                        if text:
+                            yield {
+                                "text": text,
+                                "type_id": "8",
+                                "type_label": id2label["8"],
+                                "element_index": index + 1,
+                                "path": element_path(document_name, index, (row, column)),
+                            }
+        if stats is not None:
+            stats["body_units"] = body_units
 
-    # 2. Верхние и нижние колонтитулы
-    for section in doc.sections:
-        # Верхний колонтитул
-        for para in section.header.paragraphs:
-            text = para.text.strip()    
-            if text:
-                element_index += 1
-                bbox = (4,element_index*(A4[1]/len_element), A4[0]-4, (element_index+1)*(A4[1]/len_element))
-                extracted_data.append({
-                    "text": text,
-                    "bbox": bbox,
-                    "type_id": "5",
-                    "type_label": id2label["5"]
-                })
-        # Нижний колонтитул
-        for para in section.footer.paragraphs:
-            text = para.text.strip()
-            if text:
-                element_index += 1
-                bbox = (4,element_index*(A4[1]/len_element), A4[0]-4, (element_index+1)*(A4[1]/len_element))
-                extracted_data.append({
-                    "text": text,
-                    "bbox": bbox,
-                    "type_id": "4",
-                    "type_label": id2label["4"]
-                })
+        # 2. Верхние и нижние колонтитулы
+        element_index = body_units
+        seen_parts = set()
+        for header_part, footer_part in resolve_section_parts(sections, document_rels):
+            for part_name, body_level, type_id in ((header_part, W_HDR, "5"), (footer_part, W_FTR, "4")):
+                if part_name is None or part_name in seen_parts or part_name not in zin.NameToInfo:
+                    continue
+                seen_parts.add(part_name)
+                with zin.open(part_name) as source:
+                    for kind, element, index in iter_part(source, body_level):
+                        if kind != "unit" or index is None or element.tag != W_P:
+                            continue
+                        text = paragraph_text(element).strip()
+                        if text:
+                            element_index += 1
+                            yield {
+                                "text": text,
+                                "type_id": type_id,
+                                "type_label": id2label[type_id],
+                                "element_index": element_index,
+                                "path": element_path(part_name, index),
+                            }
 
+def extract_from_docx(filepath):
+    """
+    Извлекает текст, "позицию" (описательную) и тип из DOCX.
+    Элементы идут потоком из iter_docx_items; element_paths - путь каждого текста,
+    по нему docx_writer.rewrite_docx пишет перефразированный текст обратно.
+    """
+    stats = {}
+    texts, labels, element_paths, element_indexes = [], [], [], []
+    for item in iter_docx_items(filepath, stats):
+        texts.append(item["text"])
+        labels.append(item["type_label"])
+        element_paths.append(item["path"])
+        element_indexes.append(item["element_index"])
+
+    # bbox по номеру элемента: высота страницы делится на число элементов тела
+    step = A4[1] / max(stats.get("body_units", 0), 1)
     data_from_docx = {
-        "texts": [i["text"] for i in extracted_data],
-        "bboxes": [i["bbox"] for i in extracted_data],
-        "labels": [i["type_label"] for i in extracted_data]
+        "texts": texts,
+        "bboxes": [(4, index*step, A4[0]-4, (index+1)*step) for index in element_indexes],
+        "labels": labels,
+        "element_paths": element_paths
     }
 
     return data_from_docx
@@ -139,7 +174,7 @@ def extract_from_rtf(filepath):
             with open(filepath, 'r', encoding='latin-1') as f: # Частая кодировка для RTF
                 rtf_content = f.read()
         except Exception as e:
-            print(f"Не удалось прочитать RTF файл {filepath}: {e}")
+            logger.error("Не удалось прочитать RTF файл %s: %s", filepath, e)
             return []
 
     text = rtf_to_text(rtf_content).strip()
@@ -164,13 +199,14 @@ def extract_from_rtf(filepath):
 def put_to_docx(filepath, extracted_data):
     """
     Добавляет текст в DOCX.
+    Пайплайн пишет DOCX потоково через module.docx_writer.rewrite_docx.
     """
     doc = docx.Document(filepath)
     texts = extracted_data.get('rephrased_texts', extracted_data.get('texts', []))
     
     # Make sure we have texts to add
     if not texts:
-        print(f"Warning: No texts found in extracted_data for file {filepath}")
+        logger.warning("No texts found in extracted_data for file %s", filepath)
         return doc
     
     element_index = 0
@@ -190,7 +226,7 @@ def put_to_docx(filepath, extracted_data):
                 text_index += 1
             
         elif isinstance(element, docx.oxml.table.CT_Tbl): # Таблица
-            print("Table found, skipping")
+            logger.debug("Table found, skipping")
 
     # 2. Верхние и нижние колонтитулы
     for section in doc.sections:
@@ -218,15 +254,15 @@ def extract_document_data(filepath):
     file_extension = file_extension.lower()
 
     if not os.path.exists(filepath):
-        print(f"Файл не найден: {filepath}")
+        logger.error("Файл не найден: %s", filepath)
         return []
 
-    print(f"Обработка файла: {filepath}")
+    logger.debug("Обработка файла: %s", filepath)
 
     if file_extension == '.docx':
         return extract_from_docx(filepath)
     elif file_extension == '.rtf':
         return extract_from_rtf(filepath)
     else:
-        print(f"Неподдерживаемый формат файла: {file_extension}")
+        logger.warning("Неподдерживаемый формат файла: %s", file_extension)
         return []
@@ -0,0 +1,307 @@
+"""
+Потоковая запись DOCX с перефразированным текстом.
+
+Вместо docx.Document(...).save:
+  - word/document.xml, колонтитулы - iterparse (lxml): в памяти только текущий
+    элемент верхнего уровня (параграф, таблица), он переписывается и сразу уходит в выход;
+  - текст параграфа заменяется на месте: остаётся первый run с текстом и его
+    форматирование (rPr), картинки и прочие нетекстовые run'ы не трогаются;
+  - остальные члены архива (картинки, шрифты, стили) копируются сжатыми байтами,
+    без распаковки и пересжатия (или перепаковываются тем же методом, если zipfile
+    этой версии Python не даёт так сделать, см. RAW_COPY_SUPPORTED).
+
+Тексты находятся по путям элементов из doc_reader.extract_from_docx
+("word/document.xml#12", см. module.docx_xml): переписываются только части с этими
+элементами, ячейка таблицы - по своему пути ("...#12/0/3").
+"""
+import logging
+import re
+import shutil
+import struct
+import zipfile
+from collections import defaultdict
+
+from lxml import etree
+
+from module.docx_xml import (
+    W_P, W_R, W_T, W_TAB, W_TR, W_TC, W_BR, W_CR, W_PTAB, W_NO_BREAK_HYPHEN, W_RPR, W_HYPERLINK, W_TBL, W_BODY,
+    W_HDR, W_FTR, XML_NS, HEADER_REL, is_line_break, run_text, paragraph_runs, paragraph_text, iter_part,
+    parse_element_path, read_relationships, document_part_name,
+)
+
+logger = logging.getLogger(__name__)
+
+# Размер куска при копировании сжатых данных
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _is_text_child(child):
+    return (child.tag in (W_T, W_TAB, W_PTAB, W_CR, W_NO_BREAK_HYPHEN)
+            or (child.tag == W_BR and is_line_break(child)))
+
+
+def _append_text(run, text):
+    # "\n" -> <w:br/>, "\t" -> <w:tab/>, как сеттер Paragraph.text в python-docx
+    for line_index, line in enumerate(text.split("\n")):
+        if line_index:
+            etree.SubElement(run, W_BR)
+        for piece_index, piece in enumerate(line.split("\t")):
+            if piece_index:
+                etree.SubElement(run, W_TAB)
+            if piece:
+                t = etree.SubElement(run, W_T)
+                t.text = piece
+                if piece != piece.strip():
+                    t.set(f"{{{XML_NS}}}space", "preserve")
+
+
+def set_paragraph_text(p, text):
+    """
+    Заменяет текст параграфа: текст встаёт в первый run с текстом (с его rPr),
+    из остальных run'ов текст убирается, опустевшие run'ы удаляются.
+    """
+    runs = paragraph_runs(p)
+    text_runs = [run for run in runs if run_text(run)]
+    target = text_runs[0] if text_runs else (runs[0] if runs else None)
+    if target is None:
+        if not text:
+            return
+        target = etree.SubElement(p, W_R)
+
+    for run in runs:
+        for child in [child for child in run if _is_text_child(child)]:
+            run.remove(child)
+        if run is not target and all(child.tag == W_RPR for child in run):
+            parent = run.getparent()
+            parent.remove(run)
+            if parent.tag == W_HYPERLINK and not len(parent):
+                parent.getparent().remove(parent)
+    _append_text(target, text)
+
+
+# --- Запись в таблицы ---
+
+def set_cell_text(tc, text):
+    paragraphs = list(tc.iterchildren(W_P))
+    if not paragraphs:
+        return
+    with_text = [p for p in paragraphs if paragraph_text(p).strip()]
+    target = with_text[0] if with_text else paragraphs[0]
+    set_paragraph_text(target, text)
+    for p in with_text[1:]:
+        set_paragraph_text(p, "")
+
+
+def set_table_cells(tbl, cells):
+    """
+    cells - {(строка, ячейка в строке): текст}, как в путях ячеек (docx_xml.table_cells).
+    """
+    for row, tr in enumerate(tbl.iterchildren(W_TR)):
+        for column, tc in enumerate(tr.iterchildren(W_TC)):
+            if (row, column) in cells:
+                set_cell_text(tc, cells[(row, column)])
+
+
+# --- Потоковая перезапись XML-части ---
+
+_XMLNS_ATTR = re.compile(rb'\s+xmlns(?::([\w.-]+))?="([^"]*)"')
+
+
+def _start_tag(element, declare_namespaces):
+    """
+    Открывающий тег контейнера (корень, body); корню - с объявлениями пространств имён.
+    """
+    def qname(name):
+        qualified = etree.QName(name)
+        if qualified.namespace is None:
+            return qualified.localname
+        if qualified.namespace == XML_NS:
+            return f"xml:{qualified.localname}"
+        prefix = next((prefix for prefix, uri in element.nsmap.items() if uri == qualified.namespace), None)
+        return f"{prefix}:{qualified.localname}" if prefix else qualified.localname
+
+    parts = [qname(element.tag)]
+    if declare_namespaces:
+        for prefix, uri in element.nsmap.items():
+            parts.append(f'xmlns:{prefix}="{uri}"' if prefix else f'xmlns="{uri}"')
+    for name, value in element.attrib.items():
+        escaped = value.replace("&", "&amp;").replace("<", "&lt;").replace('"', "&quot;")
+        parts.append(f'{qname(name)}="{escaped}"')
+    return "<" + " ".join(parts) + ">", "</" + parts[0] + ">"
+
+
+def _serialize(element, root_namespaces):
+    """
+    Элемент целиком, без повторных объявлений пространств имён корня:
+    lxml пишет все объявления из области видимости на каждый сериализуемый элемент.
+    """
+    data = etree.tostring(element, encoding="UTF-8")
+    end = data.index(b">")
+    head = _XMLNS_ATTR.sub(
+        lambda match: b"" if (match.group(1), match.group(2)) in root_namespaces else match.group(0),
+        data[:end],
+    )
+    return head + data[end:]
+
+
+def rewrite_part(source, output, body_level, text_for):
+    """
+    Переписывает XML-часть (document.xml, header*.xml, footer*.xml) из потока source в output.
+
+    body_level - тег контейнера, чьи прямые дети - единицы (w:body или корень колонтитула).
+    text_for(index, element) - новый текст единицы или None (оставить как есть);
+    параграф получает его целиком, таблица - по ячейкам: {(строка, ячейка): текст}.
+    """
+    root_namespaces = set()
+    closers = []
+    output.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n')
+    for kind, element, index in iter_part(source, body_level):
+        if kind == "open":
+            is_root = element.getparent() is None
+            opener, closer = _start_tag(element, declare_namespaces=is_root)
+            if is_root:
+                root_namespaces = {(prefix.encode() if prefix else None, uri.encode())
+                                   for prefix, uri in element.nsmap.items()}
+            output.write(opener.encode("utf-8"))
+            closers.append(closer)
+        elif kind == "close":
+            output.write(closers.pop().encode("utf-8"))
+        else:
+            if index is not None:
+                text = text_for(index, element)
+                if text is not None:
+                    if element.tag == W_P:
+                        set_paragraph_text(element, text)
+                    elif element.tag == W_TBL:
+                        set_table_cells(element, text)
+            output.write(_serialize(element, root_namespaces))
+
+
+# --- Архив ---
+
+# Копирование сжатыми байтами опирается на внутренности zipfile (не публичный API):
+# если в этой версии Python их нет, члены архива перепаковываются через ZipFile.open
+RAW_COPY_SUPPORTED = (
+    all(hasattr(zipfile, name) for name in ("structFileHeader", "sizeFileHeader", "_FH_FILENAME_LENGTH",
+                                            "_FH_EXTRA_FIELD_LENGTH", "ZIP64_LIMIT"))
+    and hasattr(zipfile.ZipFile, "_writecheck")
+    and hasattr(zipfile.ZipInfo, "FileHeader")
+)
+
+
+def _copy_info(info):
+    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.comment = info.comment
+    new_info.create_system = info.create_system
+    new_info.external_attr = info.external_attr
+    new_info.internal_attr = info.internal_attr
+    return new_info
+
+
+def copy_member(zin, zout, info):
+    """
+    Копирует член архива как есть: сжатыми байтами, если это поддерживается
+    (RAW_COPY_SUPPORTED и zout пишется в файл с seek), иначе распаковкой
+    и сжатием тем же методом.
+    """
+    if (RAW_COPY_SUPPORTED and hasattr(zout, "start_dir") and hasattr(zout, "_didModify")
+            and zout.fp.seekable()):
+        copy_member_raw(zin, zout, info)
+    else:
+        copy_member_recompressed(zin, zout, info)
+
+
+def copy_member_recompressed(zin, zout, info):
+    new_info = _copy_info(info)
+    # По исходному размеру zipfile решает, нужен ли zip64
+    new_info.file_size = info.file_size
+    with zin.open(info) as source, zout.open(new_info, "w") as output:
+        shutil.copyfileobj(source, output, COPY_CHUNK_SIZE)
+
+
+def copy_member_raw(zin, zout, info):
+    """
+    Копирует член архива сжатыми байтами, без распаковки и пересжатия.
+    В zipfile нет публичного API для этого: локальный заголовок и данные пишутся так же,
+    как это делают ZipFile._open_to_write и _ZipWriteFile.close (см. RAW_COPY_SUPPORTED).
+    """
+    source = zin.fp
+    source.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, source.read(zipfile.sizeFileHeader))
+    data_offset = (info.header_offset + zipfile.sizeFileHeader
+                   + header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+    new_info = _copy_info(info)
+    # Размеры и CRC известны заранее - дескриптор данных не нужен
+    new_info.flag_bits = info.flag_bits & ~0x08
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.file_size = info.file_size
+    zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+
+    zout.fp.seek(zout.start_dir)
+    new_info.header_offset = zout.fp.tell()
+    zout._writecheck(new_info)
+    zout._didModify = True
+    zout.fp.write(new_info.FileHeader(zip64))
+    source.seek(data_offset)
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source.read(min(remaining, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Член архива обрезан: {info.filename}")
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
+    zout.start_dir = zout.fp.tell()
+    zout.filelist.append(new_info)
+    zout.NameToInfo[new_info.filename] = new_info
+
+
+def _rewrite_member(zin, zout, name, body_level, text_for):
+    info = zin.getinfo(name)
+    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+    new_info.compress_type = zipfile.ZIP_DEFLATED
+    new_info.external_attr = info.external_attr
+    # Размер результата заранее неизвестен: zip64 - если исходная часть уже близка к пределу
+    force_zip64 = info.file_size * 2 > zipfile.ZIP64_LIMIT
+    with zin.open(info) as source, zout.open(new_info, "w", force_zip64=force_zip64) as output:
+        rewrite_part(source, output, body_level, text_for)
+
+
+def _body_level(part_name, document_name, header_parts):
+    if part_name == document_name:
+        return W_BODY
+    return W_HDR if part_name in header_parts else W_FTR
+
+
+def rewrite_docx(source_path, output_path, texts, element_paths):
+    """
+    Пишет в output_path копию source_path с текстами texts.
+
+    element_paths (из doc_reader.extract_from_docx) - путь элемента для каждого текста:
+    переписываются только части, где есть эти элементы, остальное копируется как есть.
+    """
+    with zipfile.ZipFile(source_path) as zin, zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zout:
+        document_name = document_part_name(zin)
+        document_rels = read_relationships(zin, document_name)
+        header_parts = {target for rel_type, target in document_rels.values() if rel_type.endswith(HEADER_REL)}
+        _rewrite_by_paths(zin, zout, texts, element_paths, document_name, header_parts)
+    return output_path
+
+
+def _rewrite_by_paths(zin, zout, texts, element_paths, document_name, header_parts):
+    by_part = defaultdict(dict)
+    for text, path in zip(texts, element_paths):
+        part_name, index, cell = parse_element_path(path)
+        if cell is None:
+            by_part[part_name].setdefault(index, text)
+        else:
+            by_part[part_name].setdefault(index, {}).setdefault(cell, text)
+    for info in zin.infolist():
+        replacements = by_part.get(info.filename)
+        if replacements is None:
+            copy_member(zin, zout, info)
+            continue
+        body_level = _body_level(info.filename, document_name, header_parts)
+        _rewrite_member(zin, zout, info.filename, body_level, lambda index, element: replacements.get(index))
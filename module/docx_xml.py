@@ -0,0 +1,285 @@
+"""
+Общий потоковый разбор WordprocessingML для doc_reader (извлечение) и docx_writer (запись).
+
+Часть документа (word/document.xml, header*.xml, footer*.xml) разбирается iterparse:
+единица - прямой ребёнок w:body (или корня колонтитула): параграф, таблица, sectPr.
+После обработки единица очищается, поэтому память не зависит от размера документа.
+
+Путь элемента - "<часть архива>#<номер единицы>", например "word/document.xml#12";
+у ячейки таблицы ещё "/<строка>/<ячейка в строке>": "word/document.xml#12/0/3".
+Извлечение сохраняет пути, и запись находит по ним свои элементы без повторного обхода.
+"""
+import posixpath
+
+from lxml import etree
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+OFFICE_DOCUMENT_REL = "/officeDocument"
+STYLES_REL = "/styles"
+HEADER_REL = "/header"
+FOOTER_REL = "/footer"
+
+DEFAULT_DOCUMENT_PART = "word/document.xml"
+
+
+def w(tag):
+    return f"{{{W_NS}}}{tag}"
+
+
+W_P = w("p")
+W_R = w("r")
+W_T = w("t")
+W_TAB = w("tab")
+W_BR = w("br")
+W_CR = w("cr")
+W_PTAB = w("ptab")
+W_NO_BREAK_HYPHEN = w("noBreakHyphen")
+W_RPR = w("rPr")
+W_HYPERLINK = w("hyperlink")
+W_TBL = w("tbl")
+W_TR = w("tr")
+W_TC = w("tc")
+W_TCPR = w("tcPr")
+W_VMERGE = w("vMerge")
+W_PPR = w("pPr")
+W_PSTYLE = w("pStyle")
+W_NUMPR = w("numPr")
+W_SECTPR = w("sectPr")
+W_BODY = w("body")
+W_HDR = w("hdr")
+W_FTR = w("ftr")
+W_STYLE = w("style")
+W_NAME = w("name")
+W_VAL = w("val")
+W_TYPE = w("type")
+W_STYLE_ID = w("styleId")
+W_DEFAULT = w("default")
+
+
+# --- Текст параграфа (как python-docx Paragraph.text) ---
+
+def is_line_break(br):
+    # Разрыв страницы/колонки в текст не попадает, только перенос строки
+    return br.get(W_TYPE, "textWrapping") == "textWrapping"
+
+
+def run_text(run):
+    parts = []
+    for child in run:
+        tag = child.tag
+        if tag == W_T:
+            parts.append(child.text or "")
+        elif tag in (W_TAB, W_PTAB):
+            parts.append("\t")
+        elif tag == W_BR:
+            if is_line_break(child):
+                parts.append("\n")
+        elif tag == W_CR:
+            parts.append("\n")
+        elif tag == W_NO_BREAK_HYPHEN:
+            parts.append("-")
+    return "".join(parts)
+
+
+def paragraph_runs(p):
+    """
+    Run'ы параграфа, чей текст входит в Paragraph.text: прямые и внутри гиперссылок.
+    """
+    runs = []
+    for child in p:
+        if child.tag == W_R:
+            runs.append(child)
+        elif child.tag == W_HYPERLINK:
+            runs.extend(child.iterchildren(W_R))
+    return runs
+
+
+def paragraph_text(p):
+    return "".join(run_text(run) for run in paragraph_runs(p))
+
+
+def paragraph_style(p):
+    """
+    (ID стиля из pPr/pStyle или None, есть ли нумерация numPr).
+    """
+    p_pr = p.find(W_PPR)
+    if p_pr is None:
+        return None, False
+    p_style = p_pr.find(W_PSTYLE)
+    return (p_style.get(W_VAL) if p_style is not None else None), p_pr.find(W_NUMPR) is not None
+
+
+# --- Таблицы ---
+
+def cell_text(tc):
+    return "\n".join(paragraph_text(p) for p in tc.iterchildren(W_P)).strip()
+
+
+def table_cells(tbl):
+    """
+    (номер строки, номер ячейки в строке, tc) для ячеек таблицы, как они лежат в XML.
+    Продолжение вертикального слияния пропускается: текст у ячейки, начавшей слияние.
+    """
+    for row, tr in enumerate(tbl.iterchildren(W_TR)):
+        for column, tc in enumerate(tr.iterchildren(W_TC)):
+            tc_pr = tc.find(W_TCPR)
+            vmerge = tc_pr.find(W_VMERGE) if tc_pr is not None else None
+            if vmerge is not None and vmerge.get(W_VAL) != "restart":
+                continue
+            yield row, column, tc
+
+
+# --- Потоковый разбор части ---
+
+def iter_part(source, body_level):
+    """
+    Генератор событий по XML-части из потока source:
+        ("open", element, None)   - начало контейнера (корень; w:body, если body_level == w:body)
+        ("unit", element, index)  - готовая единица; index - её номер среди детей body_level
+                                    (None для прочих детей корня, например w:background)
+        ("close", element, None)  - конец контейнера
+    После возврата управления единица очищается и удаляется из дерева.
+    """
+    containers = []
+    index = -1
+    for event, element in etree.iterparse(source, events=("start", "end"), huge_tree=True):
+        parent = element.getparent()
+        if event == "start":
+            if parent is None or (element.tag == body_level and parent is containers[0]):
+                containers.append(element)
+                yield "open", element, None
+            continue
+
+        if containers and element is containers[-1]:
+            containers.pop()
+            yield "close", element, None
+            continue
+        if not containers or parent is not containers[-1]:
+            # Внутри единицы - ждём её конца
+            continue
+
+        if parent.tag == body_level:
+            index += 1
+            yield "unit", element, index
+        else:
+            yield "unit", element, None
+        element.clear()
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def element_path(part_name, index, cell=None):
+    """
+    cell - (строка, ячейка в строке) для ячейки таблицы, None - вся единица.
+    """
+    if cell is None:
+        return f"{part_name}#{index}"
+    return f"{part_name}#{index}/{cell[0]}/{cell[1]}"
+
+
+def parse_element_path(path):
+    """
+    (часть архива, номер единицы, (строка, ячейка) или None).
+    """
+    part_name, _, location = path.rpartition("#")
+    index, *cell = location.split("/")
+    return part_name, int(index), (int(cell[0]), int(cell[1])) if cell else None
+
+
+# --- Пакет ---
+
+def read_relationships(zin, part_name):
+    """
+    {rId: (тип, имя части в архиве)} для связей части part_name ("" - корневые связи пакета).
+    """
+    directory, name = posixpath.split(part_name)
+    rels_name = posixpath.join(directory, "_rels", f"{name}.rels")
+    if rels_name not in zin.NameToInfo:
+        return {}
+    relationships = {}
+    root = etree.fromstring(zin.read(rels_name))
+    for rel in root.iterchildren(f"{{{PKG_REL_NS}}}Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target")
+        if target.startswith("/"):
+            target_name = target.lstrip("/")
+        else:
+            target_name = posixpath.normpath(posixpath.join(directory, target))
+        relationships[rel.get("Id")] = (rel.get("Type"), target_name)
+    return relationships
+
+
+def find_part(relationships, rel_suffix, default=None):
+    return next((target for rel_type, target in relationships.values() if rel_type.endswith(rel_suffix)), default)
+
+
+def document_part_name(zin):
+    return find_part(read_relationships(zin, ""), OFFICE_DOCUMENT_REL, DEFAULT_DOCUMENT_PART)
+
+
+def read_style_names(zin, document_rels):
+    """
+    ({ID стиля: имя}, имя стиля параграфа по умолчанию) из styles.xml.
+    Имена встроенных стилей английские ("heading 1") и в локализованном Word, ID - нет.
+    """
+    styles_name = find_part(document_rels, STYLES_REL)
+    names = {}
+    default_name = "Normal"
+    if styles_name is None or styles_name not in zin.NameToInfo:
+        return names, default_name
+    root = etree.fromstring(zin.read(styles_name))
+    for style in root.iterchildren(W_STYLE):
+        name = style.find(W_NAME)
+        if name is None:
+            continue
+        names[style.get(W_STYLE_ID)] = name.get(W_VAL)
+        if style.get(W_TYPE) == "paragraph" and style.get(W_DEFAULT) in ("1", "true"):
+            default_name = name.get(W_VAL)
+    return names, default_name
+
+
+def unit_sect_pr(element):
+    """
+    sectPr, которым заканчивается секция: в pPr параграфа-разрыва или последний в w:body.
+    """
+    if element.tag == W_SECTPR:
+        return element
+    if element.tag == W_P:
+        p_pr = element.find(W_PPR)
+        if p_pr is not None:
+            return p_pr.find(W_SECTPR)
+    return None
+
+
+def _default_reference(sect_pr, tag):
+    for reference in sect_pr.iterchildren(w(tag)):
+        if reference.get(W_TYPE, "default") == "default":
+            return reference.get(f"{{{R_NS}}}id")
+    return None
+
+
+def section_references(sect_pr):
+    """
+    (rId основного верхнего колонтитула, rId нижнего) секции; None - наследуется от предыдущей.
+    """
+    return _default_reference(sect_pr, "headerReference"), _default_reference(sect_pr, "footerReference")
+
+
+def resolve_section_parts(sections, document_rels):
+    """
+    Части колонтитулов по секциям: [(верхний, нижний), ...] с наследованием от предыдущей
+    секции, как section.header / section.footer в python-docx. None - колонтитула нет.
+    """
+    resolved = []
+    current = [None, None]
+    for references in sections:
+        for kind, rel_id in enumerate(references):
+            if rel_id is not None and rel_id in document_rels:
+                current[kind] = document_rels[rel_id][1]
+        resolved.append(tuple(current))
+    return resolved
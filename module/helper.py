@@ -1,3 +1,8 @@
+import numpy as np
+
+# Начиная с этого числа bbox filter_contained_boxes переходит на sweep-вариант
+SWEEP_MIN_BOXES = 512
+
 def calculate_area(box):
     """Рассчитывает площадь bbox.
     box: [xmin, ymin, xmax, ymax]
@@ -46,42 +51,125 @@ def is_inside(inner_box, outer_box, tolerance=0.0):
             outer_box[2] + tolerance >= inner_box[2] and
             outer_box[3] + tolerance >= inner_box[3])
 
-def filter_contained_boxes(boxes,labels):
+def boxes_to_array(boxes):
+    """
+    Приводит список bbox к массиву формы (n, 4): [xmin, ymin, xmax, ymax].
+    """
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+def calculate_areas(boxes):
+    """Векторный calculate_area: площади всех bbox, вырожденные дают 0."""
+    b = boxes_to_array(boxes)
+    widths = b[:, 2] - b[:, 0]
+    heights = b[:, 3] - b[:, 1]
+    return np.where((widths > 0) & (heights > 0), widths * heights, 0.0)
+
+def calculate_iou_matrix(boxes1, boxes2):
+    """
+    Векторный calculate_iou: матрица IoU формы (len(boxes1), len(boxes2)).
+    """
+    b1 = boxes_to_array(boxes1)[:, None, :]
+    b2 = boxes_to_array(boxes2)[None, :, :]
+
+    inter_w = np.maximum(0.0, np.minimum(b1[..., 2], b2[..., 2]) - np.maximum(b1[..., 0], b2[..., 0]))
+    inter_h = np.maximum(0.0, np.minimum(b1[..., 3], b2[..., 3]) - np.maximum(b1[..., 1], b2[..., 1]))
+    intersection_area = inter_w * inter_h
+
+    union_area = calculate_areas(boxes1)[:, None] + calculate_areas(boxes2)[None, :] - intersection_area
+
+    iou = np.zeros_like(intersection_area)
+    np.divide(intersection_area, union_area, out=iou, where=union_area != 0)  # Избегаем деления на ноль
+    return iou
+
+def nms(boxes, scores, iou_threshold=0.5):
+    """
+    Non-maximum suppression по IoU.
+    Возвращает индексы оставленных bbox в порядке убывания score.
+    """
+    b = boxes_to_array(boxes)
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+    keep = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(int(best))
+        rest = order[1:]
+        if rest.size == 0:
+            break
+        iou = calculate_iou_matrix(b[best:best + 1], b[rest])[0]
+        order = rest[iou <= iou_threshold]
+    return keep
+
+def containment_matrix(boxes, tolerance=0.0):
+    """
+    Матрица вложенности: m[i, j] == is_inside(boxes[i], boxes[j], tolerance) для i != j.
+    Память O(n^2), для тысяч bbox лучше _contained_mask_sweep.
+    """
+    b = boxes_to_array(boxes)
+    inner = b[:, None, :]
+    outer = b[None, :, :]
+    m = ((outer[..., 0] - tolerance <= inner[..., 0]) &
+         (outer[..., 1] - tolerance <= inner[..., 1]) &
+         (outer[..., 2] + tolerance >= inner[..., 2]) &
+         (outer[..., 3] + tolerance >= inner[..., 3]))
+    np.fill_diagonal(m, False)  # Не сравниваем bbox сам с собой
+    return m
+
+def _contained_mask_sweep(b, tolerance=0.0, block_size=256):
+    """
+    Для каждого bbox: содержится ли он в каком-нибудь другом.
+    Bbox сортируются по xmin, и для i проверяется только префикс с xmin_j <= xmin_i + tolerance
+    (остальные не могут его содержать). Строки обрабатываются блоками, память O(block_size * n).
+    """
+    n = len(b)
+    order = np.argsort(b[:, 0], kind="stable")
+    s = b[order]
+    limits = np.searchsorted(s[:, 0], s[:, 0] + tolerance, side="right")
+
+    contained = np.zeros(n, dtype=bool)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        limit = int(limits[start:stop].max())
+        if limit == 0:
+            continue
+        inner = s[start:stop, None, :]
+        outer = s[None, :limit, :]
+        m = ((outer[..., 0] - tolerance <= inner[..., 0]) &
+             (outer[..., 1] - tolerance <= inner[..., 1]) &
+             (outer[..., 2] + tolerance >= inner[..., 2]) &
+             (outer[..., 3] + tolerance >= inner[..., 3]))
+        rows = np.arange(start, stop)
+        self_cols = rows < limit
+        m[self_cols.nonzero()[0], rows[self_cols]] = False  # Не сравниваем bbox сам с собой
+        contained[start:stop] = m.any(axis=1)
+
+    mask = np.empty(n, dtype=bool)
+    mask[order] = contained
+    return mask
+
+def filter_contained_boxes(boxes, labels, tolerance=0.0, method="auto"):
     """
     Фильтрует список bbox, удаляя те, которые полностью содержатся в других.
     boxes: список bbox, где каждый bbox это [xmin, ymin, xmax, ymax]
+    method: "matrix" - полная матрица вложенности, "sweep" - сортировка по xmin и проход блоками,
+            "auto" - sweep для страниц больше SWEEP_MIN_BOXES bbox.
+    Как и раньше, bbox удаляется, если он внутри любого другого (даже тоже удалённого),
+    поэтому полные дубликаты удаляются оба.
     """
-    if not boxes:
-        return []
+    if len(boxes) == 0:
+        return [], []
 
-    n = len(boxes)
-    # Изначально считаем, что все bbox нужно сохранить
-    keep_mask = [True] * n
+    b = boxes_to_array(boxes)
+    if method == "auto":
+        method = "sweep" if len(b) > SWEEP_MIN_BOXES else "matrix"
 
-    for i in range(n):
-        # Если i-й bbox уже помечен на удаление, пропускаем его
-        if not keep_mask[i]:
-            continue
+    if method == "matrix":
+        contained = containment_matrix(b, tolerance).any(axis=1)
+    elif method == "sweep":
+        contained = _contained_mask_sweep(b, tolerance)
+    else:
+        raise ValueError(f"Неизвестный метод фильтрации: {method}")
 
-        for j in range(n):
-            if i == j:  # Не сравниваем bbox сам с собой
-                continue
-            
-            # Если j-й bbox (потенциальный контейнер) уже помечен на удаление,
-            # он не может содержать i-й. Это необязательная оптимизация, т.к.
-            # если j удален, он не будет в итоговом списке.
-            # if not keep_mask[j]:
-            #     continue
-
-            box_i = boxes[i]
-            box_j = boxes[j] # Потенциальный контейнер для box_i
-
-            # Если box_i находится внутри box_j
-            if is_inside(box_i, box_j):
-                # Тогда box_i нужно удалить
-                keep_mask[i] = False
-                break # box_i уже содержится в box_j, нет смысла проверять другие контейнеры для box_i
-    
-    filtered_boxes = [boxes[i] for i in range(n) if keep_mask[i]]
-    filtered_labels = [labels[i] for i in range(n) if keep_mask[i]]
-    return filtered_boxes,filtered_labels
+    keep = np.flatnonzero(~contained)
+    filtered_boxes = [boxes[i] for i in keep]
+    filtered_labels = [labels[i] for i in keep]
+    return filtered_boxes, filtered_labels
@@ -11,7 +11,10 @@ import torch
 from PIL import Image, ImageDraw, ImageFont
 load_dotenv()
  # можно пользовать для того чтобы генерация была более лучше 
-from module.config import id2label
+from module.config import id2label, LAYOUT_BATCH_SIZE
+
+LAYOUT_MODEL_NAME = "cmarkea/detr-layout-detection"
+LAYOUT_THRESHOLD = 0.5
 # "id2label": {
 #     "0": "Caption",
 #     "1": "Footnote",
@@ -28,23 +31,48 @@ from module.config import id2label
 class Layout:
     def __init__(self):
         self.img_proc = AutoImageProcessor.from_pretrained(
-            "cmarkea/detr-layout-detection"
+            LAYOUT_MODEL_NAME
         )
         self.model = DetrForSegmentation.from_pretrained(
-            "cmarkea/detr-layout-detection"
+            LAYOUT_MODEL_NAME
         ).to("cuda").eval()
 
-    def detect_layout(self,img, threshold=0.5):
-        with torch.inference_mode():
-            input_ids = self.img_proc(img, return_tensors='pt').to("cuda")
-            output = self.model(**input_ids)
+    def detect_layout(self,img, threshold=LAYOUT_THRESHOLD):
+        return self.detect_layout_batch([img], threshold=threshold)[0]
 
+    def detect_layout_batch(self, images, batch_size=LAYOUT_BATCH_SIZE, threshold=LAYOUT_THRESHOLD):
+        """
+        Детекция layout сразу для нескольких страниц.
+        Возвращает список пар (bboxes, labels) в порядке images.
+        """
+        results = []
+        for start in range(0, len(images), batch_size):
+            # Страницы могут прийти в сером (RASTER_COLORSPACE = "gray"), DETR ждёт 3 канала
+            batch = [img if img.mode == "RGB" else img.convert("RGB") for img in images[start:start + batch_size]]
+            with torch.inference_mode():
+                input_ids = self.img_proc(batch, return_tensors='pt').to("cuda")
+                output = self.model(**input_ids)
 
+            bbox_pred = self.img_proc.post_process_object_detection(
+                output,
+                threshold=threshold,
+                target_sizes=[img.size[::-1] for img in batch]
+            )
 
-        bbox_pred = self.img_proc.post_process_object_detection(
-            output,
-            threshold=threshold,
-            target_sizes=[img.size[::-1]]
-        )
-        return list(map(lambda box: box.cpu().tolist(),bbox_pred[0]['boxes'])), list(map(lambda label: id2label[str(label.item())],bbox_pred[0]['labels']))
+            # Один перенос на CPU для всего батча вместо .cpu() на каждый bbox
+            counts = [len(pred['labels']) for pred in bbox_pred]
+            all_boxes = torch.cat([pred['boxes'] for pred in bbox_pred]).cpu().tolist()
+            all_labels = torch.cat([pred['labels'] for pred in bbox_pred]).cpu().tolist()
+
+            offset = 0
+            for count in counts:
+                boxes = all_boxes[offset:offset + count]
+                labels = [id2label[str(label)] for label in all_labels[offset:offset + count]]
+                results.append((boxes, labels))
+                offset += count
+        return results
 
+    def unload(self):
+        # Освобождает GPU; дальше объект не используется (см. module.models.ModelManager)
+        self.model.to("cpu")
+        self.model = None
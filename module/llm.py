@@ -2,7 +2,24 @@ from vllm import LLM, SamplingParams
 MODEL_NAME = "RefalMachine/RuadaptQwen2.5-14B-Instruct-1M"
 SAMPLING_PARAMS = SamplingParams(temperature=0.7, top_p=0.9, max_tokens=500)
 import os
-from .config import anonymize_text_tokens
+import re
+import math
+import logging
+from .config import (
+    anonymize_text_tokens,
+    LLM_CACHE_PATH,
+    LLM_CACHE_MAX_BYTES,
+    LLM_DETERMINISTIC,
+    LLM_MAX_MODEL_LEN,
+    LLM_OUTPUT_RATIO,
+    LLM_OUTPUT_MARGIN,
+    LLM_CUDA_VISIBLE_DEVICES,
+    LLM_GPU_MEMORY_UTILIZATION,
+)
+from .cache import DiskCache, make_key
+from .llm_plan import plan_generation
+
+logger = logging.getLogger(__name__)
 
 PROMPT_TEMPLATE = f"""Перефразируй следующий текст, сохраняя его первоначальный смысл. Важно: следующие плейсхолдеры должны остаться в тексте БЕЗ ИЗМЕНЕНИЙ:
 {anonymize_text_tokens}
@@ -13,29 +30,235 @@ PROMPT_TEMPLATE = f"""Перефразируй следующий текст, с
 Перефразированный текст:
 """
 
+# Границы предложений: после . ! ? … и перевод строки
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def split_sentences(text):
+    """
+    Предложения текста и разделитель после каждого (у последнего - ""), как они стояли в тексте:
+    переводы строк (строки таблиц, пункты списков, адреса) сохраняются при обратной склейке.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        sentence = text[start:match.start()]
+        if sentence.strip():
+            sentences.append([sentence, match.group()])
+        elif sentences:
+            # Пустой кусок (например, пробелы между переводами строк) - часть разделителя
+            sentences[-1][1] += sentence + match.group()
+        start = match.end()
+    if text[start:].strip() or not sentences:
+        sentences.append([text[start:], ""])
+    return [tuple(sentence) for sentence in sentences]
+
+
+def pack_pieces(pieces, counts, limit, separators=None):
+    """
+    Жадно склеивает куски подряд, пока сумма токенов не превышает limit.
+    separators[i] - разделитель после i-го куска (по умолчанию пробел).
+    Возвращает список (текст, число токенов, разделитель после куска; у последнего - "").
+    """
+    if separators is None:
+        separators = [" "] * len(pieces)
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece, count, separator in zip(pieces, counts, separators):
+        if current and current_tokens + count > limit:
+            chunks.append(("".join(current[:-1]), current_tokens, current[-1]))
+            current = []
+            current_tokens = 0
+        current.extend((piece, separator))
+        current_tokens += count
+    if current:
+        chunks.append(("".join(current[:-1]), current_tokens, ""))
+    return chunks
+
+
 class GENERATE_TEXT:
-    def __init__(self):
-        os.environ["CUDA_VISIBLE_DEVICES"] = "1"
+    def __init__(self, cache=None, deterministic=LLM_DETERMINISTIC):
+        if LLM_CUDA_VISIBLE_DEVICES is not None:
+            os.environ["CUDA_VISIBLE_DEVICES"] = LLM_CUDA_VISIBLE_DEVICES
 
         self.llm = LLM(
             model=MODEL_NAME,
             trust_remote_code=True,
         tensor_parallel_size=1,
-        gpu_memory_utilization=0.7,
-        max_model_len=1200,
-        dtype="bfloat16"
+        gpu_memory_utilization=LLM_GPU_MEMORY_UTILIZATION,
+        max_model_len=LLM_MAX_MODEL_LEN,
+        dtype="bfloat16",
+        # Все промпты начинаются с одного PROMPT_TEMPLATE: его KV-кэш считается один раз
+        enable_prefix_caching=True,
       )
+        # Кэш перефразировок между запусками (LLM_CACHE_PATH = None - без кэша)
+        if cache is None and LLM_CACHE_PATH:
+            cache = DiskCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES)
+        self.cache = cache
+        # В детерминированном режиме seed каждого запроса выводится из его ключа,
+        # поэтому закэшированный ответ совпадает с тем, что дала бы модель заново
+        self.deterministic = deterministic
+        self.last_plan_stats = None
+
+        self.tokenizer = self.llm.get_tokenizer()
+        # Сколько токенов занимает шаблон без текста
+        prompt_overhead = self.count_tokens([PROMPT_TEMPLATE.format(text_to_rephrase="")])[0]
+        # Кусок текста вместе с шаблоном и ответом (LLM_OUTPUT_RATIO от входа + запас)
+        # должен влезть в контекст, а ответ - в SAMPLING_PARAMS.max_tokens
+        self.max_chunk_tokens = max(1, int(min(
+            (LLM_MAX_MODEL_LEN - prompt_overhead - LLM_OUTPUT_MARGIN) / (1 + LLM_OUTPUT_RATIO),
+            (SAMPLING_PARAMS.max_tokens - LLM_OUTPUT_MARGIN) / LLM_OUTPUT_RATIO,
+        )))
+
+    def unload(self):
+        """
+        Останавливает движок vLLM. Если просто отпустить ссылку на LLM, веса, KV-кэш
+        и распределённые группы остаются на GPU, и следующая модель (OCR после вытеснения
+        LLM менеджером) падает по памяти. Остальную память вернут gc и torch.cuda.empty_cache
+        в models.release_model.
+        """
+        llm, self.llm, self.tokenizer = self.llm, None, None
+        if llm is None:
+            return
+        engine = getattr(llm, "llm_engine", None)
+        # Новые версии vLLM закрывают процессы движка сами, в старых закрываем executor
+        shutdown = getattr(engine, "shutdown", None)
+        if shutdown is not None:
+            shutdown()
+        executor = getattr(engine, "model_executor", None)
+        if executor is not None and hasattr(executor, "shutdown"):
+            executor.shutdown()
+        if engine is not None:
+            del llm.llm_engine
+        del engine, executor, llm
+
+        try:
+            from vllm.distributed.parallel_state import destroy_model_parallel, destroy_distributed_environment
+        except ImportError:
+            logger.warning("vLLM без destroy_model_parallel: память GPU может освободиться не полностью")
+            return
+        destroy_model_parallel()
+        destroy_distributed_environment()
+
+    def count_tokens(self, texts):
+        """
+        Длины текстов в токенах модели, одним вызовом токенизатора на весь список.
+        """
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+    def chunk_texts(self, texts):
+        """
+        Для каждого текста - список кусков (текст, число токенов, разделитель после куска)
+        не длиннее max_chunk_tokens; текст = куски, склеенные через свои разделители.
+        Длинные тексты режутся по границам предложений, слишком длинные предложения - по словам.
+        """
+        limit = self.max_chunk_tokens
+        counts = self.count_tokens(texts)
+        chunked = [[(text, count, "")] for text, count in zip(texts, counts)]
 
+        long_ids = [i for i, count in enumerate(counts) if count > limit]
+        if not long_ids:
+            return chunked
 
+        sentences = {i: split_sentences(texts[i]) for i in long_ids}
+        all_sentences = [sentence for i in long_ids for sentence, _ in sentences[i]]
+        sentence_counts = iter(self.count_tokens(all_sentences))
+
+        for i in long_ids:
+            pieces = []
+            piece_counts = []
+            separators = []
+            for sentence, separator in sentences[i]:
+                count = next(sentence_counts)
+                if count <= limit:
+                    pieces.append(sentence)
+                    piece_counts.append(count)
+                    separators.append(separator)
+                    continue
+                # Предложение само не влезает - режем по словам; после последнего куска - разделитель предложения
+                words = sentence.split()
+                for chunk, chunk_count, word_separator in pack_pieces(
+                        words, self.count_tokens([" " + w for w in words]), limit):
+                    pieces.append(chunk)
+                    piece_counts.append(chunk_count)
+                    separators.append(word_separator or separator)
+            chunked[i] = pack_pieces(pieces, piece_counts, limit, separators)
+        return chunked
+
+    def cache_key(self, text):
+        return make_key(MODEL_NAME, repr(SAMPLING_PARAMS), PROMPT_TEMPLATE, LLM_OUTPUT_RATIO, LLM_OUTPUT_MARGIN,
+                        "seeded" if self.deterministic else "sampled", text)
+
+    def sampling_params(self, key, n_tokens):
+        """
+        max_tokens пропорционально длине входа: короткие запросы не резервируют
+        KV-кэш под 500 токенов, и vLLM держит больше запросов одновременно.
+        """
+        params = SAMPLING_PARAMS.clone()
+        params.max_tokens = min(SAMPLING_PARAMS.max_tokens, math.ceil(n_tokens * LLM_OUTPUT_RATIO) + LLM_OUTPUT_MARGIN)
+        if self.deterministic:
+            params.seed = int(key[:8], 16)
+        return params
 
     def generate_text(self, texts):
-        full_prompts = []
-        for text in texts:
-            full_prompts.append(PROMPT_TEMPLATE.format(text_to_rephrase=text))
-
-        outputs = self.llm.generate(full_prompts, SAMPLING_PARAMS)
-        rephrased_texts = []
-        for i, output in enumerate(outputs):
-            generated_text = output.outputs[0].text.strip() # Берем первый сгенерированный вариант
-            rephrased_texts.append(generated_text)
-        return rephrased_texts
\ No newline at end of file
+        texts = list(texts)
+        chunked = self.chunk_texts(texts)
+
+        keys = [[self.cache_key(chunk) for chunk, _, _ in chunks] for chunks in chunked]
+        flat_keys = [key for text_keys in keys for key in text_keys]
+        results = self.cache.get_many(flat_keys) if self.cache is not None else {}
+
+        # В модель уходят только промахи кэша, одинаковые куски - один раз
+        missing = {}
+        for text_keys, chunks in zip(keys, chunked):
+            for key, chunk in zip(text_keys, chunks):
+                if key not in results and key not in missing:
+                    missing[key] = chunk
+
+        if missing:
+            # Длинные запросы первыми: планировщик vLLM плотнее пакует батчи,
+            # и в конце не остаётся одинокий длинный запрос
+            order = sorted(missing, key=lambda key: missing[key][1], reverse=True)
+            full_prompts = []
+            params = []
+            for key in order:
+                chunk, n_tokens, _ = missing[key]
+                full_prompts.append(PROMPT_TEMPLATE.format(text_to_rephrase=chunk))
+                params.append(self.sampling_params(key, n_tokens))
+
+            outputs = self.llm.generate(full_prompts, params)
+            generated = {}
+            for key, output in zip(order, outputs):
+                generated[key] = output.outputs[0].text.strip() # Берем первый сгенерированный вариант
+
+            if self.cache is not None:
+                self.cache.put_many(generated)
+            results.update(generated)
+
+        # Куски длинных текстов собираются обратно в исходном порядке, через исходные разделители
+        rephrased_texts = [
+            "".join(results[key] + separator for key, (_, _, separator) in zip(text_keys, chunks))
+            for text_keys, chunks in zip(keys, chunked)
+        ]
+        return rephrased_texts
+
+    def generate_corpus(self, documents_texts):
+        """
+        Перефразирует сегменты сразу всех документов одним потоком запросов к vLLM.
+        documents_texts - список списков текстов (по документу на список),
+        результат той же формы: result[document][segment].
+
+        Одинаковые сегменты (с точностью до пробелов) уходят в модель один раз,
+        тривиальные (номера страниц, даты, одиночные плейсхолдеры) возвращаются как есть.
+        Статистика сэкономленных вызовов - self.last_plan_stats.
+        """
+        plan = plan_generation(documents_texts)
+        generated = self.generate_text(plan.unique_texts) if plan.unique_texts else []
+        self.last_plan_stats = plan.stats
+        logger.info("LLM: сегментов %d, запросов %d, сэкономлено %d (тривиальных %d, дубликатов %d)",
+                    plan.stats['segments'], plan.stats['llm_calls'], plan.stats['llm_calls_avoided'],
+                    plan.stats['trivial'], plan.stats['duplicates'])
+        return plan.apply(generated)
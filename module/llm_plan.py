@@ -0,0 +1,91 @@
+"""
+Планировщик перед LLM: дедупликация сегментов по всему корпусу и
+пропуск сегментов, которые нечего перефразировать.
+
+plan_generation раскладывает сегменты всех документов на:
+  - тривиальные (номера страниц, даты, одиночный плейсхолдер, пунктуация) -
+    возвращаются как есть, без LLM;
+  - остальные - дедуплицируются по нормализованному (пробелы) ключу: в LLM уходит
+    один промпт на уникальный текст, результат раздаётся всем копиям.
+    В LLM идёт исходный текст первой копии: переводы строк в таблицах ("a | b\nc | d")
+    и между предложениями должны дойти до модели и до записи.
+"""
+import re
+
+from module.config import anonymize_text_tokens, LLM_TRIVIAL_MIN_LETTERS, LLM_TRIVIAL_PATTERNS
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDERS = re.compile("|".join(re.escape(token) for token in anonymize_text_tokens))
+_LETTER = re.compile(r"[^\W\d_]")
+_TRIVIAL_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in LLM_TRIVIAL_PATTERNS]
+
+
+def normalize_text(text):
+    """
+    Ключ дедупликации: пробелы и переводы строк схлопываются, края обрезаются.
+    """
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def is_trivial(text, min_letters=LLM_TRIVIAL_MIN_LETTERS, patterns=_TRIVIAL_PATTERNS):
+    """
+    True, если сегмент не нужно перефразировать: без плейсхолдеров в нём меньше
+    min_letters букв (номер страницы, пунктуация, одни плейсхолдеры)
+    или он целиком совпадает с одним из шаблонов (даты и т.п.).
+    """
+    letters = len(_LETTER.findall(_PLACEHOLDERS.sub("", text)))
+    if letters < min_letters:
+        return True
+    return any(pattern.fullmatch(text) for pattern in patterns)
+
+
+class GenerationPlan:
+    """
+    unique_texts - тексты, которые нужно отправить в LLM (первая копия каждого уникального, как есть);
+    slots[document][segment] - индекс в unique_texts или None для тривиального сегмента;
+    stats - сколько вызовов LLM сэкономлено.
+    """
+    def __init__(self, documents_texts):
+        self.documents_texts = documents_texts
+        self.unique_texts = []
+        self.slots = []
+
+        index_by_text = {}
+        total = 0
+        trivial = 0
+        for texts in documents_texts:
+            doc_slots = []
+            for text in texts:
+                total += 1
+                normalized = normalize_text(text)
+                if is_trivial(normalized):
+                    trivial += 1
+                    doc_slots.append(None)
+                    continue
+                if normalized not in index_by_text:
+                    index_by_text[normalized] = len(self.unique_texts)
+                    self.unique_texts.append(text)
+                doc_slots.append(index_by_text[normalized])
+            self.slots.append(doc_slots)
+
+        self.stats = {
+            "segments": total,
+            "trivial": trivial,
+            "duplicates": total - trivial - len(self.unique_texts),
+            "llm_calls": len(self.unique_texts),
+            "llm_calls_avoided": total - len(self.unique_texts),
+        }
+
+    def apply(self, generated):
+        """
+        generated - ответы LLM в порядке unique_texts.
+        Возвращает результат в форме documents_texts; тривиальные сегменты - без изменений.
+        """
+        return [
+            [text if slot is None else generated[slot] for text, slot in zip(texts, doc_slots)]
+            for texts, doc_slots in zip(self.documents_texts, self.slots)
+        ]
+
+
+def plan_generation(documents_texts):
+    return GenerationPlan([list(texts) for texts in documents_texts])
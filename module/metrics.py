@@ -0,0 +1,277 @@
+"""
+Метрики и трассировка этапов пайплайна.
+
+    metrics = Metrics()
+    with metrics.stage("ocr", document=data['file']) as record:
+        ...
+        record["items"] = len(crops)
+
+На каждый вызов stage пишется запись: время, число элементов, элементов/с,
+RSS процесса (текущий и пиковый) и, если torch уже загружен и есть CUDA, пик памяти GPU
+(счётчик пика CUDA не сбрасывается, см. _stage_gpu_peak).
+Записи идут строками JSON в jsonl_path; summary()/write_prometheus() дают сводку по этапам.
+
+Выключенный Metrics(enabled=False) отдаёт один и тот же пустой контекст,
+поэтому инструментирование горячих циклов почти ничего не стоит.
+
+profile_stages - этапы, первые profile_window вызовов которых снимаются профайлером:
+"cprofile" (файлы .prof для pstats/snakeviz) или "torch" (chrome trace).
+"""
+import cProfile
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+
+from module.config import (
+    LOG_LEVEL,
+    METRICS_ENABLED,
+    METRICS_JSONL_PATH,
+    METRICS_PROMETHEUS_PATH,
+    METRICS_PROFILE_STAGES,
+    METRICS_PROFILER,
+    METRICS_PROFILE_WINDOW,
+    METRICS_PROFILE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def setup_logging(level=LOG_LEVEL):
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def current_rss_mb():
+    """
+    Текущий RSS процесса (Linux, /proc); None, если недоступен.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 1024**2
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def _cuda():
+    # torch не импортируем сами: если пайплайн работает без него, GPU-метрик просто нет
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        return torch.cuda
+    return None
+
+
+def _stage_gpu_peak(cuda, start_allocated, start_peak):
+    """
+    Пик памяти GPU за этап без сброса счётчика процесса: если пик процесса вырос,
+    он достигнут во время этапа; иначе - нижняя оценка по памяти в начале и в конце этапа.
+    При параллельных этапах в пик попадает и память соседей.
+    """
+    peak = cuda.max_memory_allocated()
+    if peak > start_peak:
+        return peak
+    return max(start_allocated, cuda.memory_allocated())
+
+
+class Metrics:
+    """
+    enabled: False - stage() ничего не измеряет и не пишет
+    jsonl_path: куда дописывать записи (None - только в памяти)
+    prometheus_path: куда close() запишет сводку в текстовом формате Prometheus
+    """
+    def __init__(self, enabled=METRICS_ENABLED, jsonl_path=METRICS_JSONL_PATH,
+                 prometheus_path=METRICS_PROMETHEUS_PATH, profile_stages=METRICS_PROFILE_STAGES,
+                 profiler=METRICS_PROFILER, profile_window=METRICS_PROFILE_WINDOW, profile_dir=METRICS_PROFILE_DIR):
+        if profiler not in ("cprofile", "torch"):
+            raise ValueError(f"Неизвестный профайлер: {profiler}")
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.profile_stages = set(profile_stages or ())
+        self.profiler = profiler
+        self.profile_window = profile_window
+        self.profile_dir = profile_dir
+        # Последние записи для просмотра; сводка считается нарастающим итогом,
+        # поэтому память не растёт в долгоживущем сервисе
+        self.records = deque(maxlen=1000)
+        self.totals = {}
+        self.lock = threading.Lock()
+        self.profiled = defaultdict(int)
+        self._jsonl = None
+        self._null = nullcontext({})
+
+    def stage(self, name, document=None, items=0):
+        """
+        Контекст измерения этапа name. Внутри можно выставить record["items"]
+        и добавить свои поля в record - они попадут в запись.
+        """
+        if not self.enabled:
+            return self._null
+        return self._measure(name, document, items)
+
+    @contextmanager
+    def _measure(self, name, document, items):
+        record = {"stage": name, "document": document, "items": items}
+        cuda = _cuda()
+        if cuda is not None:
+            # Пик CUDA общий на процесс: не сбрасываем его, иначе вложенные и параллельные этапы
+            # (загрузка модели внутри этапа, потоки сервиса) затирают пики друг друга
+            gpu_start_allocated = cuda.memory_allocated()
+            gpu_start_peak = cuda.max_memory_allocated()
+        profiler = self._start_profiler(name)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            self._stop_profiler(name, profiler)
+            record["seconds"] = seconds
+            record["items_per_s"] = record["items"] / seconds if seconds else 0.0
+            record["rss_mb"] = current_rss_mb()
+            record["peak_rss_mb"] = peak_rss_mb()
+            if cuda is not None:
+                record["gpu_peak_mb"] = _stage_gpu_peak(cuda, gpu_start_allocated, gpu_start_peak) / 1024**2
+            record["timestamp"] = time.time()
+            self._emit(record)
+
+    def record(self, name, seconds, document=None, items=0):
+        """
+        Запись этапа, время которого измерено не здесь (например, в воркере пула).
+        """
+        if not self.enabled:
+            return
+        self._emit({
+            "stage": name, "document": document, "items": items, "seconds": seconds,
+            "items_per_s": items / seconds if seconds else 0.0,
+            "rss_mb": current_rss_mb(), "peak_rss_mb": peak_rss_mb(), "timestamp": time.time(),
+        })
+
+    def _start_profiler(self, name):
+        if name not in self.profile_stages:
+            return None
+        with self.lock:
+            if self.profiled[name] >= self.profile_window:
+                return None
+            self.profiled[name] += 1
+            index = self.profiled[name]
+        if self.profiler == "torch":
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+            profiler.__enter__()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler, index
+
+    def _stop_profiler(self, name, started):
+        if started is None:
+            return
+        profiler, index = started
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if self.profiler == "torch":
+            profiler.__exit__(None, None, None)
+            path = os.path.join(self.profile_dir, f"{name}_{index}.json")
+            profiler.export_chrome_trace(path)
+        else:
+            profiler.disable()
+            path = os.path.join(self.profile_dir, f"{name}_{index}.prof")
+            profiler.dump_stats(path)
+        logger.info("Профиль этапа %s сохранён в %s", name, path)
+
+    def _emit(self, record):
+        with self.lock:
+            self.records.append(record)
+            totals = self.totals.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "items": 0,
+                                                              "peak_rss_mb": 0.0, "gpu_peak_mb": None})
+            totals["calls"] += 1
+            totals["seconds"] += record["seconds"]
+            totals["items"] += record["items"]
+            totals["peak_rss_mb"] = max(totals["peak_rss_mb"], record["peak_rss_mb"])
+            if "gpu_peak_mb" in record:
+                totals["gpu_peak_mb"] = max(totals["gpu_peak_mb"] or 0.0, record["gpu_peak_mb"])
+            if self.jsonl_path:
+                if self._jsonl is None:
+                    directory = os.path.dirname(self.jsonl_path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._jsonl = open(self.jsonl_path, "a", encoding="utf-8")
+                self._jsonl.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._jsonl.flush()
+        logger.debug("%s %s: %.3f с, %s элементов", record["stage"], record["document"] or "",
+                     record["seconds"], record["items"])
+
+    def summary(self):
+        """
+        Сводка по этапам: {stage: {calls, seconds, items, items_per_s, peak_rss_mb, gpu_peak_mb}}.
+        """
+        with self.lock:
+            stages = {name: dict(totals) for name, totals in self.totals.items()}
+        for stage in stages.values():
+            stage["items_per_s"] = stage["items"] / stage["seconds"] if stage["seconds"] else 0.0
+        return stages
+
+    def prometheus_text(self):
+        metrics = [
+            ("pipeline_stage_calls_total", "counter", "Число вызовов этапа", "calls"),
+            ("pipeline_stage_seconds_total", "counter", "Суммарное время этапа, с", "seconds"),
+            ("pipeline_stage_items_total", "counter", "Обработано элементов", "items"),
+            ("pipeline_stage_items_per_second", "gauge", "Пропускная способность этапа", "items_per_s"),
+            ("pipeline_stage_peak_rss_megabytes", "gauge", "Пиковый RSS процесса", "peak_rss_mb"),
+            ("pipeline_stage_gpu_peak_megabytes", "gauge", "Пик памяти GPU", "gpu_peak_mb"),
+        ]
+        summary = self.summary()
+        lines = []
+        for metric, kind, help_text, field in metrics:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for stage, values in summary.items():
+                if values[field] is not None:
+                    lines.append(f'{metric}{{stage="{stage}"}} {values[field]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        path = path or self.prometheus_path
+        if not path:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Через временный файл, чтобы node_exporter не прочитал недописанный
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.write_prometheus()
+        with self.lock:
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Общий выключенный экземпляр для функций, которым metrics не передали
+DISABLED = Metrics(enabled=False)
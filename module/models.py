@@ -0,0 +1,144 @@
+"""
+Менеджер моделей: ленивая загрузка Layout, OCR и GENERATE_TEXT
+и вытеснение по LRU в пределах бюджета памяти.
+
+Вместо ручного "model.to('cpu'); model = None; gc.collect(); torch.cuda.empty_cache()"
+пайплайн просит модель у менеджера (manager.get("ocr")): если она уже загружена,
+отдаётся та же, если нет - грузится, а давно не использованные модели выгружаются,
+пока новая не влезет в MODEL_MEMORY_BUDGET_GB. На большой карте все модели
+остаются загруженными одновременно.
+
+Фабрики и стоимости можно подменить, поэтому менеджер проверяется
+маленькими моделями-заглушками на CPU.
+"""
+import gc
+import logging
+import threading
+from collections import OrderedDict
+
+from module.config import MODEL_MEMORY_BUDGET_GB, MODEL_MEMORY_COST_GB
+from module.metrics import DISABLED
+
+logger = logging.getLogger(__name__)
+
+
+def default_factories():
+    """
+    Фабрики настоящих моделей; импорт ленивый, чтобы менеджер работал без transformers/vllm.
+    """
+    def layout():
+        from module.layout import Layout
+        return Layout()
+
+    def ocr():
+        from module.ocr import OCR
+        return OCR()
+
+    def llm():
+        from module.llm import GENERATE_TEXT
+        return GENERATE_TEXT()
+
+    return {"layout": layout, "ocr": ocr, "llm": llm}
+
+
+def release_model(model):
+    """
+    Выгружает модель: model.unload(), сборка мусора и очистка кэша CUDA.
+    """
+    unload = getattr(model, "unload", None)
+    if unload is not None:
+        unload()
+    gc.collect()
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class ModelManager:
+    """
+    factories: {имя: функция без аргументов, возвращающая модель}
+    costs: {имя: примерный объём памяти модели в ГБ}
+    budget_gb: сколько памяти могут занимать загруженные модели одновременно
+    metrics: Metrics для времени загрузки ("load_<имя>")
+    """
+    def __init__(self, factories=None, costs=None, budget_gb=MODEL_MEMORY_BUDGET_GB, metrics=None):
+        self.factories = factories if factories is not None else default_factories()
+        self.costs = {**MODEL_MEMORY_COST_GB, **(costs or {})}
+        self.budget_gb = budget_gb
+        self.loaded = OrderedDict()
+        # Защищает loaded: его читают потоки сервиса (/health), пока воркер грузит модели
+        self.lock = threading.Lock()
+        self.metrics = metrics if metrics is not None else DISABLED
+
+    def cost(self, name):
+        if name not in self.factories:
+            raise KeyError(f"Неизвестная модель: {name}")
+        return self.costs.get(name, 0.0)
+
+    def used_gb(self):
+        with self.lock:
+            return sum(self.cost(name) for name in self.loaded)
+
+    def loaded_names(self):
+        """
+        Снимок имён загруженных моделей (от давно использованной к недавней).
+        """
+        with self.lock:
+            return list(self.loaded)
+
+    def fits_together(self, names):
+        """
+        Влезают ли модели names в бюджет одновременно.
+        """
+        return sum(self.cost(name) for name in set(names)) <= self.budget_gb
+
+    def get(self, name):
+        """
+        Возвращает загруженную модель name, при необходимости загружая её
+        и выгружая давно не использованные модели.
+        """
+        with self.lock:
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+                return self.loaded[name]
+
+        cost = self.cost(name)
+        if cost > self.budget_gb:
+            logger.warning("Модель '%s' (%s ГБ) больше бюджета %s ГБ, выгружаем все остальные",
+                           name, cost, self.budget_gb)
+        while self.loaded and self.used_gb() + cost > self.budget_gb:
+            excess = self.used_gb() + cost - self.budget_gb
+            # Если хватает выгрузить одну модель - выгружаем самую давнюю из таких,
+            # остальные остаются загруженными; иначе просто самую давнюю
+            loaded_names = self.loaded_names()
+            victim = next((loaded for loaded in loaded_names if self.cost(loaded) >= excess), loaded_names[0])
+            self.evict(victim)
+
+        with self.metrics.stage(f"load_{name}"):
+            model = self.factories[name]()
+        logger.info("Модель '%s' загружена", name)
+        with self.lock:
+            self.loaded[name] = model
+        return model
+
+    def evict(self, name):
+        with self.lock:
+            model = self.loaded.pop(name, None)
+        if model is not None:
+            release_model(model)
+
+    def close(self):
+        for name in self.loaded_names():
+            self.evict(name)
+
+    def __contains__(self, name):
+        return name in self.loaded
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
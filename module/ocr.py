@@ -1,9 +1,52 @@
 from transformers import Qwen2_5_VLForConditionalGeneration, AutoTokenizer, AutoProcessor
 from qwen_vl_utils import process_vision_info
 import os 
+import math
+from module.config import (
+    OCR_BATCH_SIZE,
+    OCR_CACHE_ENABLED,
+    OCR_ROUTING,
+    OCR_DEFAULT_ROUTE,
+    OCR_TOKENS_ROUNDING,
+)
+from module.cache import make_key
+from module.ocr_cache import OCRCache
 
-def ocr(img,model,processor, ):
-    messages = [
+OCR_MODEL_NAME = "Qwen/Qwen2.5-VL-7B-Instruct"
+# The default range for the number of visual tokens per image in the model is 4-16384.
+# You can set min_pixels and max_pixels according to your needs, such as a token range of 256-1280, to balance performance and cost.
+OCR_MIN_PIXELS = 256*28*28
+OCR_MAX_PIXELS = 1280*28*28
+
+OCR_PROMPT = "Please perform OCR on this image. Return the recognized text exactly as it appears in the image, without translation."
+# OCR_PROMPT = "Please perform OCR on this image. The text is in Russian. Return the recognized text exactly as it appears in the image, without translation." # RU !!!!!!!!!!!!!!!!
+
+# Варианты промпта для OCR_ROUTING
+OCR_PROMPTS = {
+    "default": OCR_PROMPT,
+    "table": "Please perform OCR on this table. Return its content row by row: one row per line, cells separated by ' | '. Return the recognized text exactly as it appears in the image, without translation.",
+}
+
+
+def route_for_label(label):
+    """
+    Настройки OCR для метки layout: OCR_DEFAULT_ROUTE, перекрытый OCR_ROUTING[label].
+    """
+    return {**OCR_DEFAULT_ROUTE, **OCR_ROUTING.get(label, {})}
+
+
+def token_budget(route, img):
+    """
+    max_new_tokens для кропа: базовый бюджет + добавка за площадь, не больше потолка.
+    """
+    width, height = img.size
+    budget = route["max_new_tokens"] + route["tokens_per_megapixel"] * width * height / 1e6
+    budget = math.ceil(budget / OCR_TOKENS_ROUNDING) * OCR_TOKENS_ROUNDING
+    return int(min(route["max_tokens_cap"], budget))
+
+
+def build_messages(img, prompt=OCR_PROMPT):
+    return [
         {
             "role": "user",
             "content": [
@@ -11,18 +54,26 @@ def ocr(img,model,processor, ):
                     "type": "image",
                     "image": img,
                 },
-                # {"type": "text", "text": "Please perform OCR on this image. The text is in Russian. Return the recognized text exactly as it appears in the image, without translation."}, # RU !!!!!!!!!!!!!!!!
-                {"type": "text", "text": "Please perform OCR on this image. Return the recognized text exactly as it appears in the image, without translation."},
+                {"type": "text", "text": prompt},
             ],
         }
     ]
 
-    text = processor.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True
-    )
-    image_inputs, video_inputs = process_vision_info(messages)
+
+def ocr_batch(imgs, model, processor, max_new_tokens=128, prompt=OCR_PROMPT):
+    """
+    OCR нескольких картинок одним вызовом generate.
+    Результаты возвращаются в том же порядке, что и imgs.
+    """
+    messages_batch = [build_messages(img, prompt) for img in imgs]
+
+    texts = [
+        processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        for messages in messages_batch
+    ]
+    image_inputs, video_inputs = process_vision_info(messages_batch)
     inputs = processor(
-        text=[text],
+        text=texts,
         images=image_inputs,
         videos=video_inputs,
         padding=True,
@@ -30,7 +81,8 @@ def ocr(img,model,processor, ):
     )
     inputs = inputs.to("cuda")
 
-    generated_ids = model.generate(**inputs, max_new_tokens=128)
+    generated_ids = model.generate(**inputs, max_new_tokens=max_new_tokens)
+    # Паддинг слева, поэтому у всех промптов одна длина и ответ начинается сразу после неё
     generated_ids_trimmed = [
         out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
     ]
@@ -38,12 +90,16 @@ def ocr(img,model,processor, ):
         generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
     )
     return output_text
+
+
+def ocr(img,model,processor, ):
+    return ocr_batch([img], model, processor)
     
 
 class OCR:
-    def __init__(self):
+    def __init__(self, cache=None):
         ocr_model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
-            "Qwen/Qwen2.5-VL-7B-Instruct", torch_dtype="auto", device_map="auto"
+            OCR_MODEL_NAME, torch_dtype="auto", device_map="auto"
         )
 
         # We recommend enabling flash_attention_2 for better acceleration and memory saving, especially in multi-image and video scenarios.
@@ -56,13 +112,80 @@ class OCR:
 
         # processor = AutoProcessor.from_pretrained("Qwen/Qwen2.5-VL-7B-Instruct")
 
-        # The default range for the number of visual tokens per image in the model is 4-16384.
-        # You can set min_pixels and max_pixels according to your needs, such as a token range of 256-1280, to balance performance and cost.
-        min_pixels = 256*28*28
-        max_pixels = 1280*28*28
-        ocr_processor = AutoProcessor.from_pretrained("Qwen/Qwen2.5-VL-7B-Instruct", min_pixels=min_pixels, max_pixels=max_pixels)
+        ocr_processor = AutoProcessor.from_pretrained(OCR_MODEL_NAME, min_pixels=OCR_MIN_PIXELS, max_pixels=OCR_MAX_PIXELS)
+        # Для батчевой генерации decoder-only модели промпты выравниваются по правому краю
+        ocr_processor.tokenizer.padding_side = "left"
         self.model = ocr_model
         self.processor = ocr_processor
 
+        # Кэш по хэшу кропа: повторяющиеся колонтитулы, печати и логотипы
+        # распознаются один раз. Статистика - self.cache.stats()
+        if cache is None and OCR_CACHE_ENABLED:
+            cache = OCRCache(make_key(OCR_MODEL_NAME, OCR_PROMPTS, OCR_MIN_PIXELS, OCR_MAX_PIXELS))
+        self.cache = cache
+
     def ocr(self, img):
-        return ocr(img, self.model, self.processor)[0]
\ No newline at end of file
+        return ocr(img, self.model, self.processor)[0]
+
+    def ocr_batch(self, crops, labels=None, batch_size=OCR_BATCH_SIZE):
+        """
+        OCR списка кропов батчами по batch_size.
+        i-й результат соответствует i-му кропу (и i-му bbox).
+
+        labels - метки layout кропов: по ним OCR_ROUTING решает, пропустить ли регион,
+        каким промптом его читать и сколько токенов дать на генерацию.
+        Без меток все кропы идут с маршрутом по умолчанию.
+        """
+        if labels is None:
+            labels = [None] * len(crops)
+
+        # (вариант промпта, бюджет) для каждого кропа; None - регион пропускается
+        plans = []
+        for crop, label in zip(crops, labels):
+            route = route_for_label(label)
+            plans.append(None if route["skip"] else (route["prompt"], token_budget(route, crop)))
+
+        keys = []
+        for crop, plan in zip(crops, plans):
+            if plan is None:
+                keys.append(None)
+            elif self.cache is not None:
+                keys.append(self.cache.key(crop, *plan))
+            else:
+                keys.append(len(keys))
+        wanted = [key for key in keys if key is not None]
+        results = self.cache.get_many(wanted) if self.cache is not None else {}
+
+        # В модель уходят только кропы с новыми ключами, каждый ключ - один раз.
+        # Группируем по промпту и бюджету: у одного вызова generate один max_new_tokens.
+        groups = {}
+        for key, crop, plan in zip(keys, crops, plans):
+            if key is None or key in results:
+                continue
+            group = groups.setdefault(plan, {})
+            if key not in group:
+                group[key] = crop
+
+        generated = {}
+        for (prompt_name, max_new_tokens), group in sorted(groups.items(), key=lambda item: item[0][1]):
+            texts = self._run_batches(list(group.values()), batch_size, max_new_tokens, OCR_PROMPTS[prompt_name])
+            generated.update(zip(group, texts))
+
+        if self.cache is not None:
+            self.cache.put_many(generated)
+        results.update(generated)
+
+        return ["" if key is None else results[key] for key in keys]
+
+    def unload(self):
+        # device_map="auto" раскладывает модель хуками accelerate, .to("cpu") с ними не работает:
+        # достаточно отпустить ссылки, память вернёт gc + torch.cuda.empty_cache
+        self.model = None
+        self.processor = None
+
+    def _run_batches(self, crops, batch_size, max_new_tokens, prompt):
+        texts = []
+        for start in range(0, len(crops), batch_size):
+            texts.extend(ocr_batch(crops[start:start + batch_size], self.model, self.processor,
+                                   max_new_tokens=max_new_tokens, prompt=prompt))
+        return texts
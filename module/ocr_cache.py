@@ -0,0 +1,227 @@
+"""
+Кэш результатов OCR для повторяющихся кропов.
+
+Колонтитулы, печати и логотипы повторяются на каждой странице, но отсканированные
+копии отличаются шумом и сдвигом bbox на пиксель, поэтому кропы сравниваются
+не по байтам, а по нормализованной (серый, автоконтраст) картинке:
+  - dHash с порогом по расстоянию Хэмминга - быстрый отбор кандидатов;
+  - затем кропы выравниваются (сдвиг до REGION_SHIFT пикселей по профилям яркости), и средняя разница
+    в каждой клетке OCR_CACHE_REGION_CELL x OCR_CACHE_REGION_CELL должна быть в допуске:
+    dHash на сетке 32x16 не различает "Страница 2 из 12" и "Страница 3 из 12", а клетки различают.
+Похожий кроп получает ключ первого кропа своей группы, и модель вызывается один раз
+на группу. Ключ включает идентичность модели и промпта, поэтому смена модели
+или промпта не подхватит старые ответы.
+
+Индекс для поиска похожих живёт в памяти (OCR_CACHE_FUZZY_ENTRIES кропов не крупнее
+OCR_CACHE_FUZZY_MAX_PIXELS); на диске ответы лежат по ключу, поэтому между запусками
+и для крупных кропов находится только точная копия первого кропа группы.
+"""
+import hashlib
+import math
+from collections import OrderedDict
+
+from PIL import Image, ImageChops, ImageOps
+
+from module.cache import DiskCache, make_key
+from module.config import (
+    OCR_CACHE_MAX_ENTRIES, OCR_CACHE_PATH, OCR_CACHE_MAX_BYTES, OCR_CACHE_MAX_DISTANCE, OCR_CACHE_REGION_CELL,
+    OCR_CACHE_REGION_TOLERANCE, OCR_CACHE_FUZZY_ENTRIES, OCR_CACHE_FUZZY_MAX_PIXELS,
+    OCR_CACHE_FUZZY_CANDIDATES,
+)
+
+# Сетка difference hash: (HASH_WIDTH + 1) x HASH_HEIGHT пикселей -> HASH_WIDTH * HASH_HEIGHT бит.
+# Кропы текста вытянуты по горизонтали, поэтому сетка тоже.
+HASH_WIDTH = 32
+HASH_HEIGHT = 16
+# Бит ставится, только если соседние клетки отличаются больше чем на столько уровней яркости:
+# на ровном фоне шум скана не переворачивает биты
+HASH_MARGIN = 8
+# На сколько пикселей по каждой оси сдвигается кроп при сравнении с похожим
+REGION_SHIFT = 2
+
+
+def _normalize(img):
+    return ImageOps.autocontrast(img.convert("L"))
+
+
+def perceptual_hash(gray):
+    """
+    dHash нормализованного кропа: int на HASH_WIDTH * HASH_HEIGHT бит.
+    """
+    small = gray.resize((HASH_WIDTH + 1, HASH_HEIGHT), Image.Resampling.BOX)
+    pixels = small.tobytes()
+
+    bits = 0
+    row_len = HASH_WIDTH + 1
+    for y in range(HASH_HEIGHT):
+        row = pixels[y * row_len:(y + 1) * row_len]
+        for x in range(HASH_WIDTH):
+            bits = (bits << 1) | (row[x] - row[x + 1] > HASH_MARGIN)
+    return bits
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _profile_shift(stored, gray, shift=REGION_SHIFT):
+    """
+    Сдвиг (до shift), при котором профили яркости stored и gray (bytes) совпадают лучше всего.
+    """
+    best_shift, best_error = 0, None
+    for offset in range(-shift, shift + 1):
+        start = max(offset, 0)
+        length = min(len(stored) - start, len(gray) - max(-offset, 0))
+        if length <= 0:
+            continue
+        pairs = zip(stored[start:start + length], gray[max(-offset, 0):max(-offset, 0) + length])
+        error = sum(abs(a - b) for a, b in pairs) / length
+        if best_error is None or error < best_error:
+            best_shift, best_error = offset, error
+    return best_shift
+
+
+def region_distance(stored, gray, cell=OCR_CACHE_REGION_CELL):
+    """
+    Насколько кроп gray отличается от stored (оба нормализованы, размеры могут отличаться на пиксели).
+    Кропы выравниваются (сдвиг до REGION_SHIFT пикселей по профилям яркости столбцов и строк),
+    разница общей части усредняется по клеткам cell x cell.
+    Возвращает наибольшую разницу клетки (0-255).
+    """
+    dx = _profile_shift(stored.resize((stored.width, 1), Image.Resampling.BOX).tobytes(),
+                        gray.resize((gray.width, 1), Image.Resampling.BOX).tobytes())
+    dy = _profile_shift(stored.resize((1, stored.height), Image.Resampling.BOX).tobytes(),
+                        gray.resize((1, gray.height), Image.Resampling.BOX).tobytes())
+    # Общая часть: stored с (left, top), gray с (gray_left, gray_top)
+    left, top = max(dx, 0), max(dy, 0)
+    gray_left, gray_top = max(-dx, 0), max(-dy, 0)
+    width = min(stored.width - left, gray.width - gray_left)
+    height = min(stored.height - top, gray.height - gray_top)
+    if width <= 0 or height <= 0:
+        return 255
+    diff = ImageChops.difference(stored.crop((left, top, left + width, top + height)),
+                                 gray.crop((gray_left, gray_top, gray_left + width, gray_top + height)))
+    cells = (max(1, math.ceil(width / cell)), max(1, math.ceil(height / cell)))
+    return diff.resize(cells, Image.Resampling.BOX).getextrema()[1]
+
+
+def exact_hash(gray):
+    """
+    Хэш всех пикселей нормализованного кропа и его размера.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{gray.width}x{gray.height}".encode())
+    digest.update(gray.tobytes())
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    LRU в памяти (max_entries записей) с необязательным хранилищем на диске.
+    index - кропы для поиска похожих: {key: (контекст, dHash, нормализованный кроп)}, до fuzzy_entries штук.
+    hits - кропы, обслуженные без вызова модели, misses - уникальные ключи, ушедшие в модель.
+    """
+    def __init__(self, identity, max_entries=OCR_CACHE_MAX_ENTRIES, disk_path=OCR_CACHE_PATH,
+                 disk_max_bytes=OCR_CACHE_MAX_BYTES, max_distance=OCR_CACHE_MAX_DISTANCE,
+                 region_tolerance=OCR_CACHE_REGION_TOLERANCE, fuzzy_entries=OCR_CACHE_FUZZY_ENTRIES,
+                 fuzzy_max_pixels=OCR_CACHE_FUZZY_MAX_PIXELS, fuzzy_candidates=OCR_CACHE_FUZZY_CANDIDATES):
+        self.identity = identity
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.region_tolerance = region_tolerance
+        self.fuzzy_entries = fuzzy_entries
+        self.fuzzy_max_pixels = fuzzy_max_pixels
+        self.fuzzy_candidates = fuzzy_candidates
+        self.entries = OrderedDict()
+        self.index = OrderedDict()
+        self.disk = DiskCache(disk_path, disk_max_bytes) if disk_path else None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, img, *extra):
+        """
+        extra - всё, что кроме картинки влияет на ответ (вариант промпта, бюджет токенов, ...).
+        Кроп, похожий на уже виденный с тем же extra, получает его ключ; иначе новый ключ
+        по точному хэшу пикселей.
+        """
+        context = make_key(self.identity, *extra)
+        gray = _normalize(img)
+        key = make_key(context, exact_hash(gray))
+        if gray.width * gray.height > self.fuzzy_max_pixels:
+            return key
+        if key in self.index:
+            self.index.move_to_end(key)
+            return key
+
+        bits = perceptual_hash(gray)
+        # Сравниваем с несколькими недавними кандидатами, прошедшими отбор
+        # по dHash и размеру (bbox того же региона отличается на пиксели)
+        candidates = 0
+        for entry_key, (entry_context, entry_bits, entry_gray) in reversed(self.index.items()):
+            if entry_context != context or hamming_distance(bits, entry_bits) > self.max_distance:
+                continue
+            if (abs(entry_gray.width - gray.width) > 2 * REGION_SHIFT
+                    or abs(entry_gray.height - gray.height) > 2 * REGION_SHIFT):
+                continue
+            if region_distance(entry_gray, gray) <= self.region_tolerance:
+                self.index.move_to_end(entry_key)
+                return entry_key
+            candidates += 1
+            if candidates == self.fuzzy_candidates:
+                break
+
+        self.index[key] = (context, bits, gray)
+        while len(self.index) > self.fuzzy_entries:
+            self.index.popitem(last=False)
+        return key
+
+    def get_many(self, keys):
+        """
+        Возвращает {key: text} для найденных ключей.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                found[key] = self.entries[key]
+            elif key not in found:
+                missing.append(key)
+
+        if missing and self.disk is not None:
+            from_disk = self.disk.get_many(missing)
+            for key, text in from_disk.items():
+                self._remember(key, text)
+            found.update(from_disk)
+
+        # Повтор ещё не распознанного ключа в том же запросе тоже hit:
+        # модель вызывается один раз на уникальный ключ
+        counted_missing = set()
+        for key in keys:
+            if key in found or key in counted_missing:
+                self.hits += 1
+            else:
+                self.misses += 1
+                counted_missing.add(key)
+        return found
+
+    def put_many(self, items):
+        for key, text in items.items():
+            self._remember(key, text)
+        if self.disk is not None:
+            self.disk.put_many(items)
+
+    def _remember(self, key, text):
+        self.entries[key] = text
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.entries),
+        }
@@ -0,0 +1,153 @@
+"""
+Постраничный рендер выходного PDF в пуле процессов.
+
+Каждый сегмент документа знает свою страницу (data['pages']), поэтому страницы
+рисуются независимо: у каждой свой canvas размером с исходную страницу.
+Воркеры возвращают одностраничные PDF, pypdf склеивает их по порядку.
+Время рендера 300-страничного скана растёт не с числом страниц, а с числом страниц на ядро.
+
+Тот же пул пишет и целые документы (pipeline.write_documents): короткие документы
+уходят в воркеры целиком, а внутри воркера страницы рисуются последовательно -
+вложенных пулов нет.
+"""
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+
+from module.config import RENDER_WORKERS, RENDER_MIN_PARALLEL_PAGES, RENDER_MAX_PENDING
+# Импорт pdf_gen регистрирует шрифт: в воркере пула это происходит один раз при распаковке первой задачи
+from module.pdf_gen import draw_layout_page
+
+logger = logging.getLogger(__name__)
+
+
+def split_by_page(texts, bboxes, labels, pages, page_count):
+    """
+    Раскладывает сегменты документа по страницам: [(texts, bboxes, labels), ...] длиной page_count.
+    """
+    split = [([], [], []) for _ in range(page_count)]
+    for text, bbox, label, page_num in zip(texts, bboxes, labels, pages):
+        page_texts, page_bboxes, page_labels = split[page_num]
+        page_texts.append(text)
+        page_bboxes.append(bbox)
+        page_labels.append(label)
+    return split
+
+
+def render_page(texts, bboxes, labels, page_size, target_pagesize=None, debug_draw_bbox_borders=False):
+    """
+    Рендерит одну страницу в байты одностраничного PDF.
+    target_pagesize None - выходная страница того же размера, что исходная.
+    """
+    target_pagesize = target_pagesize or page_size
+    buffer = io.BytesIO()
+    doc_canvas = canvas.Canvas(buffer, pagesize=target_pagesize)
+    draw_layout_page(doc_canvas, texts, bboxes, labels, page_size, target_pagesize, debug_draw_bbox_borders)
+    doc_canvas.save()
+    return buffer.getvalue()
+
+
+def _render_page_args(args):
+    return render_page(*args)
+
+
+def merge_pages(page_pdfs, output_pdf_filename):
+    """
+    Склеивает одностраничные PDF (байты) в один файл.
+    """
+    writer = PdfWriter()
+    for page_pdf in page_pdfs:
+        writer.add_page(PdfReader(io.BytesIO(page_pdf)).pages[0])
+    with open(output_pdf_filename, "wb") as f:
+        writer.write(f)
+
+
+class PageRenderer:
+    """
+    workers: размер пула процессов (None - по числу ядер); 0 - рендер в текущем процессе
+    min_parallel_pages: документы короче рендерятся без пула
+    max_pending: сколько документов может одновременно ждать в пуле (ограничивает память)
+    """
+    def __init__(self, workers=RENDER_WORKERS, min_parallel_pages=RENDER_MIN_PARALLEL_PAGES,
+                 max_pending=RENDER_MAX_PENDING):
+        self.workers = workers
+        self.min_parallel_pages = min_parallel_pages
+        self.max_pending = max(1, max_pending)
+        self.executor = None
+
+    @property
+    def parallel(self):
+        return self.workers != 0
+
+    def _get_executor(self):
+        if self.executor is None:
+            # spawn: воркеры не наследуют CUDA-контекст основного процесса
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    def submit(self, fn, *args):
+        """
+        Отдаёт задачу в пул (fn должна быть функцией уровня модуля).
+        Возвращает (future, пул): по пулу close_broken узнаёт, не пересоздан ли он уже.
+        """
+        executor = self._get_executor()
+        return executor.submit(fn, *args), executor
+
+    def close_broken(self, executor):
+        """
+        После BrokenProcessPool: закрывает пул, если он ещё текущий; следующая задача создаст новый.
+        """
+        if executor is self.executor:
+            self.close()
+
+    @staticmethod
+    def run_isolated(fn, *args):
+        """
+        Выполняет fn в отдельном одноразовом процессе. Так повторяют задачи упавшего пула:
+        процесс снова уронит только та, что виновата.
+        """
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return executor.submit(fn, *args).result()
+
+    def render_pages(self, page_jobs):
+        """
+        page_jobs - аргументы render_page для каждой страницы; возвращает байты страниц по порядку.
+        """
+        if not self.parallel or len(page_jobs) < self.min_parallel_pages:
+            return [render_page(*job) for job in page_jobs]
+        executor = self._get_executor()
+        # Крупными кусками, чтобы на страницу не приходилось по отдельной пересылке
+        chunksize = max(1, len(page_jobs) // ((self.workers or os.cpu_count() or 1) * 4))
+        return list(executor.map(_render_page_args, page_jobs, chunksize=chunksize))
+
+    def render_document(self, texts, bboxes, labels, pages, page_sizes, output_pdf_filename,
+                        target_pdf_pagesize=None, debug_draw_bbox_borders=False):
+        """
+        Рендерит документ постранично: pages - номер страницы каждого сегмента,
+        page_sizes - исходный размер каждой страницы (пустые страницы тоже попадают в выход).
+        """
+        if not (len(texts) == len(bboxes) == len(labels) == len(pages)):
+            raise ValueError("Списки текстов, bbox, ID меток и страниц должны быть одинаковой длины.")
+        page_jobs = [
+            (page_texts, page_bboxes, page_labels, page_size, target_pdf_pagesize, debug_draw_bbox_borders)
+            for (page_texts, page_bboxes, page_labels), page_size
+            in zip(split_by_page(texts, bboxes, labels, pages, len(page_sizes)), page_sizes)
+        ]
+        merge_pages(self.render_pages(page_jobs), output_pdf_filename)
+        logger.info("PDF файл '%s' (%d стр.) успешно сгенерирован.", output_pdf_filename, len(page_jobs))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
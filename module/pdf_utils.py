@@ -1,89 +1,298 @@
 from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ContentStream
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import Paragraph, Frame
 from reportlab.lib.styles import ParagraphStyle
 import os
+import logging
+from module.config import PDF_MIN_TEXT_CHARS, PDF_SCAN_IMAGE_COVERAGE, PDF_SCAN_MAX_TEXT_COVERAGE
+
+
+# Типы страниц для маршрутизации
+PAGE_TEXT = "text"        # есть текстовый слой - берём текст из него
+PAGE_SCANNED = "scanned"  # только картинка - растеризация, layout и OCR
+PAGE_EMPTY = "empty"      # ни текста, ни картинок - пропускаем
+
+logger = logging.getLogger(__name__)
+
+# Средняя ширина символа в долях кегля: точные метрики шрифтов PDF не разбираем,
+# для bbox текстового блока этого достаточно
+AVG_CHAR_WIDTH = 0.5
+
+# Глубина вложенности Form XObject при подсчёте картинок (защита от циклических ссылок)
+MAX_FORM_DEPTH = 8
+
+
+def _bbox_rotation(rotation, width, height):
+    """
+    Функция, переводящая bbox (от левого верхнего угла неповёрнутой страницы width x height)
+    в координаты страницы, повёрнутой по часовой стрелке на rotation градусов (/Rotate).
+    """
+    rotation %= 360
+    if rotation == 90:
+        return lambda bbox: [height - bbox[3], bbox[0], height - bbox[1], bbox[2]]
+    if rotation == 180:
+        return lambda bbox: [width - bbox[2], height - bbox[3], width - bbox[0], height - bbox[1]]
+    if rotation == 270:
+        return lambda bbox: [bbox[1], width - bbox[2], bbox[3], width - bbox[0]]
+    return lambda bbox: bbox
+
+
+def _mult(m, n):
+    """Произведение матриц PDF [a, b, c, d, e, f]."""
+    return [
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+
+class PdfDocument:
+    """
+    PDF, который парсится один раз.
+
+    Число страниц, размеры, признак скана и текст с bbox по страницам
+    берутся из одного PdfReader; текст каждой страницы извлекается
+    лениво при первом обращении и кэшируется.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.reader = PdfReader(filepath)
+        self._pages_text = {}
+        self._image_areas = {}
+
+    @property
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def page_size(self, page_num=0):
+        """
+        Видимый размер страницы в пунктах, как её растеризует PyMuPDF: cropbox с учётом /Rotate.
+        """
+        page = self.reader.pages[page_num]
+        width, height = page.cropbox.width, page.cropbox.height
+        if page.rotation % 180 == 90:
+            return height, width
+        return width, height
+
+    @property
+    def page_sizes(self):
+        return [self.page_size(page_num) for page_num in range(self.page_count)]
+
+    def page_text_and_bboxes(self, page_num=0):
+        """
+        Extract text and bounding boxes from a PDF page.
+
+        Args:
+            page_num (int): Page number to extract from (0-indexed)
+
+        Returns:
+            tuple: (list of texts, list of bounding boxes [x0, y0, x1, y1], origin at top-left)
+        """
+        if page_num >= self.page_count:
+            raise ValueError(f"Page {page_num} does not exist in PDF with {self.page_count} pages")
+
+        if page_num not in self._pages_text:
+            self._pages_text[page_num] = self._extract_page(page_num)
+        return self._pages_text[page_num]
+
+    def _extract_page(self, page_num):
+        page = self.reader.pages[page_num]
+
+        # Координаты от левого верхнего угла cropbox (видимой области), затем поворот /Rotate
+        cropbox = page.cropbox
+        page_left = float(cropbox.left)
+        page_top = float(cropbox.top)
+        rotate = _bbox_rotation(page.rotation, float(cropbox.width), float(cropbox.height))
+
+        texts = []
+        bboxes = []
+
+        def visitor_text(text, cm, tm, font_dict, font_size):
+            if not text.strip():
+                return
+            matrix = _mult(tm, cm)
+            x0 = matrix[4] - page_left
+            y_baseline = matrix[5]
+            size = font_size * ((matrix[2] ** 2 + matrix[3] ** 2) ** 0.5 or 1)
+
+            lines = text.strip("\n").split("\n")
+            width = max(len(line) for line in lines) * size * AVG_CHAR_WIDTH
+            # Convert PDF coordinates (origin at bottom-left) to standard coordinates (origin at top-left)
+            top = page_top - (y_baseline + size)
+            bbox = [x0, top, x0 + width, top + size * len(lines)]
+
+            texts.append(text.strip())
+            bboxes.append(rotate(bbox))
+
+        page.extract_text(visitor_text=visitor_text)
+        return texts, bboxes
+
+    def page_image_area(self, page_num=0):
+        """
+        Площадь страницы под картинками (в кв. пунктах): XObject-картинки, inline-картинки
+        (BI/ID/EI) и картинки внутри Form XObject. Считается лениво, отдельным проходом
+        по content stream: текстовым страницам он не нужен.
+        None - content stream не разобрался.
+        """
+        if page_num not in self._image_areas:
+            page = self.reader.pages[page_num]
+            try:
+                contents = page.get_contents()
+                area = 0.0
+                if contents is not None:
+                    resources = page.get("/Resources")
+                    area = self._image_area(contents.operations, resources.get_object() if resources else {},
+                                            [1, 0, 0, 1, 0, 0])
+            except Exception as e:
+                logger.warning("Не удалось разобрать content stream страницы %d (%s): %s",
+                               page_num, self.filepath, e)
+                area = None
+            self._image_areas[page_num] = area
+        return self._image_areas[page_num]
+
+    def _image_area(self, operations, resources, matrix, depth=0):
+        # Картинка - единичный квадрат, растянутый текущей матрицей: площадь = |det|
+        area = 0.0
+        stack = []
+        xobjects = resources.get("/XObject")
+        xobjects = xobjects.get_object() if xobjects else {}
+        for operands, operator in operations:
+            if operator == b"q":
+                stack.append(matrix)
+            elif operator == b"Q":
+                if stack:
+                    matrix = stack.pop()
+            elif operator == b"cm":
+                matrix = _mult([float(value) for value in operands], matrix)
+            elif operator == b"INLINE IMAGE":
+                area += abs(matrix[0] * matrix[3] - matrix[1] * matrix[2])
+            elif operator == b"Do" and operands:
+                xobject = xobjects.get(operands[0])
+                if xobject is None:
+                    continue
+                xobject = xobject.get_object()
+                subtype = xobject.get("/Subtype")
+                if subtype == "/Image":
+                    area += abs(matrix[0] * matrix[3] - matrix[1] * matrix[2])
+                elif subtype == "/Form" and depth < MAX_FORM_DEPTH:
+                    # Скан часто лежит внутри формы: её матрица и свои ресурсы (или ресурсы страницы)
+                    form_matrix = [float(value) for value in xobject.get("/Matrix", [1, 0, 0, 1, 0, 0])]
+                    form_resources = xobject.get("/Resources")
+                    form_resources = form_resources.get_object() if form_resources else resources
+                    area += self._image_area(ContentStream(xobject, self.reader).operations, form_resources,
+                                             _mult(form_matrix, matrix), depth + 1)
+        return area
+
+    def page_text(self, page_num=0):
+        return "".join(self.page_text_and_bboxes(page_num)[0])
+
+    def page_stats(self, page_num=0):
+        """
+        Признаки страницы: число символов текстового слоя, доля площади под текстом
+        и под картинками (image_coverage None - content stream не разобрался).
+        """
+        stats = self._text_stats(page_num)
+        image_area = self.page_image_area(page_num)
+        stats["image_coverage"] = None if image_area is None else min(1.0, image_area / self._page_area(page_num))
+        return stats
+
+    def _page_area(self, page_num):
+        width, height = self.page_size(page_num)
+        return float(width) * float(height) or 1.0
+
+    def _text_stats(self, page_num):
+        texts, bboxes = self.page_text_and_bboxes(page_num)
+        text_area = sum(max(0, x1 - x0) * max(0, y1 - y0) for x0, y0, x1, y1 in bboxes)
+        return {
+            "text_chars": sum(len(text.strip()) for text in texts),
+            "text_coverage": min(1.0, text_area / self._page_area(page_num)),
+        }
+
+    def page_kind(self, page_num=0):
+        """
+        Классифицирует страницу: PAGE_TEXT, PAGE_SCANNED или PAGE_EMPTY.
+        Сканом считается страница почти без текста, либо картинка на всю страницу
+        с текстовым слоем, покрывающим малую её часть.
+        Страница без текста, чей content stream не разобрался, считается сканом:
+        лучше лишний OCR, чем потерянная страница.
+        """
+        stats = self._text_stats(page_num)
+        if stats["text_chars"] >= PDF_MIN_TEXT_CHARS and stats["text_coverage"] >= PDF_SCAN_MAX_TEXT_COVERAGE:
+            # Плотный текстовый слой - картинки можно не считать
+            return PAGE_TEXT
+        stats = self.page_stats(page_num)
+        if stats["text_chars"] < PDF_MIN_TEXT_CHARS:
+            return PAGE_SCANNED if stats["image_coverage"] is None or stats["image_coverage"] > 0 else PAGE_EMPTY
+        if stats["image_coverage"] is None:
+            return PAGE_TEXT
+        if (stats["image_coverage"] >= PDF_SCAN_IMAGE_COVERAGE and
+                stats["text_coverage"] < PDF_SCAN_MAX_TEXT_COVERAGE):
+            return PAGE_SCANNED
+        return PAGE_TEXT
+
+    def page_kinds(self):
+        return [self.page_kind(page_num) for page_num in range(self.page_count)]
+
+    def is_scanned(self):
+        """
+        True, если в документе нет страниц с текстовым слоем, но есть сканы.
+        """
+        kinds = self.page_kinds()
+        return PAGE_SCANNED in kinds and PAGE_TEXT not in kinds
+
+    def extract_all_pages_text_and_bboxes(self):
+        """
+        Returns:
+            tuple: (list of page texts, list of page bounding boxes)
+        """
+        all_texts = []
+        all_bboxes = []
+        for page_num in range(self.page_count):
+            texts, bboxes = self.page_text_and_bboxes(page_num)
+            all_texts.append(texts)
+            all_bboxes.append(bboxes)
+        return all_texts, all_bboxes
 
 
 def check_scanned_pdf(filepath):
-    reader = PdfReader(filepath)
-    if len(reader.pages) == 1 and reader.pages[0].extract_text() == "":
-        return True
-    return False
+    return PdfDocument(filepath).is_scanned()
 
 def get_pdf_pages_count(filepath):
-    reader = PdfReader(filepath)
-    return len(reader.pages)
+    return PdfDocument(filepath).page_count
 
 def get_pdf_page_size(filepath):
-    reader = PdfReader(filepath)
-    return reader.pages[0].mediabox.width, reader.pages[0].mediabox.height  
+    return PdfDocument(filepath).page_size(0)
 
 def get_pdf_page_text_and_bboxes(filepath, page_num=0):
     """
     Extract text and bounding boxes from a PDF page.
-    
+    Для нескольких страниц одного файла используйте PdfDocument, чтобы не парсить его заново.
+
     Args:
         filepath (str): Path to the PDF file
         page_num (int): Page number to extract from (0-indexed)
-        
+
     Returns:
         tuple: (list of texts, list of bounding boxes)
     """
-    reader = PdfReader(filepath)
-    if page_num >= len(reader.pages):
-        raise ValueError(f"Page {page_num} does not exist in PDF with {len(reader.pages)} pages")
-        
-    page = reader.pages[page_num]
-    
-    # Get page dimensions
-    page_width = float(page.mediabox.width)
-    page_height = float(page.mediabox.height)
-    
-    # Extract text with layout information
-    texts = []
-    bboxes = []
-    
-    # Extract text from the page
-    text_elements = page.extract_text(extraction_mode="layout")
-    
-    # Get text extraction objects with bbox information
-    if hasattr(page, "/Resources") and "/Font" in page["/Resources"]:
-        for obj in page.get_text_extraction_objects():
-            if "text" in obj and len(obj["text"].strip()) > 0:
-                text = obj["text"]
-                
-                # Get bounding box coordinates and normalize to page dimensions
-                x0, y0, x1, y1 = obj.get("bbox", (0, 0, 0, 0))
-                # Convert PDF coordinates (origin at bottom-left) to standard coordinates (origin at top-left)
-                bbox = [x0, page_height - y1, x1, page_height - y0]
-                
-                texts.append(text)
-                bboxes.append(bbox)
-    
-    return texts, bboxes
+    return PdfDocument(filepath).page_text_and_bboxes(page_num)
 
 def extract_all_pdf_pages_text_and_bboxes(filepath):
     """
     Extract text and bounding boxes from all pages of a PDF.
-    
+
     Args:
         filepath (str): Path to the PDF file
-        
+
     Returns:
         tuple: (list of page texts, list of page bounding boxes)
     """
-    reader = PdfReader(filepath)
-    all_texts = []
-    all_bboxes = []
-    
-    for page_num in range(len(reader.pages)):
-        texts, bboxes = get_pdf_page_text_and_bboxes(filepath, page_num)
-        all_texts.append(texts)
-        all_bboxes.append(bboxes)
-    
-    return all_texts, all_bboxes
+    return PdfDocument(filepath).extract_all_pages_text_and_bboxes()
 
 def create_pdf_from_text_and_bboxes(
     texts_list, 
@@ -159,7 +368,7 @@ def create_pdf_from_text_and_bboxes(
             frame.addFromList([paragraph], c)
                 
         except Exception as e:
-            print(f"Error adding text '{text[:20]}...' to frame: {e}")
+            logger.warning("Error adding text '%.20s...' to frame: %s", text, e)
             
             # Draw an empty frame to show the error location if debug is enabled
             if debug_draw_borders:
@@ -0,0 +1,516 @@
+"""
+Пайплайн обработки документов: layout -> OCR -> анонимизация -> LLM -> рендер.
+
+Каждый документ описывается словарём (как раньше в main.data_list):
+    file, path, texts, bboxes, labels, anonymized_texts, rephrased_texts, ...
+У PDF ещё pages (номер страницы каждого сегмента) и page_sizes (размер каждой страницы),
+у DOCX - element_paths (путь элемента каждого текста для записи, см. module.docx_xml).
+
+Функции этого модуля работают с одним документом, поэтому их можно
+вызывать как по всему корпусу сразу (batch-режим), так и потоком
+(stream_documents), не держа в памяти картинки всего корпуса.
+"""
+import os
+import logging
+import time
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+
+from module.anonymize import anonymize_texts
+from module.checkpoint import stage_done
+from module.config import id2label, OUTPUT_DIR, PIPELINE_WINDOW, LAYOUT_BATCH_SIZE
+from module.doc_reader import extract_document_data
+from module.docx_writer import rewrite_docx
+from module.helper import filter_contained_boxes
+from module.metrics import DISABLED
+from module.page_render import PageRenderer
+from module.pdf_gen import generate_pdf_from_layout_data
+from module.pdf_utils import PdfDocument, PAGE_TEXT, PAGE_SCANNED
+from module.rasterize import Rasterizer
+
+TEXT_DOCUMENT_EXTENSIONS = ('.docx', '.rtf')
+
+logger = logging.getLogger(__name__)
+
+
+def list_documents(data_path):
+    """
+    Возвращает пути ко всем файлам в папке с данными.
+    """
+    return [os.path.join(data_path, file) for file in sorted(os.listdir(data_path))]
+
+
+def open_document(file_path, checkpoints=None, output_dir=OUTPUT_DIR):
+    """
+    Заготовка документа: из чекпоинтов (до последнего готового этапа, data['stage'])
+    или пустая, если чекпоинты отключены.
+    """
+    if checkpoints is None:
+        return {'file': os.path.basename(file_path), 'path': file_path, 'stage': None}
+    return checkpoints.restore(file_path, output_dir)
+
+
+def pending(docs, stage):
+    """
+    Документы, для которых этап stage ещё не выполнен.
+    """
+    return [data for data in docs if not stage_done(data, stage)]
+
+
+def save_checkpoints(docs, stage, checkpoints=None):
+    if checkpoints is not None:
+        checkpoints.save_many(docs, stage)
+    return docs
+
+
+def load_document(file_path, layout, rasterizer=None):
+    """
+    Первый этап: разбор файла в словарь документа.
+
+    Для сканов и картинок запускает детекцию layout (картинки остаются в словаре
+    до OCR), для текстовых PDF/DOCX/RTF сразу извлекает тексты.
+    """
+    file = os.path.basename(file_path)
+    data = {'file': file, 'path': file_path}
+
+    if file.endswith('.pdf'):
+        # Один разбор PDF на все проверки и извлечение текста
+        pdf = PdfDocument(file_path)
+        page_kinds = pdf.page_kinds()
+        scanned_pages = [page_num for page_num, kind in enumerate(page_kinds) if kind == PAGE_SCANNED]
+        logger.info("Processing PDF: %s (scanned pages: %d of %d)", file, len(scanned_pages), pdf.page_count)
+
+        pdf_pages_data = {}
+        for page_num, kind in enumerate(page_kinds):
+            if kind != PAGE_TEXT:
+                continue
+            # Страницы с текстовым слоем: текст и bbox (в пунктах) прямо из PDF
+            texts, bboxes = pdf.page_text_and_bboxes(page_num)
+            pdf_pages_data[page_num] = {
+                'page_num': page_num,
+                'kind': kind,
+                'texts': list(texts),
+                'bboxes': list(bboxes),
+                'labels': [id2label["9"]] * len(texts)
+            }
+        if scanned_pages:
+            # Только страницы-картинки идут в растеризацию, layout и (позже) OCR
+            for page_data in detect_scanned_pages(file_path, scanned_pages, layout, rasterizer):
+                pdf_pages_data[page_data['page_num']] = page_data
+
+        data['pdf_pages'] = [pdf_pages_data[page_num] for page_num in sorted(pdf_pages_data)]
+        data['is_scanned_pdf'] = bool(scanned_pages)
+        data['pdf_page_count'] = pdf.page_count
+        # PDF без страниц: размер по умолчанию, чтобы запись не падала
+        first_page_size = pdf.page_size(0) if pdf.page_count else A4
+        data['pdf_page_size'] = first_page_size
+        data['page_size'] = first_page_size
+        data['page_sizes'] = [(float(width), float(height)) for width, height in pdf.page_sizes]
+        if not scanned_pages:
+            merge_pdf_pages(data)
+
+    elif file.endswith(TEXT_DOCUMENT_EXTENSIONS):
+        data_doc = extract_document_data(file_path)
+        data['texts'] = data_doc['texts']
+        data['labels'] = data_doc['labels']
+        data['bboxes'] = data_doc['bboxes']
+        if 'element_paths' in data_doc:
+            data['element_paths'] = data_doc['element_paths']
+        data['page_size'] = A4
+
+    else:
+        # Process image files
+        img = Image.open(file_path).convert("RGB")
+        bboxes, labels = layout.detect_layout(img)
+        bboxes, labels = filter_contained_boxes(bboxes, labels)
+
+        data['bboxes'] = bboxes
+        data['labels'] = labels
+        data['img'] = img
+        data['page_size'] = img.size
+
+    return data
+
+
+def detect_scanned_pages(file_path, page_nums, layout, rasterizer=None):
+    """
+    Растеризует страницы page_nums и прогоняет их через layout батчами.
+    Пул rasterizer рендерит следующие страницы, пока layout занят текущим батчем.
+    bbox'ы остаются в пикселях картинки, 'scale' - пикселей на пункт PDF.
+    """
+    if rasterizer is None:
+        rasterizer = Rasterizer(workers=0)
+
+    pages_data = []
+    batch = []
+
+    def flush():
+        # Страницы идут в DETR одним батчем
+        page_layouts = layout.detect_layout_batch([img for _, img in batch], batch_size=LAYOUT_BATCH_SIZE)
+        for (page_num, img), (bboxes, labels) in zip(batch, page_layouts):
+            bboxes, labels = filter_contained_boxes(bboxes, labels)
+            pages_data.append({
+                'page_num': page_num,
+                'kind': PAGE_SCANNED,
+                'img': img,
+                'scale': rasterizer.scale,
+                'bboxes': bboxes,
+                'labels': labels
+            })
+        batch.clear()
+
+    for page_num, img in rasterizer.iter_pages(file_path, page_nums):
+        batch.append((page_num, img))
+        if len(batch) == LAYOUT_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    return pages_data
+
+
+def merge_pdf_pages(data):
+    """
+    Собирает тексты всех страниц PDF в общие списки документа.
+    bbox'ы сканов переводятся из пикселей в пункты, как у текстового слоя,
+    номер страницы каждого сегмента - в data['pages'].
+    """
+    all_texts = []
+    all_bboxes = []
+    all_labels = []
+    all_pages = []
+    for page_data in data.pop('pdf_pages'):
+        bboxes = page_data['bboxes']
+        if page_data['kind'] == PAGE_SCANNED:
+            scale = page_data['scale']
+            bboxes = [[coord / scale for coord in bbox] for bbox in bboxes]
+        all_texts.extend(page_data['texts'])
+        all_bboxes.extend(bboxes)
+        all_labels.extend(page_data['labels'])
+        all_pages.extend([page_data['page_num']] * len(page_data['texts']))
+
+    data['texts'] = all_texts
+    data['bboxes'] = all_bboxes
+    data['labels'] = all_labels
+    data['pages'] = all_pages
+    return data
+
+
+def document_pages(data):
+    # Картинка и DOCX/RTF считаются одной страницей
+    return data.get('pdf_page_count', 1)
+
+
+def needs_ocr(data):
+    # Картинка, восстановленная из чекпоинта layout, ещё без 'img' (см. restore_images), но и без текстов
+    return 'pdf_pages' in data or 'texts' not in data
+
+
+def ocr_document(data, ocr):
+    """
+    Второй этап: OCR всех найденных регионов сканов и картинок.
+    Документы без картинок (текстовые PDF, DOCX, RTF) не трогает.
+    """
+    if not needs_ocr(data):
+        return data
+
+    if 'pdf_pages' in data:
+        for page_data in data['pdf_pages']:
+            if page_data['kind'] != PAGE_SCANNED:
+                continue
+            img = page_data['img']
+            crops = [img.crop(bbox) for bbox in page_data['bboxes']]
+            page_data['texts'] = ocr.ocr_batch(crops, page_data['labels'])
+        merge_pdf_pages(data)
+    else:
+        img = data['img']
+        bboxes = data['bboxes']
+        data['texts'] = ocr.ocr_batch([img.crop(bbox) for bbox in bboxes], data['labels'])
+
+    return data
+
+
+def restore_images(data, rasterizer=None):
+    """
+    Картинки в чекпоинт layout не попадают: если документ восстановлен после layout,
+    страницы-сканы рендерятся (а картинка открывается) заново перед OCR.
+    """
+    if 'pdf_pages' in data:
+        pages = [page_data for page_data in data['pdf_pages']
+                 if page_data['kind'] == PAGE_SCANNED and 'img' not in page_data]
+        if pages:
+            if rasterizer is None:
+                rasterizer = Rasterizer(workers=0)
+            images = dict(rasterizer.iter_pages(data['path'], [page_data['page_num'] for page_data in pages]))
+            for page_data in pages:
+                page_data['img'] = images[page_data['page_num']]
+    elif 'texts' not in data and 'img' not in data:
+        data['img'] = Image.open(data['path']).convert("RGB")
+    return data
+
+
+def release_images(data):
+    """
+    Удаляет из документа отрендеренные страницы: после OCR они больше не нужны.
+    """
+    data.pop('img', None)
+    for page_data in data.get('pdf_pages', []):
+        page_data.pop('img', None)
+    return data
+
+
+def anonymize_document(data, anonymizer=None):
+    if anonymizer is None:
+        data['anonymized_texts'] = anonymize_texts(data['texts'])
+    else:
+        data['anonymized_texts'] = anonymizer.anonymize_texts(data['texts'])
+    return data
+
+
+def anonymize_documents(docs, anonymizer):
+    """
+    Анонимизирует тексты нескольких документов одним вызовом anonymizer
+    (ParallelAnonymizer раздаёт их по ядрам) и раскладывает результат обратно.
+    """
+    flat_texts = []
+    for data in docs:
+        flat_texts.extend(data['texts'])
+
+    anonymized_texts = anonymizer.anonymize_texts(flat_texts)
+
+    offset = 0
+    for data in docs:
+        count = len(data['texts'])
+        data['anonymized_texts'] = anonymized_texts[offset:offset + count]
+        offset += count
+    return docs
+
+
+def rephrase_documents(docs, llm):
+    """
+    Перефразирует тексты нескольких документов одним потоком запросов к LLM,
+    чтобы vLLM видел весь батч, и раскладывает результат обратно по документам.
+    """
+    rephrased = llm.generate_corpus([data['anonymized_texts'] for data in docs])
+    for data, rephrased_texts in zip(docs, rephrased):
+        data['rephrased_texts'] = rephrased_texts
+    return docs
+
+
+def write_document(data, output_dir=OUTPUT_DIR, renderer=None):
+    """
+    Последний этап: сохраняет документ с перефразированным текстом в output_dir.
+    PDF рендерится постранично (renderer - PageRenderer, без него - в текущем процессе),
+    каждая страница своего исходного размера.
+    """
+    file = data['file']
+    os.makedirs(output_dir, exist_ok=True)
+
+    if file.endswith('.docx'):
+        # Потоковая перезапись XML, картинки и прочие части копируются без пересжатия
+        output_path = os.path.join(output_dir, f"nibba_{file}")
+        rewrite_docx(data['path'], output_path, data['rephrased_texts'], data['element_paths'])
+    else:
+        output_path = os.path.join(output_dir, f"nibba_{file}.pdf")
+        if 'pages' in data and 'page_sizes' in data:
+            if renderer is None:
+                renderer = PageRenderer(workers=0)
+            renderer.render_document(
+                texts=data['rephrased_texts'],
+                bboxes=data['bboxes'],
+                labels=data['labels'],
+                pages=data['pages'],
+                page_sizes=data['page_sizes'],
+                output_pdf_filename=output_path,
+                debug_draw_bbox_borders=True
+            )
+        else:
+            # Картинки и RTF - одна страница
+            generate_pdf_from_layout_data(
+                texts_list=data['rephrased_texts'],
+                bboxes_list=data['bboxes'],
+                label_ids_list=data['labels'],
+                original_page_size=data.get('page_size', A4),
+                output_pdf_filename=output_path,
+                target_pdf_pagesize=A4,
+                debug_draw_bbox_borders=True
+            )
+    data['output_path'] = output_path
+    return data
+
+
+# Поля документа, нужные write_document: только они пересылаются в воркер пула
+WRITE_FIELDS = ('file', 'path', 'rephrased_texts', 'bboxes', 'labels', 'pages', 'page_sizes', 'page_size',
+                'element_paths')
+
+
+def write_payload(data):
+    return {field: data[field] for field in WRITE_FIELDS if field in data}
+
+
+def _write_job(data, output_dir):
+    # Выполняется в воркере пула: страницы рисуются последовательно, вложенного пула нет
+    start = time.perf_counter()
+    output_path = write_document(data, output_dir)['output_path']
+    return output_path, time.perf_counter() - start
+
+
+def _write_failed(data, error):
+    logger.error("Не удалось записать %s: %s: %s", data['file'], type(error).__name__, error)
+    data['write_error'] = f"{type(error).__name__}: {error}"
+    return data
+
+
+def write_documents(docs, output_dir=OUTPUT_DIR, renderer=None, metrics=DISABLED):
+    """
+    Генератор: пишет документы (уже записанные пропускает) и отдаёт их в исходном порядке.
+
+    С renderer (PageRenderer с пулом) короткие документы пишутся в воркерах целиком,
+    в пуле одновременно не больше renderer.max_pending документов, поэтому память
+    не растёт с корпусом. Длинные (от renderer.min_parallel_pages страниц) пишутся
+    здесь, а их страницы расходятся по тому же пулу.
+    Ошибка одного документа не останавливает остальные: у него появляется
+    data['write_error'], а output_path не выставляется.
+    Если воркер умирает (например, по памяти), ломаются все задачи пула: каждый документ
+    из упавшего пула повторяется один в отдельном процессе (PageRenderer.run_isolated),
+    и write_error получает только тот, что роняет процесс снова.
+    """
+    parallel = renderer is not None and renderer.parallel
+    max_pending = renderer.max_pending if parallel else 1
+    queue = deque()  # (data, future, пул); future None - документ уже готов
+
+    def written(data, output_path, seconds):
+        data['output_path'] = output_path
+        data.pop('write_error', None)
+        metrics.record("write", seconds, document=data['file'], items=len(data['rephrased_texts']))
+        return data
+
+    def retry_isolated(data, payload):
+        logger.warning("Пул рендера упал, %s повторяется в отдельном процессе", data['file'])
+        try:
+            return written(data, *renderer.run_isolated(_write_job, payload, output_dir))
+        except Exception as e:
+            return _write_failed(data, e)
+
+    def finish(data, future, executor):
+        if future is None:
+            return data
+        try:
+            return written(data, *future.result())
+        except BrokenProcessPool:
+            # Пул пересоздаётся при следующей задаче
+            renderer.close_broken(executor)
+            return retry_isolated(data, write_payload(data))
+        except Exception as e:
+            return _write_failed(data, e)
+
+    for data in docs:
+        if stage_done(data, "write"):
+            queue.append((data, None, None))
+        elif parallel and document_pages(data) < renderer.min_parallel_pages:
+            try:
+                queue.append((data, *renderer.submit(_write_job, write_payload(data), output_dir)))
+            except BrokenProcessPool:
+                # Пул уже сломан задачей, которая ещё в очереди: пересоздаём и отдаём документ новому
+                renderer.close()
+                queue.append((data, *renderer.submit(_write_job, write_payload(data), output_dir)))
+        else:
+            try:
+                with metrics.stage("write", document=data['file'], items=len(data['rephrased_texts'])):
+                    write_document(data, output_dir, renderer)
+                data.pop('write_error', None)
+            except BrokenProcessPool:
+                # Страницы этого документа были в упавшем пуле
+                renderer.close()
+                retry_isolated(data, write_payload(data))
+            except Exception as e:
+                _write_failed(data, e)
+            queue.append((data, None, None))
+        # Отдаём готовые по порядку; если в пуле уже max_pending документов - ждём первый
+        while queue and (queue[0][1] is None or queue[0][1].done() or len(queue) > max_pending):
+            yield finish(*queue.popleft())
+    while queue:
+        yield finish(*queue.popleft())
+
+
+# --- Потоковый режим ---
+
+def _layout_stage(file_paths, layout, rasterizer, checkpoints=None, output_dir=OUTPUT_DIR, metrics=DISABLED):
+    for file_path in file_paths:
+        data = open_document(file_path, checkpoints, output_dir)
+        if not stage_done(data, "layout"):
+            with metrics.stage("layout", document=data['file']) as record:
+                data.update(load_document(file_path, layout, rasterizer))
+                record["items"] = document_pages(data)
+            save_checkpoints([data], "layout", checkpoints)
+        yield data
+
+
+def _ocr_stage(docs, ocr, rasterizer=None, checkpoints=None, metrics=DISABLED):
+    for data in docs:
+        if not stage_done(data, "ocr"):
+            with metrics.stage("ocr", document=data['file']) as record:
+                restore_images(data, rasterizer)
+                ocr_document(data, ocr)
+                record["items"] = len(data['texts'])
+            save_checkpoints([data], "ocr", checkpoints)
+        # Картинки освобождаем сразу после OCR, дальше по пайплайну идут только тексты
+        yield release_images(data)
+
+
+def _anonymize_stage(docs, anonymizer, checkpoints=None, metrics=DISABLED):
+    for data in docs:
+        if not stage_done(data, "anonymize"):
+            with metrics.stage("anonymize", document=data['file'], items=len(data['texts'])):
+                anonymize_document(data, anonymizer)
+            save_checkpoints([data], "anonymize", checkpoints)
+        yield data
+
+
+def _rephrase_stage(docs, llm, window, checkpoints=None, metrics=DISABLED):
+    # Копим не больше window документов, чтобы LLM работал батчами,
+    # но память не росла вместе с корпусом.
+    while True:
+        chunk = list(islice(docs, window))
+        if not chunk:
+            return
+        todo = pending(chunk, "rephrase")
+        if todo:
+            with metrics.stage("rephrase", items=sum(len(data['anonymized_texts']) for data in todo)):
+                rephrase_documents(todo, llm)
+            save_checkpoints(todo, "rephrase", checkpoints)
+        yield from chunk
+
+
+def _write_stage(docs, output_dir, checkpoints=None, metrics=DISABLED, renderer=None):
+    for data in write_documents(docs, output_dir, renderer, metrics):
+        if not stage_done(data, "write") and 'write_error' not in data:
+            save_checkpoints([data], "write", checkpoints)
+        yield data
+
+
+def stream_documents(file_paths, layout, ocr, llm, window=PIPELINE_WINDOW, output_dir=OUTPUT_DIR,
+                     anonymizer=None, rasterizer=None, checkpoints=None, metrics=None, renderer=None):
+    """
+    Потоковый пайплайн: документы по одному проходят layout и OCR,
+    затем окнами по window документов идут через LLM и сразу пишутся в output_dir.
+
+    Генераторы этапов ленивые, поэтому одновременно в памяти находится
+    не больше одного документа с картинками и window документов с текстами.
+    С checkpoints (CheckpointStore) готовые этапы берутся с диска, а новые сохраняются.
+    metrics (Metrics) получает время каждого этапа по каждому документу.
+    renderer (PageRenderer) рендерит страницы выходных PDF в пуле.
+    Возвращает генератор готовых документов (уже сохранённых).
+    """
+    if window < 1:
+        raise ValueError("window должен быть положительным.")
+    metrics = metrics if metrics is not None else DISABLED
+
+    docs = _layout_stage(file_paths, layout, rasterizer, checkpoints, output_dir, metrics)
+    docs = _ocr_stage(docs, ocr, rasterizer, checkpoints, metrics)
+    docs = _anonymize_stage(docs, anonymizer, checkpoints, metrics)
+    docs = _rephrase_stage(docs, llm, window, checkpoints, metrics)
+    return _write_stage(docs, output_dir, checkpoints, metrics, renderer)
@@ -0,0 +1,152 @@
+"""
+Растеризация страниц PDF в пуле потоков/процессов с упреждением.
+
+Rasterizer.iter_pages отдаёт страницы по порядку, а пул тем временем рендерит
+следующие (не больше prefetch штук вперёд). Пока layout считает батч на GPU,
+следующие страницы уже готовятся на CPU.
+"""
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from module.config import RASTER_DPI, RASTER_COLORSPACE, RASTER_WORKERS, RASTER_PREFETCH, RASTER_EXECUTOR
+
+# colorspace -> (цветовое пространство PyMuPDF, режим PIL)
+COLORSPACES = {
+    "rgb": (fitz.csRGB, "RGB"),
+    "gray": (fitz.csGRAY, "L"),
+}
+
+# Открытые документы воркеров пула, чтобы не открывать файл на каждую страницу:
+# _local.documents - {id потока: (документ, путь)}, задаётся _init_worker
+_local = threading.local()
+
+
+def _init_worker(documents):
+    # Пул потоков получает словарь своего Rasterizer (он закрывает документы в close),
+    # процесс - свою копию: документы закрываются вместе с процессом
+    _local.documents = documents
+
+
+def _get_document(file_path):
+    documents = _local.documents
+    thread_id = threading.get_ident()
+    doc, doc_path = documents.get(thread_id, (None, None))
+    if doc is None or doc_path != file_path:
+        if doc is not None:
+            doc.close()
+        doc = fitz.open(file_path)
+        documents[thread_id] = (doc, file_path)
+    return doc
+
+
+def _render(doc, page_num, dpi, colorspace):
+    fitz_colorspace, mode = COLORSPACES[colorspace]
+    pix = doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz_colorspace,
+                                             alpha=False)
+    return mode, pix.width, pix.height, pix.samples
+
+
+def render_page(file_path, page_num, dpi=RASTER_DPI, colorspace=RASTER_COLORSPACE):
+    """
+    Рендерит одну страницу в воркере пула. Возвращает (mode, width, height, samples),
+    чтобы результат можно было передать из процесса без PIL-объектов.
+    """
+    return _render(_get_document(file_path), page_num, dpi, colorspace)
+
+
+class Rasterizer:
+    """
+    dpi: разрешение рендера
+    colorspace: "rgb" или "gray" (для layout хватает серого, картинка в 3 раза меньше)
+    workers: размер пула; 0 - рендер в текущем потоке без пула
+    prefetch: сколько страниц можно отрендерить вперёд
+    executor: "process" (MuPDF держит GIL, поэтому по умолчанию процессы) или "thread"
+    """
+    def __init__(self, dpi=RASTER_DPI, colorspace=RASTER_COLORSPACE, workers=RASTER_WORKERS,
+                 prefetch=RASTER_PREFETCH, executor=RASTER_EXECUTOR):
+        if colorspace not in COLORSPACES:
+            raise ValueError(f"Неизвестное цветовое пространство: {colorspace}")
+        if executor not in ("process", "thread"):
+            raise ValueError(f"Неизвестный тип пула: {executor}")
+        self.dpi = dpi
+        self.colorspace = colorspace
+        self.workers = workers
+        self.prefetch = max(1, prefetch)
+        self.executor_type = executor
+        self.executor = None
+        # Документы, открытые потоками пула (для пула процессов остаётся пустым)
+        self.documents = {}
+
+    @property
+    def scale(self):
+        """Пикселей на пункт PDF."""
+        return self.dpi / 72
+
+    def _get_executor(self):
+        if self.executor is None:
+            if self.executor_type == "process":
+                # spawn: воркеры не наследуют CUDA-контекст основного процесса
+                self.executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker, initargs=({},)
+                )
+            else:
+                self.executor = ThreadPoolExecutor(self.workers, initializer=_init_worker,
+                                                   initargs=(self.documents,))
+        return self.executor
+
+    def iter_pages(self, file_path, page_nums):
+        """
+        Генератор (page_num, PIL.Image) в порядке page_nums.
+        """
+        if self.workers <= 0:
+            # Без пула документ открыт только на время обхода
+            with fitz.open(file_path) as doc:
+                for page_num in page_nums:
+                    mode, width, height, samples = _render(doc, page_num, self.dpi, self.colorspace)
+                    yield page_num, Image.frombytes(mode, (width, height), samples)
+            return
+
+        executor = self._get_executor()
+        page_iter = iter(page_nums)
+        pending = deque()
+
+        def submit_next():
+            for page_num in page_iter:
+                future = executor.submit(render_page, file_path, page_num, self.dpi, self.colorspace)
+                pending.append((page_num, future))
+                return
+
+        for _ in range(self.prefetch):
+            submit_next()
+
+        try:
+            while pending:
+                page_num, future = pending.popleft()
+                mode, width, height, samples = future.result()
+                # Освободилось место в окне упреждения - ставим следующую страницу
+                submit_next()
+                yield page_num, Image.frombytes(mode, (width, height), samples)
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        # Потоки пула завершились - закрываем их документы
+        for doc, _ in self.documents.values():
+            doc.close()
+        self.documents.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,395 @@
+"""
+Локальный сервис обработки документов: HTTP на localhost, очередь заданий
+с приоритетом "сначала короткие" и модели, загруженные один раз на всё время работы.
+
+    python -m module.service --port 8765
+
+    POST /jobs?name=scan.pdf      тело - файл; ответ {"id": ..., "status": "queued", "cost": ...}
+    POST /jobs                    {"path": "doc.pdf"} - файл внутри SERVICE_INPUT_ROOT на этой машине
+    GET  /jobs                    все задания
+    GET  /jobs/<id>               статус задания
+    GET  /jobs/<id>/result        готовый документ (409, пока не готов)
+    GET  /health, GET /metrics    состояние и метрики этапов в формате Prometheus
+
+Приоритет задания - оценка его стоимости (страницы и сегменты, см. estimate_job):
+одностраничная загрузка не ждёт 500-страничный скан. Ожидание снижает приоритет
+на SERVICE_AGING_PER_SECOND в секунду, поэтому большой скан тоже дождётся своей очереди.
+Воркер берёт из очереди
+до SERVICE_MAX_BATCH самых коротких заданий и прогоняет их одной пачкой run_batch,
+чтобы LLM видел их сегменты вместе. Загруженный файл удаляется, когда задание
+завершилось (готово или упало), и при остановке сервиса.
+"""
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from module.anonymize import ParallelAnonymizer
+from module.config import (
+    SERVICE_HOST,
+    SERVICE_PORT,
+    SERVICE_UPLOAD_DIR,
+    SERVICE_INPUT_ROOT,
+    SERVICE_OUTPUT_DIR,
+    SERVICE_MAX_BATCH,
+    SERVICE_SCAN_PAGE_COST,
+    SERVICE_TEXT_PAGE_COST,
+    SERVICE_SEGMENT_COST,
+    SERVICE_AGING_PER_SECOND,
+)
+from module.doc_reader import extract_document_data
+from module.metrics import Metrics, setup_logging
+from module.models import ModelManager
+from module.page_render import PageRenderer
+from module.pdf_utils import PdfDocument, PAGE_SCANNED
+from module.pipeline import TEXT_DOCUMENT_EXTENSIONS
+from module.rasterize import Rasterizer
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def estimate_job(file_path):
+    """
+    Дешёвая оценка работы: (страниц, сегментов, стоимость).
+    Скан дороже текстовой страницы - его ждут layout и OCR.
+    """
+    file = os.path.basename(file_path).lower()
+    if file.endswith('.pdf'):
+        kinds = PdfDocument(file_path).page_kinds()
+        scanned = sum(kind == PAGE_SCANNED for kind in kinds)
+        cost = scanned * SERVICE_SCAN_PAGE_COST + (len(kinds) - scanned) * SERVICE_TEXT_PAGE_COST
+        return len(kinds), None, cost
+    if file.endswith(TEXT_DOCUMENT_EXTENSIONS):
+        segments = len(extract_document_data(file_path).get('texts', []))
+        return 1, segments, segments * SERVICE_SEGMENT_COST
+    # Картинка - одна страница-скан
+    return 1, None, SERVICE_SCAN_PAGE_COST
+
+
+class JobQueue:
+    """
+    Очередь с приоритетом по стоимости (heapq) со старением; при равном приоритете -
+    по порядку поступления.
+
+    Эффективная стоимость - cost - aging * (время ожидания). Все задания стареют одинаково,
+    поэтому порядок задаёт неизменный ключ cost + aging * (время поступления) и куча не пересчитывается.
+    """
+    def __init__(self, aging=SERVICE_AGING_PER_SECOND):
+        self.aging = aging
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.started = time.monotonic()
+
+    def put(self, cost, job_id):
+        priority = cost + self.aging * (time.monotonic() - self.started)
+        with self.condition:
+            heapq.heappush(self.heap, (priority, next(self.counter), job_id))
+            self.condition.notify()
+
+    def get_batch(self, max_items):
+        """
+        Ждёт хотя бы одно задание и забирает до max_items самых дешёвых.
+        Пустой список - очередь закрыта.
+        """
+        with self.condition:
+            while not self.heap and not self.closed:
+                self.condition.wait()
+            batch = []
+            while self.heap and len(batch) < max_items:
+                batch.append(heapq.heappop(self.heap)[2])
+            return batch
+
+    def __len__(self):
+        with self.condition:
+            return len(self.heap)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class JobService:
+    """
+    Задания, очередь и воркер с тёплыми моделями.
+    manager - ModelManager (для проверки без GPU - с фабриками-заглушками).
+    """
+    def __init__(self, manager=None, output_dir=SERVICE_OUTPUT_DIR, upload_dir=SERVICE_UPLOAD_DIR,
+                 max_batch=SERVICE_MAX_BATCH, checkpoints=None, metrics=None, input_root=SERVICE_INPUT_ROOT):
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.manager = manager if manager is not None else ModelManager(metrics=self.metrics)
+        self.output_dir = output_dir
+        self.upload_dir = upload_dir
+        self.input_root = input_root
+        self.max_batch = max_batch
+        self.checkpoints = checkpoints
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = JobQueue()
+        self.anonymizer = ParallelAnonymizer()
+        self.rasterizer = Rasterizer()
+        self.renderer = PageRenderer()
+        self.worker = threading.Thread(target=self._work, name="job-worker", daemon=True)
+        os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+
+    def start(self):
+        self.worker.start()
+        return self
+
+    def submit_file(self, name, stream, length):
+        """
+        Сохраняет загруженный файл и ставит его в очередь.
+        """
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.upload_dir, f"{job_id}_{os.path.basename(name)}")
+        with open(path, "wb") as f:
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        return self._enqueue(job_id, name, path)
+
+    def submit_path(self, source_path):
+        """
+        Ставит в очередь файл, уже лежащий на этой машине внутри input_root (копируется в upload_dir).
+        """
+        if not isinstance(source_path, str) or not source_path:
+            raise ValueError("path должен быть непустой строкой")
+        if not self.input_root:
+            raise ValueError("Задания по пути отключены (SERVICE_INPUT_ROOT = None)")
+        # realpath раскрывает ".." и симлинки: файл должен действительно лежать внутри input_root
+        root = os.path.realpath(self.input_root)
+        source_path = os.path.realpath(os.path.join(root, source_path))
+        if os.path.commonpath([root, source_path]) != root:
+            raise ValueError(f"Путь вне {self.input_root}")
+        if not os.path.isfile(source_path):
+            raise ValueError(f"Файл не найден: {source_path}")
+        job_id = uuid.uuid4().hex
+        name = os.path.basename(source_path)
+        path = os.path.join(self.upload_dir, f"{job_id}_{name}")
+        shutil.copyfile(source_path, path)
+        return self._enqueue(job_id, name, path)
+
+    def _enqueue(self, job_id, name, path):
+        try:
+            pages, segments, cost = estimate_job(path)
+        except Exception as e:
+            os.remove(path)
+            raise ValueError(f"Не удалось прочитать {name}: {e}") from e
+        job = {
+            'id': job_id, 'name': name, 'path': path, 'status': QUEUED,
+            'pages': pages, 'segments': segments, 'cost': cost,
+            'submitted': time.time(), 'started': None, 'finished': None,
+            'output_path': None, 'error': None,
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+        self.queue.put(cost, job_id)
+        logger.info("Задание %s (%s): страниц %s, стоимость %s, в очереди %d", job_id, name, pages, cost,
+                    len(self.queue))
+        return dict(job)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def _finish(self, job_id, **fields):
+        """
+        Переводит задание в конечное состояние (DONE/FAILED) и удаляет его загруженный файл:
+        результат уже в output_dir, а иначе загрузки копились бы в upload_dir.
+        """
+        self._update(job_id, **fields)
+        self._remove_upload(self.get(job_id)['path'])
+
+    @staticmethod
+    def _remove_upload(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _work(self):
+        while True:
+            batch = self.queue.get_batch(self.max_batch)
+            if not batch:
+                return
+            self._run(batch)
+
+    def _run(self, job_ids):
+        # Импорт здесь: main импортирует этот модуль для режима "service"
+        from main import run_batch
+
+        now = time.time()
+        for job_id in job_ids:
+            self._update(job_id, status=RUNNING, started=now)
+        paths = [self.get(job_id)['path'] for job_id in job_ids]
+        try:
+            docs = run_batch(paths, self.output_dir, manager=self.manager, checkpoints=self.checkpoints,
+                             metrics=self.metrics, anonymizer=self.anonymizer, rasterizer=self.rasterizer,
+                             renderer=self.renderer)
+        except Exception:
+            if len(job_ids) == 1:
+                logger.exception("Задание %s завершилось с ошибкой", job_ids[0])
+                self._finish(job_ids[0], status=FAILED, finished=time.time(), error=self._last_error())
+                return
+            # Одно сломанное задание не должно валить остальные из пачки
+            logger.warning("Пачка из %d заданий упала, запускаем их по одному", len(job_ids))
+            for job_id in job_ids:
+                self._run([job_id])
+            return
+        finished = time.time()
+        for job_id, data in zip(job_ids, docs):
+            if 'write_error' in data:
+                self._finish(job_id, status=FAILED, finished=finished, error=data['write_error'])
+                continue
+            self._finish(job_id, status=DONE, finished=finished, output_path=data['output_path'])
+            logger.info("Задание %s готово: %s", job_id, data['output_path'])
+
+    @staticmethod
+    def _last_error():
+        exc = sys.exc_info()[1]
+        return f"{type(exc).__name__}: {exc}"
+
+    def close(self):
+        self.queue.close()
+        if self.worker.is_alive():
+            self.worker.join()
+        self.anonymizer.close()
+        self.rasterizer.close()
+        self.renderer.close()
+        self.manager.close()
+        self.metrics.close()
+        # Задания, не дошедшие до воркера, пропадают вместе с сервисом - их загрузки тоже
+        for job in self.list():
+            if job['status'] not in (DONE, FAILED):
+                self._remove_upload(job['path'])
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    # self.server.service - JobService
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(path)}"')
+        self.end_headers()
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "not found"})
+        service = self.server.service
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("ожидается JSON-объект {\"path\": ...}")
+                job = service.submit_path(request["path"])
+            else:
+                name = parse_qs(url.query).get("name", [None])[0] or self.headers.get("X-Filename")
+                if not name:
+                    return self._send_json(400, {"error": "укажите имя файла: ?name=... или X-Filename"})
+                job = service.submit_file(name, self.rfile, length)
+        except (ValueError, KeyError) as e:
+            return self._send_json(400, {"error": str(e)})
+        self._send_json(202, job)
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if parts == ["health"]:
+            return self._send_json(200, {"status": "ok", "queued": len(service.queue),
+                                         "models": service.manager.loaded_names()})
+        if parts == ["metrics"]:
+            body = service.metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if parts == ["jobs"]:
+            return self._send_json(200, service.list())
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = service.get(parts[1])
+            if job is None:
+                return self._send_json(404, {"error": "задание не найдено"})
+            if len(parts) == 2:
+                return self._send_json(200, job)
+            if parts[2] == "result":
+                if job['status'] != DONE:
+                    return self._send_json(409, {"error": f"задание в статусе {job['status']}"})
+                return self._send_file(job['output_path'])
+        self._send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_server(service, host=SERVICE_HOST, port=SERVICE_PORT):
+    server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.service = service
+    return server
+
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, service=None):
+    service = (service or JobService()).start()
+    server = make_server(service, host, port)
+    logger.info("Сервис слушает http://%s:%d", host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный сервис обработки документов")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+    setup_logging()
+    serve(args.host, args.port)
@@ -0,0 +1,214 @@
+"""
+Вписывание текста в bbox для pdf_gen.
+
+Вместо Paragraph.wrapOn с уменьшением шрифта на 10% до пяти раз:
+  - ширина каждого слова меряется один раз (при кегле 1, с кэшем на шрифт):
+    ширина при кегле s - это просто ширина * s;
+  - наибольший кегль, при котором текст влезает в bbox, ищется бинарным поиском,
+    каждая проба - жадный перенос по готовым ширинам без reportlab;
+  - строки рисуются прямо на canvas, без Frame/Paragraph.
+
+Текст рисуется как есть (не как разметка Paragraph), поэтому "<" и "&" в тексте
+больше не ломают элемент.
+"""
+from functools import lru_cache
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+MIN_FONT_SIZE = 4
+# Межстрочный интервал (в долях кегля), когда шрифт уменьшен относительно стиля
+SHRINK_LEADING_RATIO = 1.2
+# Точность бинарного поиска кегля, пункты
+FONT_SIZE_PRECISION = 0.1
+ELLIPSIS = "..."
+
+ALIGN_LEFT = 0
+ALIGN_CENTER = 1
+ALIGN_RIGHT = 2
+ALIGN_JUSTIFY = 4
+
+
+@lru_cache(maxsize=200_000)
+def text_width(text, font_name):
+    """
+    Ширина строки при кегле 1 (ширина при кегле s - text_width * s).
+    """
+    return stringWidth(text, font_name, 1.0)
+
+
+class TextLayout:
+    """
+    Результат вписывания: кегль, интервал, строки (списки слов) и их ширины при кегле 1.
+    fits - False, если текст не влез даже при min_size и обрезан.
+    """
+    __slots__ = ("font_size", "leading", "lines", "line_widths", "fits")
+
+    def __init__(self, font_size, leading, lines, line_widths, fits):
+        self.font_size = font_size
+        self.leading = leading
+        self.lines = lines
+        self.line_widths = line_widths
+        self.fits = fits
+
+
+def _split_long_word(word, font_name, max_units):
+    """
+    Режет слово шире строки на куски по символам.
+    """
+    pieces = []
+    current = ""
+    current_width = 0.0
+    for ch in word:
+        ch_width = text_width(ch, font_name)
+        if current and current_width + ch_width > max_units:
+            pieces.append(current)
+            current = ""
+            current_width = 0.0
+        current += ch
+        current_width += ch_width
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def wrap_words(words, widths, space_width, max_units, font_name, max_lines=None):
+    """
+    Жадный перенос: words с ширинами widths (кегль 1) в строки не шире max_units.
+    Возвращает (строки, ширины строк); max_lines - остановиться, набрав столько строк + 1.
+    """
+    lines = []
+    line_widths = []
+    current = []
+    current_width = 0.0
+    for word, width in zip(words, widths):
+        if width > max_units:
+            # Слово само шире строки - режем по символам
+            pieces = _split_long_word(word, font_name, max_units)
+            piece_widths = [text_width(piece, font_name) for piece in pieces]
+        else:
+            pieces = (word,)
+            piece_widths = (width,)
+        for piece, piece_width in zip(pieces, piece_widths):
+            if current and current_width + space_width + piece_width > max_units:
+                lines.append(current)
+                line_widths.append(current_width)
+                if max_lines is not None and len(lines) > max_lines:
+                    return lines, line_widths
+                current = []
+                current_width = 0.0
+            if current:
+                current_width += space_width
+            current.append(piece)
+            current_width += piece_width
+    if current:
+        lines.append(current)
+        line_widths.append(current_width)
+    return lines, line_widths
+
+
+def fit_text(text, font_name, width, height, max_size, leading_ratio, min_size=MIN_FONT_SIZE,
+             precision=FONT_SIZE_PRECISION):
+    """
+    Наибольший кегль из [min_size, max_size], при котором text влезает в width x height.
+    При кегле стиля (max_size) интервал - leading_ratio, при уменьшенном - SHRINK_LEADING_RATIO.
+    """
+    words = text.split()
+    widths = [text_width(word, font_name) for word in words]
+    space_width = text_width(" ", font_name)
+    min_size = min(min_size, max_size)
+
+    def leading_for(size):
+        return size * (leading_ratio if size >= max_size else min(leading_ratio, SHRINK_LEADING_RATIO))
+
+    def try_size(size):
+        leading = leading_for(size)
+        max_lines = int(height / leading)
+        lines, line_widths = wrap_words(words, widths, space_width, width / size, font_name, max_lines)
+        return lines, line_widths, leading, len(lines) <= max_lines
+
+    lines, line_widths, leading, fits = try_size(max_size)
+    if fits:
+        return TextLayout(max_size, leading, lines, line_widths, True)
+
+    best = None
+    low, high = min_size, max_size
+    while high - low > precision:
+        size = (low + high) / 2
+        candidate = try_size(size)
+        if candidate[3]:
+            best = (size, candidate)
+            low = size
+        else:
+            high = size
+    if best is None:
+        candidate = try_size(min_size)
+        if candidate[3]:
+            best = (min_size, candidate)
+    if best is not None:
+        size, (lines, line_widths, leading, _) = best
+        return TextLayout(size, leading, lines, line_widths, True)
+
+    # Не влезает даже при min_size: оставляем строки, которые помещаются, последнюю - с многоточием
+    size = min_size
+    leading = leading_for(size)
+    max_lines = max(1, int(height / leading))
+    lines, line_widths = wrap_words(words, widths, space_width, width / size, font_name)
+    lines = lines[:max_lines]
+    line_widths = line_widths[:max_lines]
+    last = " ".join(lines[-1]) if lines else ""
+    last = last[:ellipsis_cut(last, font_name, width / size)] + ELLIPSIS
+    lines[-1:] = [[last]]
+    line_widths[-1:] = [stringWidth(last, font_name, 1.0)]
+    return TextLayout(size, leading, lines, line_widths, False)
+
+
+def ellipsis_cut(text, font_name, max_units):
+    """
+    Длина наибольшего префикса text, который с многоточием влезает в max_units.
+    Двоичный поиск, ширины - напрямую через stringWidth: одноразовые префиксы
+    не должны вытеснять из кэша text_width слова, которые повторяются.
+    """
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if stringWidth(text[:middle] + ELLIPSIS, font_name, 1.0) <= max_units:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def draw_text_layout(doc_canvas, layout, x, top, width, font_name, alignment=ALIGN_LEFT, color=None):
+    """
+    Рисует строки layout в колонке шириной width; top - верхний край текста.
+    Весь блок - один текстовый объект: drawString на каждую строку (и тем более слово)
+    заметно дороже.
+    """
+    size = layout.font_size
+    space_width = text_width(" ", font_name) * size
+    text = doc_canvas.beginText()
+    text.setFont(font_name, size, layout.leading)
+    if color is not None:
+        text.setFillColor(color)
+    baseline = top - size
+    last_index = len(layout.lines) - 1
+    for index, (words, units) in enumerate(zip(layout.lines, layout.line_widths)):
+        line_width = units * size
+        if alignment == ALIGN_JUSTIFY and index < last_index and len(words) > 1:
+            # Растягиваем пробелы так, чтобы строка заняла всю ширину
+            gap = space_width + (width - line_width) / (len(words) - 1)
+            cursor = x
+            for word in words:
+                text.setTextOrigin(cursor, baseline)
+                text.textOut(word)
+                cursor += text_width(word, font_name) * size + gap
+        else:
+            if alignment == ALIGN_CENTER:
+                text.setTextOrigin(x + (width - line_width) / 2, baseline)
+            elif alignment == ALIGN_RIGHT:
+                text.setTextOrigin(x + width - line_width, baseline)
+            else:
+                text.setTextOrigin(x, baseline)
+            text.textOut(" ".join(words))
+        baseline -= layout.leading
+    doc_canvas.drawText(text)
@@ -0,0 +1,57 @@
+import zipfile
+
+import docx
+import pytest
+
+from module import docx_writer
+from module.doc_reader import extract_from_docx
+
+
+def make_docx(path):
+    document = docx.Document()
+    document.sections[0].header.paragraphs[0].text = "Шапка"
+    document.add_paragraph("Первый абзац")
+    table = document.add_table(rows=2, cols=2)
+    for index, cell in enumerate(table._cells):
+        cell.text = f"ячейка {index}"
+    document.add_paragraph("Последний абзац")
+    document.save(path)
+    # Член без сжатия: метод должен сохраниться при копировании
+    with zipfile.ZipFile(path, "a") as archive:
+        archive.writestr(zipfile.ZipInfo("word/media/image1.png"), b"\x89PNG" + bytes(range(256)) * 4,
+                         compress_type=zipfile.ZIP_STORED)
+
+
+@pytest.mark.parametrize("raw", [True, False])
+def test_rewrite_docx_round_trip(tmp_path, monkeypatch, raw):
+    if raw and not docx_writer.RAW_COPY_SUPPORTED:
+        pytest.skip("zipfile этой версии Python не поддерживает копирование сжатыми байтами")
+    monkeypatch.setattr(docx_writer, "RAW_COPY_SUPPORTED", raw)
+    used = []
+    for name in ("copy_member_raw", "copy_member_recompressed"):
+        original = getattr(docx_writer, name)
+        monkeypatch.setattr(docx_writer, name,
+                            lambda *args, name=name, original=original: (used.append(name), original(*args))[1])
+
+    source = tmp_path / "in.docx"
+    output = tmp_path / "out.docx"
+    make_docx(source)
+    data = extract_from_docx(source)
+    texts = [text.upper() for text in data["texts"]]
+    docx_writer.rewrite_docx(source, output, texts, data["element_paths"])
+
+    assert set(used) == {"copy_member_raw" if raw else "copy_member_recompressed"}
+    result = extract_from_docx(output)
+    assert result["texts"] == texts
+    assert result["element_paths"] == data["element_paths"]
+
+    rewritten = {docx_writer.parse_element_path(path)[0] for path in data["element_paths"]}
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(output) as zout:
+        assert zout.testzip() is None
+        assert zout.namelist() == zin.namelist()
+        for info in zin.infolist():
+            if info.filename in rewritten:
+                continue
+            copied = zout.getinfo(info.filename)
+            assert copied.compress_type == info.compress_type
+            assert zout.read(info.filename) == zin.read(info.filename)